@@ -40,6 +40,7 @@ logging.getLogger("mitmproxy.server").setLevel(logging.CRITICAL)
 
 from routes import auth_bp, chat_bp, admin_bp, settings_bp, utcp_bp
 from routes.browser import browser_bp
+from services.host_whitelist import DEFAULT_AI_API_WHITELIST
 
 _ROOT = Path(__file__).resolve().parent
 CONFIG_PATH = _ROOT / "config.json"
@@ -184,6 +185,30 @@ def load_config():
             cfg["weknora_memory_kb_id"] = ""
         if "weknora_memory_max_recent_turns" not in cfg:
             cfg["weknora_memory_max_recent_turns"] = 20
+        if "proxy_cache_enabled" not in cfg:
+            cfg["proxy_cache_enabled"] = False
+        if "proxy_cache_ttl_seconds" not in cfg:
+            cfg["proxy_cache_ttl_seconds"] = 300
+        if "proxy_cache_memory_mb" not in cfg:
+            cfg["proxy_cache_memory_mb"] = 64
+        if "proxy_cache_disk_mb" not in cfg:
+            cfg["proxy_cache_disk_mb"] = 512
+        if "ai_api_whitelist" not in cfg:
+            cfg["ai_api_whitelist"] = list(DEFAULT_AI_API_WHITELIST)
+        if "proxy_stream_large_bodies" not in cfg:
+            cfg["proxy_stream_large_bodies"] = ""
+        if "proxy_body_size_limit" not in cfg:
+            cfg["proxy_body_size_limit"] = ""
+        if "proxy_http2" not in cfg:
+            cfg["proxy_http2"] = True
+        if "proxy_http2_ping_keepalive" not in cfg:
+            cfg["proxy_http2_ping_keepalive"] = 58
+        if "proxy_connection_strategy" not in cfg:
+            cfg["proxy_connection_strategy"] = "eager"
+        if "proxy_ignore_hosts" not in cfg:
+            cfg["proxy_ignore_hosts"] = []
+        if "proxy_auth_sessions" not in cfg:
+            cfg["proxy_auth_sessions"] = False
         return cfg
     _env_safe = os.environ.get("SafeMode", "false").strip().lower() in ("1", "true", "yes")
     _env_debug = os.environ.get("DebugMode", "false").strip().lower() in ("1", "true", "yes")
@@ -208,6 +233,18 @@ def load_config():
         "weknora_memory_enabled": False,
         "weknora_memory_kb_id": "",
         "weknora_memory_max_recent_turns": 20,
+        "proxy_cache_enabled": False,
+        "proxy_cache_ttl_seconds": 300,
+        "proxy_cache_memory_mb": 64,
+        "proxy_cache_disk_mb": 512,
+        "ai_api_whitelist": list(DEFAULT_AI_API_WHITELIST),
+        "proxy_stream_large_bodies": "",
+        "proxy_body_size_limit": "",
+        "proxy_http2": True,
+        "proxy_http2_ping_keepalive": 58,
+        "proxy_connection_strategy": "eager",
+        "proxy_ignore_hosts": [],
+        "proxy_auth_sessions": False,
     }
 
 
@@ -246,6 +283,18 @@ def save_config(cfg):
         "weknora_memory_enabled": bool(cfg.get("weknora_memory_enabled", False)),
         "weknora_memory_kb_id": (cfg.get("weknora_memory_kb_id") or "").strip(),
         "weknora_memory_max_recent_turns": max(1, min(50, int(cfg.get("weknora_memory_max_recent_turns", 20)))),
+        "proxy_cache_enabled": bool(cfg.get("proxy_cache_enabled", False)),
+        "proxy_cache_ttl_seconds": max(1, min(7 * 86400, int(cfg.get("proxy_cache_ttl_seconds", 300)))),
+        "proxy_cache_memory_mb": max(0, min(4096, int(cfg.get("proxy_cache_memory_mb", 64)))),
+        "proxy_cache_disk_mb": max(0, min(102400, int(cfg.get("proxy_cache_disk_mb", 512)))),
+        "ai_api_whitelist": [x for x in (cfg.get("ai_api_whitelist") or []) if isinstance(x, str)],
+        "proxy_stream_large_bodies": str(cfg.get("proxy_stream_large_bodies") or "").strip(),
+        "proxy_body_size_limit": str(cfg.get("proxy_body_size_limit") or "").strip(),
+        "proxy_http2": bool(cfg.get("proxy_http2", True)),
+        "proxy_http2_ping_keepalive": max(0, min(3600, int(cfg.get("proxy_http2_ping_keepalive", 58)))),
+        "proxy_connection_strategy": "lazy" if cfg.get("proxy_connection_strategy") == "lazy" else "eager",
+        "proxy_ignore_hosts": [x for x in (cfg.get("proxy_ignore_hosts") or []) if isinstance(x, str)],
+        "proxy_auth_sessions": bool(cfg.get("proxy_auth_sessions", False)),
     }
     for p in cfg.get("providers") or []:
         if isinstance(p, dict) and p.get("id") in {m["provider_id"] for m in FIXED_PROVIDER_MODELS}:
@@ -398,13 +447,43 @@ def create_app():
     app.register_blueprint(utcp_bp, url_prefix="/api/utcp")
     _debug_log("Blueprint 已注册: utcp", _force=debug_mode)
 
-    from services import browser_packets
+    from services import browser_packets, body_store
+    body_store.set_blob_dir(_ROOT / "data" / "blobs")
     persist_path = _ROOT / "data" / "browser_packets.json"
     browser_packets.set_persist_path(persist_path)
     _debug_log("browser_packets 持久化路径已设置: %s" % persist_path, _force=debug_mode)
     browser_packets.load_packets()
     _debug_log("browser_packets 已加载", _force=debug_mode)
 
+    from services.traffic_rules import traffic_rules
+    rules_path = _ROOT / "data" / "traffic_rules.json"
+    traffic_rules.set_persist_path(rules_path)
+    _debug_log("流量规则已加载: %s 条" % traffic_rules.load_rules(), _force=debug_mode)
+
+    from services.response_cache import response_cache
+    response_cache.set_disk_dir(_ROOT / "data" / "proxy_cache")
+    response_cache.configure(
+        enabled=cfg.get("proxy_cache_enabled", False),
+        ttl_seconds=cfg.get("proxy_cache_ttl_seconds", 300),
+        memory_mb=cfg.get("proxy_cache_memory_mb", 64),
+        disk_mb=cfg.get("proxy_cache_disk_mb", 512),
+    )
+    _debug_log("代理缓存: enabled=%s" % response_cache.enabled, _force=debug_mode)
+
+    from services.host_whitelist import ai_api_whitelist
+    try:
+        ai_api_whitelist.set_entries(cfg.get("ai_api_whitelist") or [])
+    except ValueError as e:
+        _debug_log("AI API 白名单无效，使用默认值: %s" % e, _force=True)
+        ai_api_whitelist.set_entries(DEFAULT_AI_API_WHITELIST)
+
+    from services import browser_session
+    try:
+        browser_session.set_proxy_tuning(cfg)
+    except ValueError as e:
+        _debug_log("代理调优配置无效，使用默认值: %s" % e, _force=True)
+        browser_session.set_proxy_tuning({})
+
     from routes.browser import set_filter_path
     set_filter_path(_ROOT / "data" / "recorder_filter.json")
 
@@ -0,0 +1,395 @@
+# -*- coding: utf-8 -*-
+"""
+流量规则引擎基准测试：用合成 flow 测量规则匹配与代理插件钩子的单 flow 开销。
+
+模式：
+- match：只测 TrafficRuleManager.match_url / match_rules（不依赖 mitmproxy）；
+- addon：用假 flow 对象依次调用 AIInterceptorAddon 的 request / responseheaders / response 钩子；
+- e2e：本机启动 HTTP 替身服务与真实 mitmproxy 实例，经代理发送请求，并与直连对比（仅监听 127.0.0.1）。
+
+示例：
+    python bench_traffic_rules.py --mode match --flows 100000 --urls 10000 --rules 1000
+    python bench_traffic_rules.py --mode addon --rules 100 --body-sizes 0,4096,1048576
+    python bench_traffic_rules.py --mode e2e --flows 2000 --concurrency 8 --output bench_output.txt
+"""
+import argparse
+import gc
+import random
+import statistics
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from services.traffic_rules import traffic_rules
+
+_HOSTS = 200
+_WORDS = ("alpha", "bravo", "charlie", "delta", "echo", "foxtrot", "golf", "hotel")
+
+
+# ---------- 合成数据 ----------
+
+def make_urls(n, seed=1):
+    """生成 n 个不同的 URL：主机、路径层级、数字 id 与查询参数随机组合。"""
+    rnd = random.Random(seed)
+    urls = []
+    for i in range(n):
+        host = "h%d.bench.local" % rnd.randrange(_HOSTS)
+        path = "/api/v%d/%s/%d" % (rnd.randrange(1, 4), rnd.choice(_WORDS), rnd.randrange(100000))
+        query = "?page=%d&q=%s" % (rnd.randrange(50), rnd.choice(_WORDS)) if rnd.random() < 0.5 else ""
+        scheme = "https" if rnd.random() < 0.8 else "http"
+        urls.append("%s://%s%s%s" % (scheme, host, path, query) if i % 97 else "%s://%s/static/app.%d.js" % (scheme, host, i))
+    return urls
+
+
+def make_rules(n, seed=2):
+    """
+    生成 n 条规则，按比例混合：
+    40% 锚定主机（走主机分桶）、40% 非锚定路径片段（走组合正则闸门）、
+    10% 修改响应体、10% 修改请求头。
+    """
+    rnd = random.Random(seed)
+    items = []
+    for i in range(n):
+        kind = rnd.random()
+        if kind < 0.4:
+            regex = r"^https?://h%d\.bench\.local/api/v%d/" % (rnd.randrange(_HOSTS * 5), rnd.randrange(1, 4))
+            items.append({"type": "block_request", "regex": regex, "data": {}})
+        elif kind < 0.8:
+            regex = r"/%s/%d\d*$" % (rnd.choice(_WORDS), rnd.randrange(100, 100000))
+            items.append({"type": "modify_request_header", "regex": regex, "data": {"key": "X-Bench", "value": str(i)}})
+        elif kind < 0.9:
+            regex = r"h%d\.bench\.local/api" % rnd.randrange(_HOSTS)
+            old = rnd.choice(_WORDS)
+            items.append({"type": "modify_response_body", "regex": regex, "data": {"old_text": old, "new_text": old.upper()}})
+        else:
+            regex = r"page=%d&" % rnd.randrange(50)
+            items.append({"type": "modify_request_header", "regex": regex, "data": {"key": "X-Page", "value": "1"}})
+    return items
+
+
+def make_body(size, seed=3):
+    """生成约 size 字节的 JSON 风格文本 body。"""
+    if size <= 0:
+        return b""
+    rnd = random.Random(seed)
+    parts = []
+    total = 0
+    while total < size:
+        piece = '{"id":%d,"name":"%s","tag":"%s"},' % (rnd.randrange(10 ** 6), rnd.choice(_WORDS), rnd.choice(_WORDS))
+        parts.append(piece)
+        total += len(piece)
+    return ("[" + "".join(parts)[: max(0, size - 2)] + "]").encode("utf-8")
+
+
+def install_rules(n):
+    traffic_rules.clear_rules()
+    start = time.perf_counter()
+    ids, errors = traffic_rules.import_rules(make_rules(n))
+    if errors:
+        print("规则导入错误: %s" % errors[:3], file=sys.stderr)
+    return time.perf_counter() - start
+
+
+# ---------- 假 flow ----------
+
+class FakeHeaders(dict):
+    """大小写不敏感的 header 字典，覆盖插件用到的操作。"""
+
+    def __init__(self, items=None):
+        super().__init__()
+        for k, v in (items or {}).items():
+            self[k] = v
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key.lower(), value)
+
+    def __getitem__(self, key):
+        return super().__getitem__(key.lower())
+
+    def __delitem__(self, key):
+        super().__delitem__(key.lower())
+
+    def __contains__(self, key):
+        return super().__contains__(key.lower())
+
+    def get(self, key, default=None):
+        return super().get(key.lower(), default)
+
+
+class FakeRequest:
+    def __init__(self, url, method="GET"):
+        self.pretty_url = url
+        self.pretty_host = url.split("/")[2].split(":")[0]
+        self.method = method
+        self.http_version = "HTTP/1.1"
+        self.headers = FakeHeaders({"Host": url.split("/")[2], "User-Agent": "bench", "Accept": "*/*"})
+        self.raw_content = b""
+
+
+class FakeResponse:
+    def __init__(self, body: bytes, content_type="application/json"):
+        self.status_code = 200
+        self.headers = FakeHeaders({"Content-Type": content_type, "Content-Length": str(len(body))})
+        self.raw_content = body
+        self.stream = False
+
+    @property
+    def content(self):
+        return self.raw_content
+
+    def get_text(self, strict=True):
+        return self.raw_content.decode("utf-8", errors="replace")
+
+    @property
+    def text(self):
+        return self.get_text()
+
+    @text.setter
+    def text(self, value):
+        self.raw_content = value.encode("utf-8")
+        self.headers["content-length"] = str(len(self.raw_content))
+
+
+class FakeClientConn:
+    def __init__(self, conn_id):
+        self.id = conn_id
+
+
+class FakeFlow:
+    _next = 0
+
+    def __init__(self, url, body: bytes):
+        FakeFlow._next += 1
+        self.id = "bench-%d" % FakeFlow._next
+        self.request = FakeRequest(url)
+        self.response = None
+        self.metadata = {}
+        self.client_conn = FakeClientConn("bench-client")
+        self.websocket = None
+        self.is_replay = None
+        self.live = False
+        self._body = body
+        self.killed = False
+
+    def kill(self):
+        self.killed = True
+
+
+# ---------- 统计 ----------
+
+def summarize(name, samples, wall):
+    """samples 为每个 flow 的耗时（秒）。"""
+    samples = sorted(samples)
+    n = len(samples)
+
+    def pct(p):
+        return samples[min(n - 1, int(n * p))] * 1e6
+
+    return {
+        "name": name,
+        "flows": n,
+        "p50_us": pct(0.50),
+        "p90_us": pct(0.90),
+        "p99_us": pct(0.99),
+        "max_us": samples[-1] * 1e6,
+        "mean_us": statistics.fmean(samples) * 1e6,
+        "flows_per_s": n / wall if wall else 0.0,
+    }
+
+
+def format_rows(rows):
+    header = "%-40s %9s %10s %10s %10s %10s %10s %12s" % (
+        "case", "flows", "p50(us)", "p90(us)", "p99(us)", "max(us)", "mean(us)", "flows/s")
+    lines = [header, "-" * len(header)]
+    for r in rows:
+        lines.append("%-40s %9d %10.1f %10.1f %10.1f %10.1f %10.1f %12.0f" % (
+            r["name"], r["flows"], r["p50_us"], r["p90_us"], r["p99_us"], r["max_us"], r["mean_us"], r["flows_per_s"]))
+    return "\n".join(lines)
+
+
+# ---------- 模式 ----------
+
+def bench_match(args):
+    rows = []
+    urls = make_urls(args.urls)
+    for n_rules in args.rules:
+        build = install_rules(n_rules)
+        print("已安装 %d 条规则，编译耗时 %.1f ms" % (n_rules, build * 1000))
+        rnd = random.Random(4)
+        seq = [urls[rnd.randrange(len(urls))] for _ in range(args.flows)]
+        for phase in ("request", "response"):
+            samples = []
+            gc.disable()
+            wall_start = time.perf_counter()
+            for url in seq:
+                t0 = time.perf_counter()
+                traffic_rules.match_url(url, phase)
+                samples.append(time.perf_counter() - t0)
+            wall = time.perf_counter() - wall_start
+            gc.enable()
+            rows.append(summarize("match_url %s rules=%d" % (phase, n_rules), samples, wall))
+    return rows
+
+
+def bench_addon(args):
+    from services.mitm_service import AIInterceptorAddon
+
+    addon = AIInterceptorAddon()
+    rows = []
+    urls = make_urls(args.urls)
+    for n_rules in args.rules:
+        install_rules(n_rules)
+        for size in args.body_sizes:
+            body = make_body(size)
+            rnd = random.Random(5)
+            flows = min(args.flows, max(100, args.max_body_bytes // max(1, size))) if size else args.flows
+            samples = []
+            wall_start = time.perf_counter()
+            for _ in range(flows):
+                flow = FakeFlow(urls[rnd.randrange(len(urls))], body)
+                t0 = time.perf_counter()
+                addon.request(flow)
+                if not flow.killed:
+                    if flow.response is None:
+                        flow.response = FakeResponse(flow._body)
+                    addon.responseheaders(flow)
+                    if callable(flow.response.stream):
+                        # 模拟 mitmproxy 流式模式：按 64KB 分块回调，结束时以 b"" 调用一次
+                        for i in range(0, len(body), 65536):
+                            flow.response.stream(body[i:i + 65536])
+                        flow.response.stream(b"")
+                        flow.response.raw_content = None
+                    addon.response(flow)
+                samples.append(time.perf_counter() - t0)
+            wall = time.perf_counter() - wall_start
+            rows.append(summarize("addon rules=%d body=%d" % (n_rules, size), samples, wall))
+    return rows
+
+
+class _StandInHandler(BaseHTTPRequestHandler):
+    """本地 HTTP 替身：按查询参数 size 返回指定大小的 body。"""
+
+    bodies = {}
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        size = 0
+        if "size=" in self.path:
+            try:
+                size = int(self.path.split("size=", 1)[1].split("&", 1)[0])
+            except ValueError:
+                size = 0
+        body = self.bodies.get(size)
+        if body is None:
+            body = self.bodies[size] = make_body(size)
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def _free_port():
+    import socket
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _drive(session, urls, proxies, concurrency):
+    samples = [0.0] * len(urls)
+
+    def one(i):
+        t0 = time.perf_counter()
+        resp = session.get(urls[i], proxies=proxies, timeout=30)
+        resp.content
+        samples[i] = time.perf_counter() - t0
+
+    wall_start = time.perf_counter()
+    if concurrency <= 1:
+        for i in range(len(urls)):
+            one(i)
+    else:
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            list(pool.map(one, range(len(urls))))
+    return samples, time.perf_counter() - wall_start
+
+
+def bench_e2e(args):
+    import requests
+    from services.mitm_service import MitmProxyService
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _StandInHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    origin = "http://127.0.0.1:%d" % server.server_address[1]
+
+    proxy_port = _free_port()
+    proxy = MitmProxyService("127.0.0.1", proxy_port)
+    proxy.start()
+    proxies = {"http": proxy.proxy_url, "https": proxy.proxy_url}
+    session = requests.Session()
+    session.trust_env = False
+    deadline = time.time() + 15
+    while True:
+        try:
+            session.get(origin + "/ready", proxies=proxies, timeout=2)
+            break
+        except requests.RequestException:
+            if time.time() > deadline:
+                raise SystemExit("mitmproxy 未能在 15 秒内就绪")
+            time.sleep(0.2)
+
+    rows = []
+    try:
+        for n_rules in args.rules:
+            # 规则的主机是 *.bench.local，这里额外加入命中本地替身的规则，使改写路径被实际执行
+            install_rules(n_rules)
+            traffic_rules.add_rule("modify_response_body", r"^http://127\.0\.0\.1:\d+/", {"old_text": "alpha", "new_text": "ALPHA"})
+            for size in args.body_sizes:
+                n = min(args.flows, max(50, args.max_body_bytes // max(1, size))) if size else args.flows
+                urls = ["%s/api/v1/item/%d?size=%d" % (origin, i, size) for i in range(n)]
+                direct, wall = _drive(session, urls, None, args.concurrency)
+                rows.append(summarize("direct body=%d c=%d" % (size, args.concurrency), direct, wall))
+                proxied, wall = _drive(session, urls, proxies, args.concurrency)
+                rows.append(summarize("proxy rules=%d body=%d c=%d" % (n_rules, size, args.concurrency), proxied, wall))
+    finally:
+        proxy.stop()
+        server.shutdown()
+    return rows
+
+
+def _int_list(value):
+    return [int(float(x)) for x in value.split(",") if x.strip()]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="流量规则引擎基准测试")
+    parser.add_argument("--mode", choices=("match", "addon", "e2e"), default="match")
+    parser.add_argument("--flows", type=int, default=10000, help="每个用例的 flow 数")
+    parser.add_argument("--urls", type=int, default=10000, help="不同 URL 的数量（10k - 1M）")
+    parser.add_argument("--rules", type=_int_list, default=[10, 100, 1000], help="规则数，逗号分隔，如 10,1000,10000")
+    parser.add_argument("--body-sizes", type=_int_list, default=[0, 4096, 262144], help="响应 body 字节数，逗号分隔")
+    parser.add_argument("--max-body-bytes", type=int, default=512 * 1024 * 1024,
+                        help="大 body 用例的总字节上限，超出时自动减少 flow 数")
+    parser.add_argument("--concurrency", type=int, default=1, help="e2e 模式的并发请求数")
+    parser.add_argument("--output", help="结果追加写入的文件，如 bench_output.txt")
+    args = parser.parse_args(argv)
+
+    runner = {"match": bench_match, "addon": bench_addon, "e2e": bench_e2e}[args.mode]
+    rows = runner(args)
+    table = format_rows(rows)
+    print(table)
+    if args.output:
+        with open(args.output, "a", encoding="utf-8") as f:
+            f.write("# %s mode=%s flows=%d urls=%d\n%s\n\n" % (
+                time.strftime("%Y-%m-%d %H:%M:%S"), args.mode, args.flows, args.urls, table))
+    traffic_rules.clear_rules()
+
+
+if __name__ == "__main__":
+    main()
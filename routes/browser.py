@@ -3,10 +3,14 @@
 import json
 from pathlib import Path
 
-from flask import Blueprint, render_template, request, jsonify, redirect, url_for, send_file, current_app
+from flask import Blueprint, render_template, request, jsonify, redirect, url_for, send_file, current_app, Response
 
 from services import browser_packets
+from services import body_store
+from services import ws_messages
 from services import browser_session
+from services.traffic_rules import traffic_rules
+from services.response_cache import response_cache
 
 _FILTER_PATH = None  # 由应用设置，如 Path("data/recorder_filter.json")
 
@@ -94,6 +98,71 @@ def api_proxy():
     })
 
 
+@browser_bp.route("api/recorder/proxy/restart", methods=["POST"])
+def api_proxy_restart():
+    """
+    以当前设置重新配置录制代理：body 为 {"full": 可选, "drain_timeout": 可选秒数}。
+    默认在线更新选项，不断开连接；full 为 true 时排空在途请求、刷新录包队列后重启。
+    """
+    body = request.get_json(silent=True) or {}
+    try:
+        drain_timeout = max(0.0, min(120.0, float(body.get("drain_timeout") or 10)))
+    except (TypeError, ValueError):
+        drain_timeout = 10.0
+    ok, result = browser_session.restart_proxy(drain_timeout=drain_timeout, full=bool(body.get("full")))
+    if not ok:
+        _browser_debug("录制代理重启失败: %s" % result)
+        return jsonify({"ok": False, "error": result}), 500
+    _browser_debug("录制代理已重新配置: %s" % result)
+    return jsonify({"ok": True, "result": result})
+
+
+@browser_bp.route("api/recorder/proxy/metrics", methods=["GET"])
+def api_proxy_metrics():
+    """返回录制代理运行指标：活动连接、请求速率、收发字节、插件钩子耗时、事件循环延迟，以及代理缓存命中统计。"""
+    metrics = browser_session.get_proxy_metrics()
+    if metrics is None:
+        return jsonify({"running": False, "cache": response_cache.stats()})
+    return jsonify({"running": True, "metrics": metrics, "cache": response_cache.stats()})
+
+
+@browser_bp.route("api/recorder/listeners", methods=["GET"])
+def api_listeners():
+    """列出所有代理监听器：名称、端口、采集会话、规则集（global / isolated）与运行状态。"""
+    return jsonify({"listeners": browser_session.list_listeners()})
+
+
+@browser_bp.route("api/recorder/listeners", methods=["POST"])
+def api_listener_start():
+    """
+    在新端口启动命名监听器：body 为 {"name", "port", "capture_session": 可选, "isolated_rules": 默认 true}。
+    """
+    body = request.get_json(silent=True) or {}
+    ok, result = browser_session.start_listener(
+        body.get("name"), body.get("port"),
+        capture_session=(body.get("capture_session") or "").strip() or None,
+        isolated_rules=bool(body.get("isolated_rules", True)),
+    )
+    if not ok:
+        _browser_debug("监听器启动失败: %s" % result)
+        return jsonify({"ok": False, "error": result}), 400
+    _browser_debug("监听器已启动: %s port=%s" % (result["name"], result["port"]))
+    return jsonify({"ok": True, "listener": result})
+
+
+@browser_bp.route("api/recorder/listeners/<name>", methods=["DELETE"])
+def api_listener_stop(name):
+    """停止并移除监听器。"""
+    if not browser_session.stop_listener(name):
+        return jsonify({"ok": False, "error": "未找到"}), 404
+    return jsonify({"ok": True})
+
+
+def _listener_rules():
+    """按 ?listener= 取规则集，未指定时为全局规则；监听器不存在返回 None。"""
+    return browser_session.get_listener_rules(request.args.get("listener") or None)
+
+
 @browser_bp.route("api/recorder/filter", methods=["GET"])
 def recorder_filter_get():
     """返回记录器过滤器配置：enabled, addresses。"""
@@ -121,11 +190,17 @@ def recorder_filter_post():
 
 @browser_bp.route("api/browser/packets", methods=["GET", "POST"])
 def packets_list_or_clear():
-    """GET：返回录包列表（可选 url_contains, url_contains_any, limit）；POST：清空录包。"""
+    """GET：返回录包列表（可选 url_contains, url_contains_any, limit, grouped, session）；POST：清空录包（body 可含 session）。
+    grouped=1 时按 URL 模板分组返回 {"groups": [...]}，数字/UUID/哈希段归一化。
+    session 指定采集会话时只读取/清空该会话分区。"""
     if request.method == "POST":
-        browser_packets.clear_packets()
-        _browser_debug("录包已清空")
+        session = (request.get_json(silent=True) or {}).get("session")
+        browser_packets.clear_packets(session=session)
+        if not session:
+            ws_messages.clear_messages()
+        _browser_debug("录包已清空: session=%s" % (session or "全部"))
         return jsonify({"ok": True, "message": "已清空"})
+    session = request.args.get("session") or None
     url_contains = request.args.get("url_contains") or ""
     limit = request.args.get("limit", type=int) or 200
     url_contains_any = request.args.getlist("url_contains_any") or request.args.get("url_contains_any")
@@ -136,15 +211,43 @@ def packets_list_or_clear():
             url_contains_any = [s.strip() for s in url_contains_any.split(",") if s.strip()]
     if not isinstance(url_contains_any, list):
         url_contains_any = []
+    if request.args.get("grouped") in ("1", "true", "yes"):
+        groups = browser_packets.list_packet_groups(
+            url_contains=url_contains if not url_contains_any else None,
+            url_contains_any=url_contains_any if url_contains_any else None,
+            limit=limit,
+            session=session,
+        )
+        _browser_debug("录包分组列表: count=%s limit=%s" % (len(groups), limit))
+        return jsonify({"groups": groups})
     items = browser_packets.list_packets(
         url_contains=url_contains if not url_contains_any else None,
         url_contains_any=url_contains_any if url_contains_any else None,
         limit=limit,
+        session=session,
     )
     _browser_debug("录包列表: count=%s limit=%s" % (len(items), limit))
     return jsonify({"packets": items})
 
 
+@browser_bp.route("api/browser/sessions", methods=["GET"])
+def packet_sessions():
+    """返回采集会话列表及各会话录包数。"""
+    return jsonify({"sessions": browser_packets.list_sessions()})
+
+
+@browser_bp.route("api/browser/packets/search", methods=["GET"])
+def packets_search():
+    """全文检索录包头与 body（前 64KB）：q 为查询串，可选 limit、session；返回命中录包 id 及片段位置。"""
+    q = (request.args.get("q") or "").strip()
+    if not q:
+        return jsonify({"error": "缺少查询参数 q"}), 400
+    limit = request.args.get("limit", type=int) or 50
+    results = browser_packets.search_packets(q, limit=limit, session=request.args.get("session") or None)
+    _browser_debug("录包检索: q=%s count=%s" % (q, len(results)))
+    return jsonify({"results": results})
+
+
 @browser_bp.route("api/browser/packets/<packet_id>", methods=["GET"])
 def packet_detail(packet_id):
     """返回单条录包详情。"""
@@ -154,6 +257,114 @@ def packet_detail(packet_id):
     return jsonify(p)
 
 
+@browser_bp.route("api/browser/packets/<packet_id>/body", methods=["GET"])
+def packet_body(packet_id):
+    """返回录包完整 body：part=request|response（默认 response）；raw=1 时返回未解压的线上原始字节。"""
+    part = request.args.get("part") or "response"
+    raw = request.args.get("raw") in ("1", "true", "yes")
+    body = browser_packets.get_packet_body(packet_id, part=part, decode=not raw)
+    if body is None:
+        return jsonify({"error": "未找到"}), 404
+    data, ctype = body
+    headers = {}
+    if raw:
+        p = browser_packets.get_packet(packet_id) or {}
+        enc = body_store.header_value(p.get(part + "_headers"), "content-encoding")
+        if enc:
+            headers["X-Original-Content-Encoding"] = enc
+    return Response(data, mimetype=ctype or "application/octet-stream", headers=headers)
+
+
+@browser_bp.route("api/browser/ws", methods=["GET"])
+def ws_connections():
+    """返回 WebSocket 连接列表（可选 url_contains, limit, session）。"""
+    url_contains = request.args.get("url_contains") or ""
+    limit = request.args.get("limit", type=int) or 200
+    session = request.args.get("session") or None
+    return jsonify({"connections": ws_messages.list_connections(url_contains=url_contains, limit=limit, session=session)})
+
+
+@browser_bp.route("api/browser/ws/<conn_id>/frames", methods=["GET"])
+def ws_frames(conn_id):
+    """返回某 WebSocket 连接的帧列表（可选 direction, limit）。"""
+    limit = request.args.get("limit", type=int) or 200
+    frames = ws_messages.list_frames(conn_id, direction=request.args.get("direction"), limit=limit)
+    if frames is None:
+        return jsonify({"error": "未找到"}), 404
+    return jsonify({"frames": frames})
+
+
+@browser_bp.route("api/browser/ws/<conn_id>/frames/<int:frame_id>", methods=["GET"])
+def ws_frame_detail(conn_id, frame_id):
+    """返回单帧详情（文本帧含 payload_text，其他帧含 payload_base64）。"""
+    frame = ws_messages.get_frame(conn_id, frame_id)
+    if not frame:
+        return jsonify({"error": "未找到"}), 404
+    return jsonify(frame)
+
+
+@browser_bp.route("api/recorder/rules", methods=["GET"])
+def traffic_rule_stats():
+    """返回流量规则列表及每条规则的命中次数、最近命中时间、改写字节数、执行耗时，以及各阶段匹配耗时。?listener= 指定监听器。"""
+    manager = _listener_rules()
+    if manager is None:
+        return jsonify({"error": "监听器不存在"}), 404
+    rules = manager.get_rules(with_stats=True)
+    return jsonify({"rules": rules, "count": len(rules), "matching": manager.get_match_stats()})
+
+
+@browser_bp.route("api/recorder/rules/export", methods=["GET"])
+def traffic_rules_export():
+    """导出全部流量规则定义（不含运行统计），可直接用于导入。?listener= 指定监听器。"""
+    manager = _listener_rules()
+    if manager is None:
+        return jsonify({"error": "监听器不存在"}), 404
+    rules = manager.export_rules()
+    return jsonify({"rules": rules, "count": len(rules)})
+
+
+@browser_bp.route("api/recorder/rules/import", methods=["POST"])
+def traffic_rules_import():
+    """
+    批量导入流量规则：body 为 {"rules": [...], "replace": bool}，也可直接是规则数组。
+    每条规则含 type、regex、data，可选 enabled、ttl_seconds、expires_at、max_hits；非法的条目在 errors 中返回。
+    ?listener= 导入到指定监听器的规则集。
+    """
+    manager = _listener_rules()
+    if manager is None:
+        return jsonify({"error": "监听器不存在"}), 404
+    body = request.get_json(silent=True)
+    if isinstance(body, list):
+        items, replace = body, False
+    elif isinstance(body, dict) and isinstance(body.get("rules"), list):
+        items, replace = body["rules"], bool(body.get("replace"))
+    else:
+        return jsonify({"error": "须提供 rules 数组"}), 400
+    ids, errors = manager.import_rules(items, replace=replace)
+    _browser_debug("流量规则导入: imported=%s errors=%s replace=%s" % (len(ids), len(errors), replace))
+    return jsonify({"imported": len(ids), "ids": ids, "errors": errors})
+
+
+@browser_bp.route("api/recorder/rules/dry-run", methods=["POST"])
+def traffic_rules_dry_run():
+    """
+    试运行候选规则：body 为 {"rules": [...], "session": 可选, "sample_limit": 可选}，
+    返回每条规则在录包上的命中数与样例录包 id，不安装规则。
+    """
+    body = request.get_json(silent=True) or {}
+    items = body.get("rules")
+    if not isinstance(items, list) or not items:
+        return jsonify({"error": "须提供 rules 数组"}), 400
+    try:
+        sample_limit = max(1, min(100, int(body.get("sample_limit") or 10)))
+    except (TypeError, ValueError):
+        sample_limit = 10
+    packets = browser_packets.packet_urls(body.get("session") or None)
+    result = traffic_rules.dry_run(items, packets, sample_limit=sample_limit)
+    _browser_debug("流量规则试运行: rules=%s packets=%s elapsed=%sms" % (len(items), result["total_packets"], result["elapsed_ms"]))
+    return jsonify(result)
+
+
 @browser_bp.route("api/recorder/cert", methods=["GET"])
 def download_cert():
     """
@@ -338,6 +338,16 @@ def _inject_system_prompt(messages, use_utcp_tools, request_data=None):
             "只根据已有对话与历史工具结果用自然语言回答，本回合不要调用任何工具。"
             "当认为任务已经完成时，请先简要分析再给出最终报告，可在开头使用【任务完成】便于用户识别。"
         ).strip()
+    # 开启代理认证采集会话时，浏览器以对话 id 作为代理认证用户名，本对话的录包写入同名采集会话
+    conversation_id = (request_data or {}).get("conversation_id")
+    if use_utcp_tools and conversation_id and cfg.get("proxy_auth_sessions"):
+        system_prompt = (
+            system_prompt
+            + "\n\n【录包采集会话】本对话的录包采集会话为 " + str(conversation_id)
+            + "（浏览器代理设置为 http://" + str(conversation_id) + ":任意密码@127.0.0.1:8888）。"
+            "调用 list_browser_packets、search_browser_packets 等录包工具时请传 capture_session=" + str(conversation_id)
+            + "，只查询本对话的流量。"
+        ).strip()
     # 动态提示词模块：优先请求体 prompt_modules，否则用配置 system_prompt_modules
     modules = []
     if request_data and isinstance(request_data.get("prompt_modules"), list):
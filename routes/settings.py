@@ -57,6 +57,9 @@ def global_config():
     access_safe_mode = bool(cfg.get("access_safe_mode", False))
     debug_mode = bool(cfg.get("debug_mode", False))
     ai_default_language = cfg.get("ai_default_language") or "zh"
+    proxy_cache = _proxy_cache_settings(cfg)
+    ai_api_whitelist = cfg.get("ai_api_whitelist") or []
+    proxy_tuning = _proxy_tuning_settings(cfg)
     from app import DEFAULT_SYSTEM_PROMPT
     return render_template(
         "settings_global.html",
@@ -74,6 +77,9 @@ def global_config():
         access_safe_mode=access_safe_mode,
         debug_mode=debug_mode,
         ai_default_language=ai_default_language,
+        proxy_cache=proxy_cache,
+        ai_api_whitelist=ai_api_whitelist,
+        proxy_tuning=proxy_tuning,
     )
 
 
@@ -295,6 +301,110 @@ def global_system_prompt():
     return jsonify({"ok": True, "system_prompt": cfg["system_prompt"]})
 
 
+def _proxy_cache_settings(cfg):
+    return {
+        "proxy_cache_enabled": bool(cfg.get("proxy_cache_enabled", False)),
+        "proxy_cache_ttl_seconds": int(cfg.get("proxy_cache_ttl_seconds", 300)),
+        "proxy_cache_memory_mb": int(cfg.get("proxy_cache_memory_mb", 64)),
+        "proxy_cache_disk_mb": int(cfg.get("proxy_cache_disk_mb", 512)),
+    }
+
+
+@settings_bp.route("/global/api/proxy-cache", methods=["GET", "POST"])
+def global_proxy_cache():
+    """GET 返回录制代理缓存配置与命中统计；POST 保存配置并立即生效（body: proxy_cache_enabled、proxy_cache_ttl_seconds、proxy_cache_memory_mb、proxy_cache_disk_mb）"""
+    from services.response_cache import response_cache
+    load = current_app.config["CONFIG_LOADER"]
+    save = current_app.config["CONFIG_SAVER"]
+    if request.method == "GET":
+        return jsonify(dict(_proxy_cache_settings(load()), stats=response_cache.stats()))
+    data = request.get_json() or {}
+    cfg = load()
+    if "proxy_cache_enabled" in data:
+        cfg["proxy_cache_enabled"] = bool(data["proxy_cache_enabled"])
+    for key, lo, hi in (("proxy_cache_ttl_seconds", 1, 7 * 86400), ("proxy_cache_memory_mb", 0, 4096), ("proxy_cache_disk_mb", 0, 102400)):
+        if key in data:
+            try:
+                cfg[key] = max(lo, min(hi, int(data[key])))
+            except (TypeError, ValueError):
+                return jsonify({"ok": False, "error": f"{key} 须为整数"}), 400
+    save(cfg)
+    settings = _proxy_cache_settings(cfg)
+    response_cache.configure(
+        enabled=settings["proxy_cache_enabled"],
+        ttl_seconds=settings["proxy_cache_ttl_seconds"],
+        memory_mb=settings["proxy_cache_memory_mb"],
+        disk_mb=settings["proxy_cache_disk_mb"],
+    )
+    return jsonify(dict(settings, ok=True))
+
+
+@settings_bp.route("/global/api/proxy-cache/clear", methods=["POST"])
+def global_proxy_cache_clear():
+    """清空录制代理的内存与磁盘缓存"""
+    from services.response_cache import response_cache
+    response_cache.clear()
+    return jsonify({"ok": True, "message": "代理缓存已清空"})
+
+
+@settings_bp.route("/global/api/ai-whitelist", methods=["GET", "POST"])
+def global_ai_whitelist():
+    """GET 返回录制代理的 AI API 白名单；POST 保存并立即生效（body: entries 列表或按行分隔的字符串）"""
+    from services.host_whitelist import ai_api_whitelist, normalize_entries
+    load = current_app.config["CONFIG_LOADER"]
+    save = current_app.config["CONFIG_SAVER"]
+    if request.method == "GET":
+        return jsonify({"entries": ai_api_whitelist.entries})
+    data = request.get_json() or {}
+    entries = data.get("entries")
+    if isinstance(entries, str):
+        entries = entries.splitlines()
+    if not isinstance(entries, list):
+        return jsonify({"ok": False, "error": "entries 须为列表"}), 400
+    try:
+        entries = normalize_entries(entries)
+    except ValueError as e:
+        return jsonify({"ok": False, "error": str(e)}), 400
+    cfg = load()
+    cfg["ai_api_whitelist"] = entries
+    save(cfg)
+    ai_api_whitelist.set_entries(entries)
+    return jsonify({"ok": True, "entries": entries})
+
+
+def _proxy_tuning_settings(cfg):
+    from services.browser_session import PROXY_TUNING_DEFAULTS
+    return {k: cfg.get(k, v) for k, v in PROXY_TUNING_DEFAULTS.items()}
+
+
+@settings_bp.route("/global/api/proxy-tuning", methods=["GET", "POST"])
+def global_proxy_tuning():
+    """
+    GET 返回录制代理连接与缓冲选项；POST 保存，代理运行中时立即在线应用（已有连接沿用旧选项）
+    （body: proxy_stream_large_bodies、proxy_body_size_limit、proxy_http2、proxy_http2_ping_keepalive、
+    proxy_connection_strategy、proxy_ignore_hosts）
+    """
+    from services import browser_session
+    load = current_app.config["CONFIG_LOADER"]
+    save = current_app.config["CONFIG_SAVER"]
+    if request.method == "GET":
+        return jsonify(_proxy_tuning_settings(load()))
+    data = request.get_json() or {}
+    cfg = load()
+    merged = dict(_proxy_tuning_settings(cfg), **{k: v for k, v in data.items() if k in browser_session.PROXY_TUNING_DEFAULTS})
+    try:
+        tuning = browser_session.set_proxy_tuning(merged)
+    except ValueError as e:
+        return jsonify({"ok": False, "error": str(e)}), 400
+    cfg.update(tuning)
+    save(cfg)
+    applied = None
+    if browser_session.get_proxy_url():
+        ok, result = browser_session.restart_proxy()
+        applied = result if ok else {"error": result}
+    return jsonify(dict(tuning, ok=True, applied=applied))
+
+
 @settings_bp.route("/global/api/clear-uploads", methods=["POST"])
 def global_clear_uploads():
     """清空 uploads 上传目录（手动清空）。"""
@@ -0,0 +1,259 @@
+# -*- coding: utf-8 -*-
+"""
+响应体流式改写：大响应通过 mitmproxy 流式模式逐块改写，内存占用与响应大小无关。
+- 按 Content-Encoding 流式解压（gzip / deflate / br），改写后以明文（identity）转发；
+- 同一 flow 命中的多条字面量替换合并为一个前缀树正则（MultiReplacer），body 只扫描一遍；
+- 流式改写时保留最长字面量长度 - 1 的尾部到下一块，保证跨块边界的匹配不会遗漏，结果与整段替换一致；
+- 只改写文本类型的响应，二进制媒体原样转发；改写结果的前 RECORD_LIMIT 字节保留下来供录包。
+"""
+import functools
+import re
+import time
+import zlib
+
+from .body_store import header_value, charset_of, is_text
+
+try:
+    import brotli  # mitmproxy 依赖，通常已安装
+except ImportError:  # pragma: no cover
+    brotli = None
+
+# Content-Length 不超过该值的响应仍走缓冲改写（flow.response.text），更大或长度未知的走流式改写
+STREAM_THRESHOLD = 1024 * 1024
+# 压缩响应解压后的估计膨胀倍数：Content-Length 是压缩后长度，缓冲改写需要容纳解压后的全文
+COMPRESSION_RATIO = 8
+# 流式改写的响应录包时最多保留的改写后 body 前缀
+RECORD_LIMIT = 256 * 1024
+
+
+class _Decoder:
+    """单层 Content-Encoding 的流式解压器。"""
+
+    def __init__(self, encoding: str):
+        self.encoding = encoding
+        if encoding == "br":
+            self._obj = brotli.Decompressor()
+        elif encoding == "deflate":
+            self._obj = zlib.decompressobj(zlib.MAX_WBITS)
+        else:
+            self._obj = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        self._started = False
+
+    def feed(self, data: bytes) -> bytes:
+        if self.encoding == "br":
+            return self._obj.process(data)
+        try:
+            out = self._obj.decompress(data)
+        except zlib.error:
+            if self.encoding != "deflate" or self._started:
+                raise
+            # 部分服务端的 deflate 为不带 zlib 头的原始流
+            self._obj = zlib.decompressobj(-zlib.MAX_WBITS)
+            out = self._obj.decompress(data)
+        self._started = True
+        return out
+
+    def flush(self) -> bytes:
+        if self.encoding == "br":
+            return b""
+        return self._obj.flush()
+
+
+_END = object()
+
+
+def _trie_pattern(words) -> str:
+    """
+    把字面量集合构造成前缀树形状的正则：每个位置只沿一条分支前进，等价于在前缀树上行走。
+    结尾节点写成贪婪可选组，因此同一起点总是优先匹配最长的字面量。
+    """
+    root = {}
+    for w in words:
+        node = root
+        for ch in w:
+            node = node.setdefault(ch, {})
+        node[_END] = True
+
+    def build(node):
+        alts = []
+        for ch in sorted(k for k in node if k is not _END):
+            # 单分支链路直接拼接，递归深度只与分叉层数有关
+            seq = [re.escape(ch)]
+            child = node[ch]
+            while len(child) == 1 and _END not in child:
+                (nxt, child), = child.items()
+                seq.append(re.escape(nxt))
+            alts.append("".join(seq) + build(child))
+        if not alts:
+            return ""
+        body = alts[0] if len(alts) == 1 else "(?:%s)" % "|".join(alts)
+        return "(?:%s)?" % body if _END in node else body
+
+    return build(root)
+
+
+@functools.lru_cache(maxsize=256)
+def _compile_literals(olds, binary: bool):
+    """编译一组字面量（已去重）为单个正则。binary 时按 latin-1 一一映射到字节。"""
+    words = [o.decode("latin-1") for o in olds] if binary else list(olds)
+    pattern = _trie_pattern(words)
+    return re.compile(pattern.encode("latin-1") if binary else pattern)
+
+
+class MultiReplacer:
+    """
+    多条字面量替换合并为一个前缀树正则，对 body 只扫描一遍并同时完成所有替换。
+    重叠时的确定性规则：最左优先；同一起点取最长的字面量；old 相同的多条规则取最早添加的一条。
+    与逐条 replace 不同，替换结果不会再被后续规则二次匹配。
+    """
+
+    def __init__(self, replacements):
+        """replacements: [(old, new)]，同为 str 或同为 bytes，按规则顺序。"""
+        self.table = {}
+        self.counts = {}  # old -> 替换次数
+        self._olds = [old for old, _ in replacements]
+        for old, new in replacements:
+            if old and old not in self.table:
+                self.table[old] = new
+                self.counts[old] = 0
+        olds = tuple(self.table)
+        binary = bool(olds) and isinstance(olds[0], bytes)
+        self.regex = _compile_literals(olds, binary) if olds else None
+        self.max_len = max((len(o) for o in olds), default=0)
+        self._tail = olds[0][:0] if olds else b""
+
+    def replace(self, text):
+        """一次扫描替换整段 text。"""
+        if self.regex is None or not text:
+            return text
+        return self.regex.sub(self._substitute, text)
+
+    def _substitute(self, m):
+        old = m.group()
+        self.counts[old] += 1
+        return self.table[old]
+
+    def rewritten_bytes(self):
+        """按构造时的 replacements 顺序返回每条替换累计替换掉的字节数（被同 old 的前一条遮蔽的记 0）。"""
+        out = []
+        seen = set()
+        for old in self._olds:
+            if not old or old in seen:
+                out.append(0)
+                continue
+            seen.add(old)
+            size = len(old) if isinstance(old, bytes) else len(old.encode("utf-8"))
+            out.append(self.counts.get(old, 0) * size)
+        return out
+
+    def feed(self, data, final: bool = False):
+        """流式替换：保留 max_len - 1 个字符的尾部到下一块，保证跨块匹配与整段替换结果一致。"""
+        buf = self._tail + data if self._tail else data
+        if final or self.regex is None:
+            self._tail = buf[:0]
+            return self.replace(buf)
+        # 起点在 cut 之前的匹配，其所有候选字面量都完整落在 buf 内，最长匹配已可确定
+        cut = len(buf) - (self.max_len - 1)
+        out = []
+        i = 0
+        while True:
+            m = self.regex.search(buf, i)
+            if m is None or m.start() >= cut:
+                break
+            out.append(buf[i:m.start()])
+            out.append(self._substitute(m))
+            i = m.end()
+        end = max(i, cut)
+        out.append(buf[i:end])
+        self._tail = buf[end:]
+        return buf[:0].join(out)
+
+
+class StreamRewriter:
+    """
+    mitmproxy 流式回调（flow.response.stream）：每收到一块调用一次，流结束时以 b"" 调用一次。
+    返回 chunk 列表；不产生输出时返回空列表，避免 chunked 编码下误发结束块。
+    """
+
+    def __init__(self, replacements, decoder: _Decoder = None, rule_ids=None):
+        self._decoder = decoder
+        self.rule_ids = list(rule_ids or [])  # 与 replacements 一一对应的规则 id，用于统计
+        self.replacer = MultiReplacer(replacements)
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.elapsed = 0.0  # 累计解压与改写耗时（秒）
+        self.head = bytearray()  # 改写后输出的前 RECORD_LIMIT 字节，供录包
+
+    def __call__(self, data: bytes):
+        start = time.perf_counter()
+        final = not data
+        self.bytes_in += len(data)
+        if self._decoder is not None:
+            data = self._decoder.flush() if final else self._decoder.feed(data)
+        data = self.replacer.feed(data, final)
+        self.bytes_out += len(data)
+        if len(self.head) < RECORD_LIMIT:
+            self.head += data[:RECORD_LIMIT - len(self.head)]
+        self.elapsed += time.perf_counter() - start
+        return [data] if data else []
+
+
+def should_stream(response, passthrough: bool = False) -> bool:
+    """
+    是否对响应走流式改写：只处理文本类型；passthrough（已由 mitmproxy 标记流式转发）时直接流式，
+    否则在长度未知或（解压后估计）长度超过 STREAM_THRESHOLD 时流式。
+    """
+    if not is_text(header_value(response.headers, "content-type"), b""):
+        return False
+    if passthrough:
+        return True
+    try:
+        length = int(header_value(response.headers, "content-length"))
+    except ValueError:
+        return True
+    encoding = header_value(response.headers, "content-encoding").strip().lower()
+    if encoding and encoding not in ("identity", "none"):
+        length *= COMPRESSION_RATIO
+    return length > STREAM_THRESHOLD
+
+
+def build_stream_rewriter(flow, rules):
+    """
+    为 modify_response_body 规则构建流式改写回调，并把响应头改为明文、分块传输。
+    编码无法流式处理（如未知压缩、字符集无法表示替换文本）时返回 None，由调用方回退到缓冲改写。
+    """
+    response = flow.response
+    content_type = header_value(response.headers, "content-type")
+    charset = charset_of(content_type)
+    replacements = []
+    rule_ids = []
+    try:
+        for rule in rules:
+            old_text = rule["data"].get("old_text")
+            new_text = rule["data"].get("new_text")
+            if old_text and new_text:
+                replacements.append((old_text.encode(charset), new_text.encode(charset)))
+                rule_ids.append(rule["id"])
+    except (LookupError, UnicodeEncodeError):
+        return None
+    if not replacements:
+        return None
+
+    encodings = [e.strip().lower() for e in header_value(response.headers, "content-encoding").split(",") if e.strip()]
+    encodings = [e for e in encodings if e not in ("identity", "none")]
+    decoder = None
+    if len(encodings) > 1:
+        return None
+    if encodings:
+        enc = "gzip" if encodings[0] == "x-gzip" else encodings[0]
+        if enc not in ("gzip", "deflate", "br") or (enc == "br" and brotli is None):
+            return None
+        decoder = _Decoder(enc)
+        del response.headers["content-encoding"]
+
+    # 改写后长度未知：去掉 Content-Length，HTTP/1.1 客户端改用分块传输
+    if "content-length" in response.headers:
+        del response.headers["content-length"]
+    if flow.request.http_version == "HTTP/1.1" and flow.request.method.upper() != "HEAD":
+        response.headers["transfer-encoding"] = "chunked"
+    return StreamRewriter(replacements, decoder, rule_ids)
@@ -0,0 +1,248 @@
+# -*- coding: utf-8 -*-
+"""
+录包 body 存储：按内容寻址保存原始字节（不解码、不解压），供录包、WebSocket 帧等共用。
+- 内存中按 LRU 缓存，设置目录后同时落盘（data/blobs），内存淘汰后仍可从磁盘读回。
+- 引用计数：录包淘汰或清空时释放，计数归零即删除。
+- 解码延迟到客户端请求时进行：Content-Encoding（gzip/br/deflate）按需解压，文本/二进制先做廉价嗅探。
+"""
+import hashlib
+import threading
+import zlib
+from collections import OrderedDict
+from pathlib import Path
+
+try:
+    import brotli  # mitmproxy 依赖，通常已安装
+except ImportError:  # pragma: no cover
+    brotli = None
+
+_BLOBS = OrderedDict()  # blob id -> bytes（内存缓存，LRU）
+_REFS = {}  # blob id -> 引用计数
+_mem_bytes = 0
+_MAX_MEMORY_BYTES = 64 * 1024 * 1024  # 内存缓存上限 64MB
+_BLOB_DIR = None  # 由应用设置，如 Path("data/blobs")
+_lock = threading.Lock()
+
+_SNIFF_BYTES = 512
+
+_TEXT_TYPES = ("text/", "json", "xml", "javascript", "ecmascript", "x-www-form-urlencoded", "graphql", "html", "csv", "yaml")
+_BINARY_TYPES = (
+    "image/", "audio/", "video/", "font/", "octet-stream", "protobuf", "grpc", "zip", "gzip", "pdf",
+    "wasm", "msgpack", "x-tar", "x-7z", "x-rar", "vnd.ms-", "application/x-shockwave",
+)
+
+
+def set_blob_dir(path):
+    global _BLOB_DIR
+    _BLOB_DIR = Path(path) if path else None
+
+
+def _blob_path(blob_id):
+    return _BLOB_DIR / blob_id[:2] / blob_id
+
+
+def _cache(blob_id, data):
+    global _mem_bytes
+    _BLOBS[blob_id] = data
+    _BLOBS.move_to_end(blob_id)
+    _mem_bytes += len(data)
+    while _mem_bytes > _MAX_MEMORY_BYTES and len(_BLOBS) > 1:
+        _, old = _BLOBS.popitem(last=False)
+        _mem_bytes -= len(old)
+
+
+def _uncache(blob_id):
+    global _mem_bytes
+    data = _BLOBS.pop(blob_id, None)
+    if data is not None:
+        _mem_bytes -= len(data)
+
+
+def put(data: bytes) -> str:
+    """保存原始字节并返回 blob id（sha1）；相同内容只存一份，引用计数 +1。空内容返回 None。"""
+    if not data:
+        return None
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    blob_id = hashlib.sha1(data).hexdigest()
+    with _lock:
+        if blob_id in _REFS:
+            _REFS[blob_id] += 1
+            if blob_id in _BLOBS:
+                _BLOBS.move_to_end(blob_id)
+            return blob_id
+        _REFS[blob_id] = 1
+        _cache(blob_id, bytes(data))
+    if _BLOB_DIR is not None:
+        try:
+            p = _blob_path(blob_id)
+            if not p.exists():
+                p.parent.mkdir(parents=True, exist_ok=True)
+                p.write_bytes(data)
+        except Exception:
+            pass
+    return blob_id
+
+
+def get(blob_id: str):
+    """按 blob id 取原始字节，不存在返回 None。"""
+    if not blob_id:
+        return None
+    with _lock:
+        data = _BLOBS.get(blob_id)
+        if data is not None:
+            _BLOBS.move_to_end(blob_id)
+            return data
+        if blob_id not in _REFS or _BLOB_DIR is None:
+            return None
+    try:
+        data = _blob_path(blob_id).read_bytes()
+    except Exception:
+        return None
+    with _lock:
+        if blob_id in _REFS and blob_id not in _BLOBS:
+            _cache(blob_id, data)
+    return data
+
+
+def release(blob_id: str):
+    """引用计数 -1，归零时从内存与磁盘删除。"""
+    if not blob_id:
+        return
+    with _lock:
+        n = _REFS.get(blob_id)
+        if n is None:
+            return
+        if n > 1:
+            _REFS[blob_id] = n - 1
+            return
+        del _REFS[blob_id]
+        _uncache(blob_id)
+    if _BLOB_DIR is not None:
+        try:
+            _blob_path(blob_id).unlink()
+        except Exception:
+            pass
+
+
+def reset(blob_ids):
+    """按已加载录包引用的 blob id 重建引用计数（应用启动时调用），并删除磁盘上无引用的文件。"""
+    global _mem_bytes
+    refs = {}
+    for bid in blob_ids:
+        if bid:
+            refs[bid] = refs.get(bid, 0) + 1
+    with _lock:
+        _REFS.clear()
+        _REFS.update(refs)
+        _BLOBS.clear()
+        _mem_bytes = 0
+    if _BLOB_DIR is None or not _BLOB_DIR.exists():
+        return
+    try:
+        for p in _BLOB_DIR.glob("*/*"):
+            if p.name not in refs:
+                p.unlink()
+    except Exception:
+        pass
+
+
+def clear():
+    """删除所有 blob。"""
+    global _mem_bytes
+    with _lock:
+        ids = list(_REFS)
+        _REFS.clear()
+        _BLOBS.clear()
+        _mem_bytes = 0
+    if _BLOB_DIR is None:
+        return
+    for bid in ids:
+        try:
+            _blob_path(bid).unlink()
+        except Exception:
+            pass
+
+
+def header_value(headers: dict, name: str) -> str:
+    """大小写不敏感地取 header 值，不存在返回空串。"""
+    if not headers:
+        return ""
+    name = name.lower()
+    for k, v in headers.items():
+        if k.lower() == name:
+            return str(v)
+    return ""
+
+
+def charset_of(content_type: str) -> str:
+    for part in (content_type or "").split(";")[1:]:
+        k, _, v = part.strip().partition("=")
+        if k.lower() == "charset" and v:
+            return v.strip("\"' ")
+    return "utf-8"
+
+
+def decompress(raw: bytes, content_encoding: str, max_bytes: int = None) -> bytes:
+    """
+    按 Content-Encoding 解压（支持 gzip / deflate / br，可串联）。
+    max_bytes 限制输出长度，仅解压所需的前缀；不支持或解压失败时原样返回。
+    """
+    if not raw:
+        return raw or b""
+    encodings = [e.strip().lower() for e in (content_encoding or "").split(",") if e.strip()]
+    data = raw
+    for i, enc in enumerate(reversed(encodings)):
+        if enc in ("identity", "none"):
+            continue
+        # 仅最后一层解压可以提前截断，中间层须完整解压
+        limit = (max_bytes or 0) if i == len(encodings) - 1 else 0
+        try:
+            if enc in ("gzip", "x-gzip", "deflate"):
+                wbits = 16 + zlib.MAX_WBITS if enc != "deflate" else zlib.MAX_WBITS
+                try:
+                    data = zlib.decompressobj(wbits).decompress(data, limit)
+                except zlib.error:
+                    if enc != "deflate":
+                        raise
+                    # 部分服务端的 deflate 为不带 zlib 头的原始流
+                    data = zlib.decompressobj(-zlib.MAX_WBITS).decompress(data, limit)
+            elif enc == "br" and brotli is not None:
+                data = brotli.decompress(data)
+            else:
+                return raw
+        except Exception:
+            return raw
+    if max_bytes is not None:
+        data = data[:max_bytes]
+    return data
+
+
+def is_text(content_type: str, head: bytes) -> bool:
+    """
+    廉价判断 body 是否为文本：先看 Content-Type，无法判断时只检查前 512 字节
+    （含 NUL 或控制字符过多视为二进制）。head 须为已解压的字节。
+    """
+    ct = (content_type or "").lower()
+    if ct:
+        if any(t in ct for t in _TEXT_TYPES):
+            return True
+        if any(t in ct for t in _BINARY_TYPES):
+            return False
+    sample = head[:_SNIFF_BYTES] if head else b""
+    if not sample:
+        return True
+    if b"\x00" in sample:
+        return False
+    control = sum(1 for b in sample if b < 9 or 13 < b < 32)
+    return control * 10 < len(sample)
+
+
+def to_text(data: bytes, content_type: str = "") -> str:
+    """按 Content-Type 的 charset 解码为文本，未知编码回退 utf-8，无法解码的字节替换。"""
+    if not data:
+        return ""
+    try:
+        return data.decode(charset_of(content_type), errors="replace")
+    except LookupError:
+        return data.decode("utf-8", errors="replace")
@@ -1,13 +1,34 @@
 # -*- coding: utf-8 -*-
 """记录器流量录包存储：供录制代理与记录器页、AI 工具共用。"""
+import atexit
 import json
+import queue
+import re
+import threading
 import time
 import uuid
+from collections import deque
 from pathlib import Path
+from urllib.parse import urlsplit, parse_qsl
 
-_PACKETS = []
+from . import body_store
+
+DEFAULT_SESSION = "default"
+_SESSIONS = {}  # 采集会话名 -> _Partition，各会话的录包与索引相互独立
+_BY_ID = {}  # 录包 id -> 录包（跨会话）
+_lock = threading.RLock()
+_MAX_PACKETS = 20000  # 每个采集会话内存中最多保留的录包数，超出时淘汰最早的录包
 _MAX_BODY_PREVIEW = 64 * 1024  # 单次请求/响应 body 预览最多 64KB
+_ENTRY_PREVIEW = 1024  # 原始字节 body 在录包上只保留 1KB 文本预览，完整 body 经 blob 按需读取
+_INDEX_CHARS = 64 * 1024  # 全文索引与检索校验覆盖的 body 文本长度（从 blob 解码，不保存在录包上）
 _PERSIST_PATH = None  # 由应用设置，如 Path("data/browser_packets.json")
+_PERSIST_DELAY = 1.0  # 录包变更后延迟写盘的秒数，期间的多次变更合并为一次写入
+_persist_timer = None
+_persist_write_lock = threading.Lock()
+_MAX_PENDING = 10000  # 异步录包队列上限，满时丢弃新录包，不阻塞代理
+_QUEUE = queue.Queue(maxsize=_MAX_PENDING)
+_worker = None
+_dropped = 0
 
 
 def set_persist_path(path):
@@ -24,33 +45,326 @@ def _truncate(s, max_len=_MAX_BODY_PREVIEW):
     return s[:max_len] + ("…" if len(s) > max_len else "")
 
 
-def add_packet(method: str, url: str, request_headers: dict, request_body, response_status: int, response_headers: dict, response_body):
-    """记录一条请求/响应。body 可为 str 或 bytes，会做截断预览。"""
-    pid = str(uuid.uuid4())[:8]
+_UUID_RE = re.compile(r"^[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}$")
+_HASH_RE = re.compile(r"^[0-9a-fA-F]{16,}$")
+_INT_RE = re.compile(r"^-?\d+$")
+
+
+def _template_value(v):
+    """将单个路径段/查询值归一化：数字 -> {int}，UUID -> {uuid}，十六进制哈希 -> {hash}，其余原样保留。"""
+    if not v:
+        return v
+    if _INT_RE.match(v):
+        return "{int}"
+    if _UUID_RE.match(v):
+        return "{uuid}"
+    if _HASH_RE.match(v):
+        return "{hash}"
+    return v
+
+
+def url_template(url: str) -> str:
+    """将 URL 归一化为模板，如 /item/123?id=5 -> /item/{int}?id={int}；查询参数按键名排序。"""
+    try:
+        parts = urlsplit(url or "")
+    except ValueError:
+        return url or ""
+    path = "/".join(_template_value(seg) for seg in parts.path.split("/"))
+    query = ""
+    if parts.query:
+        pairs = sorted((k, _template_value(v)) for k, v in parse_qsl(parts.query, keep_blank_values=True))
+        query = "?" + "&".join("%s=%s" % (k, v) for k, v in pairs)
+    prefix = "%s://%s" % (parts.scheme, parts.netloc) if parts.netloc else ""
+    return prefix + (path or "/") + query
+
+
+# 英文/数字按连续字母数字切分（_ - . 等符号均为分隔，access_token 切为 access 与 token），中日韩文字按单字切分；
+# 超过 _MAX_TOKEN 的词按前缀入索引。查询时所有词都命中的录包才作为候选，再以子串检查确认
+_TOKEN_RE = re.compile(r"[0-9A-Za-z]+|[\u3040-\u30ff\u4e00-\u9fff\uac00-\ud7af]")
+_MAX_TOKEN = 64
+_SEARCH_FIELDS = ("request_headers", "request_body", "response_headers", "response_body")
+_SNIPPET_RADIUS = 60
+
+
+def _tokenize(text):
+    return {t[:_MAX_TOKEN].lower() for t in _TOKEN_RE.findall(text)} if text else set()
+
+
+def _field_text(entry, field):
+    if field.endswith("_headers"):
+        h = entry.get(field) or {}
+        return "\n".join("%s: %s" % (k, v) for k, v in h.items())
+    return entry.get(field + "_preview") or ""
+
+
+def _body_text(entry, prefix):
+    """检索用的 body 文本：带 blob 的文本 body 从 blob 解码前 _INDEX_CHARS 字符，否则取预览。"""
+    blob_id = entry.get(prefix + "_body_blob")
+    if blob_id and not entry.get(prefix + "_body_binary"):
+        raw = body_store.get(blob_id)
+        if raw:
+            return _text_preview(raw, entry.get(prefix + "_headers") or {}, _INDEX_CHARS) or ""
+    return entry.get(prefix + "_body_preview") or ""
+
+
+def _packet_tokens(entry, bodies=None):
+    """录包的索引词；bodies 为 {前缀: body 文本}，缺省时各 body 取 _body_text。"""
+    tokens = set()
+    for field in _SEARCH_FIELDS:
+        if field.endswith("_headers"):
+            tokens |= _tokenize(_field_text(entry, field))
+        else:
+            prefix = field[:-len("_body")]
+            text = bodies.get(prefix) if bodies and prefix in bodies else _body_text(entry, prefix)
+            tokens |= _tokenize(text)
+    return tokens
+
+
+class _Partition:
+    """单个采集会话的录包分区：按时间顺序的录包及其 URL 模板分组、全文倒排索引。"""
+
+    def __init__(self, name):
+        self.name = name
+        self.packets = deque()
+        self.templates = {}  # (method, url 模板) -> 分组信息：count、代表录包 id、最近时间/状态
+        self.tokens = {}  # 全文倒排索引：词 -> 录包 id 集合（覆盖请求/响应头与 body 前 _INDEX_CHARS 字符）
+        self.packet_tokens = {}  # 录包 id -> 其索引词集合，淘汰时据此移除，无需再次解码 body
+
+    def add(self, entry, bodies=None):
+        """加入录包；bodies 为已解码的 {前缀: body 文本}（录包时顺带得到），缺省时从 blob 解码。"""
+        self.packets.append(entry)
+        self._index(entry, bodies)
+        while len(self.packets) > _MAX_PACKETS:
+            self._unindex(self.packets.popleft())
+
+    def clear(self):
+        for p in self.packets:
+            _BY_ID.pop(p.get("id"), None)
+            _release_blobs(p)
+        self.packets.clear()
+        self.templates.clear()
+        self.tokens.clear()
+        self.packet_tokens.clear()
+
+    def _index(self, entry, bodies=None):
+        _BY_ID[entry["id"]] = entry
+        key = (entry["method"], url_template(entry["url"]))
+        g = self.templates.get(key)
+        if g is None:
+            g = self.templates[key] = {
+                "method": key[0],
+                "template": key[1],
+                "count": 0,
+                "first_time": entry["time"],
+            }
+        g["count"] += 1
+        # 代表录包取该模板下最新一条
+        g["packet_id"] = entry["id"]
+        g["last_time"] = entry["time"]
+        g["response_status"] = entry.get("response_status")
+        pid = entry["id"]
+        tokens = self.packet_tokens[pid] = _packet_tokens(entry, bodies)
+        for t in tokens:
+            ids = self.tokens.get(t)
+            if ids is None:
+                ids = self.tokens[t] = set()
+            ids.add(pid)
+
+    def _unindex(self, entry):
+        """淘汰录包：移除 id 映射、模板计数与倒排索引中的条目，并释放 body。"""
+        pid = entry.get("id")
+        if _BY_ID.get(pid) is entry:
+            del _BY_ID[pid]
+        key = (entry["method"], url_template(entry["url"]))
+        g = self.templates.get(key)
+        if g is not None:
+            g["count"] -= 1
+            if g["count"] <= 0:
+                del self.templates[key]
+        for t in self.packet_tokens.pop(pid, ()):
+            ids = self.tokens.get(t)
+            if ids is not None:
+                ids.discard(pid)
+                if not ids:
+                    del self.tokens[t]
+        _release_blobs(entry)
+
+
+def normalize_session(name) -> str:
+    """采集会话名：去首尾空白，空值归为默认会话。"""
+    name = str(name or "").strip()
+    return name[:128] if name else DEFAULT_SESSION
+
+
+def _partitions(session=None):
+    """session 为空时返回所有分区，否则只返回该会话分区（不存在时为空列表）。"""
+    if session is None or str(session).strip() == "":
+        return list(_SESSIONS.values())
+    part = _SESSIONS.get(normalize_session(session))
+    return [part] if part is not None else []
+
+
+def _body_fields(prefix, body, headers):
+    """
+    生成 body 相关字段，返回 (字段, 检索用文本)。str 视为已解码文本，仅做截断预览；
+    bytes 视为线上原始字节（可能带 Content-Encoding）：原样存入 body_store，
+    先用 Content-Type 与前 512 字节嗅探文本/二进制，二进制不解码，文本只解压/解码前 _INDEX_CHARS 字符，
+    录包上只保留其中前 _ENTRY_PREVIEW 字符作预览，避免列表接口把大段 body 带进上下文。
+    """
+    if not isinstance(body, (bytes, bytearray)):
+        preview = _truncate(body)
+        return {prefix + "_body_preview": preview}, preview
+    raw = bytes(body)
+    fields = {
+        prefix + "_body_preview": None,
+        prefix + "_body_size": len(raw),
+        prefix + "_body_blob": body_store.put(raw),
+        prefix + "_body_binary": False,
+    }
+    if not raw:
+        fields[prefix + "_body_preview"] = ""
+        return fields, ""
+    text = _text_preview(raw, headers, _INDEX_CHARS)
+    if text is None:
+        fields[prefix + "_body_binary"] = True
+        return fields, ""
+    fields[prefix + "_body_preview"] = _truncate(text, _ENTRY_PREVIEW)
+    return fields, text
+
+
+def _text_preview(raw, headers, max_chars=_MAX_BODY_PREVIEW):
+    """按 Content-Type 与嗅探结果把原始字节的前缀解码为文本（最多 max_chars 字符）；二进制返回 None。"""
+    ctype = body_store.header_value(headers, "content-type")
+    cenc = body_store.header_value(headers, "content-encoding")
+    head = body_store.decompress(raw[:4096], cenc, max_bytes=512) if cenc else raw[:512]
+    if not body_store.is_text(ctype, head):
+        return None
+    data = body_store.decompress(raw, cenc, max_bytes=max_chars + 1) if cenc else raw[:max_chars + 1]
+    return _truncate(body_store.to_text(data, ctype), max_chars)
+
+
+def _release_blobs(entry):
+    body_store.release(entry.get("request_body_blob"))
+    body_store.release(entry.get("response_body_blob"))
+
+
+def add_packet(method: str, url: str, request_headers: dict, request_body, response_status: int, response_headers: dict, response_body, session: str = None,
+               packet_id: str = None, replay_of: str = None, response_truncated: bool = False):
+    """
+    记录一条请求/响应。body 可为 str（截断预览）或 bytes（原始字节入 body_store，预览按需解码）。
+    session 为采集会话名（如代理认证用户名、对话 id），录包写入该会话分区，默认会话为 default。
+    packet_id 为预先分配的录包 id（如重放时），replay_of 为被重放的原录包 id。
+    response_truncated 表示 response_body 只是流式转发的响应 body 的前缀（或未录到 body）。
+    """
+    session = normalize_session(session)
+    pid = packet_id or str(uuid.uuid4())[:8]
     ts = time.time()
     req_h = dict(request_headers) if request_headers else {}
-    req_body = _truncate(request_body)
     res_h = dict(response_headers) if response_headers else {}
-    res_body = _truncate(response_body)
     entry = {
         "id": pid,
         "time": ts,
+        "session": session,
         "method": (method or "GET").upper(),
         "url": url or "",
         "request_headers": req_h,
-        "request_body_preview": req_body,
         "response_status": response_status,
         "response_headers": res_h,
-        "response_body_preview": res_body,
     }
-    _PACKETS.append(entry)
-    _persist()
+    if replay_of:
+        entry["replay_of"] = replay_of
+    if response_truncated:
+        entry["response_body_truncated"] = True
+    bodies = {}
+    for prefix, body, headers in (("request", request_body, req_h), ("response", response_body, res_h)):
+        fields, bodies[prefix] = _body_fields(prefix, body, headers)
+        entry.update(fields)
+    with _lock:
+        part = _SESSIONS.get(session)
+        if part is None:
+            part = _SESSIONS[session] = _Partition(session)
+        part.add(entry, bodies)
+        _persist()
     return pid
 
 
-def list_packets(url_contains: str = None, url_contains_any: list = None, limit: int = 200):
-    """返回录包列表，可选按 URL 过滤（单个或任意多个匹配），按时间倒序，最多 limit 条。"""
-    out = list(_PACKETS)
+def _record_loop():
+    while True:
+        fn, kwargs = _QUEUE.get()
+        try:
+            fn(**kwargs)
+        except Exception:
+            pass
+        finally:
+            _QUEUE.task_done()
+
+
+def record_async(fn, **kwargs) -> bool:
+    """
+    将录制任务 fn(**kwargs) 放入后台队列，由录包线程串行执行，
+    供代理热路径调用，不阻塞代理事件循环。队列满时丢弃并返回 False。
+    """
+    global _worker, _dropped
+    if _worker is None:
+        with _lock:
+            if _worker is None:
+                _worker = threading.Thread(target=_record_loop, name="packet-recorder", daemon=True)
+                _worker.start()
+    try:
+        _QUEUE.put_nowait((fn, kwargs))
+        return True
+    except queue.Full:
+        _dropped += 1
+        return False
+
+
+def add_packet_async(**kwargs) -> bool:
+    """异步版 add_packet：嗅探、解码预览、建索引、持久化均在录包线程中完成。"""
+    return record_async(add_packet, **kwargs)
+
+
+def flush_pending(timeout: float = 5.0) -> bool:
+    """等待异步录包队列处理完毕并立即写盘，超时返回 False。"""
+    deadline = time.time() + max(0.0, timeout)
+    while _QUEUE.unfinished_tasks:
+        if time.time() >= deadline:
+            return False
+        time.sleep(0.01)
+    flush_persist()
+    return True
+
+
+def list_sessions():
+    """返回采集会话列表：[{session, count, last_time}]，按最近录包时间倒序。"""
+    with _lock:
+        out = [{
+            "session": part.name,
+            "count": len(part.packets),
+            "last_time": part.packets[-1]["time"] if part.packets else None,
+        } for part in _SESSIONS.values()]
+    out.sort(key=lambda x: x["last_time"] or 0, reverse=True)
+    return out
+
+
+def packet_urls(session: str = None):
+    """返回 [(录包 id, url)]，按时间倒序；供规则试运行等只需 URL 的批量扫描使用。"""
+    with _lock:
+        parts = _partitions(session)
+        out = [(p.get("time") or 0, p["id"], p.get("url") or "") for part in parts for p in part.packets]
+    out.sort(key=lambda x: x[0], reverse=True)
+    return [(pid, url) for _, pid, url in out]
+
+
+def list_packets(url_contains: str = None, url_contains_any: list = None, limit: int = 200, session: str = None):
+    """
+    返回录包列表，可选按 URL 过滤（单个或任意多个匹配），按时间倒序，最多 limit 条。
+    session 指定时只读取该采集会话分区，否则合并所有会话。
+    """
+    with _lock:
+        parts = _partitions(session)
+        out = [p for part in parts for p in part.packets]
+    if len(parts) > 1:
+        out.sort(key=lambda p: p.get("time") or 0)
     if url_contains_any and len(url_contains_any) > 0:
         patterns = [str(s).strip().lower() for s in url_contains_any if s and str(s).strip()]
         if patterns:
@@ -65,44 +379,241 @@ def list_packets(url_contains: str = None, url_contains_any: list = None, limit:
     return out[: max(1, min(1000, int(limit) if limit else 200))]
 
 
+def list_packet_groups(url_contains: str = None, url_contains_any: list = None, limit: int = 200, session: str = None):
+    """
+    按 URL 模板分组返回录包（/item/123 与 /item/124 归为 /item/{int}）。
+    每组含 method、template、count、代表录包 packet_id（最新一条）、first_time/last_time、response_status；
+    按最近时间倒序，最多 limit 组。session 为空时合并所有采集会话的同名模板。
+    """
+    merged = {}
+    with _lock:
+        for part in _partitions(session):
+            for key, g in part.templates.items():
+                m = merged.get(key)
+                if m is None:
+                    merged[key] = dict(g)
+                    continue
+                m["count"] += g["count"]
+                m["first_time"] = min(m["first_time"], g["first_time"])
+                if g["last_time"] > m["last_time"]:
+                    m.update(packet_id=g["packet_id"], last_time=g["last_time"], response_status=g["response_status"])
+    groups = list(merged.values())
+    if url_contains_any and len(url_contains_any) > 0:
+        patterns = [str(s).strip().lower() for s in url_contains_any if s and str(s).strip()]
+        if patterns:
+            groups = [g for g in groups if any(q in g["template"].lower() for q in patterns)]
+    elif url_contains and url_contains.strip():
+        q = url_contains.strip().lower()
+        groups = [g for g in groups if q in g["template"].lower()]
+    groups.sort(key=lambda g: g.get("last_time") or 0, reverse=True)
+    return groups[: max(1, min(1000, int(limit) if limit else 200))]
+
+
+def search_packets(query: str, limit: int = 50, session: str = None):
+    """
+    在请求/响应头与 body（前 _INDEX_CHARS 字符）中全文检索，基于倒排索引取候选，不做全量线性扫描。
+    查询按词切分（_ - . 等符号为分隔，token 可命中 access_token），所有词都出现的录包才算命中；返回按时间倒序的
+    [{id, method, url, response_status, matches: [{field, offset, snippet}]}]，
+    offset 为完整查询串（找不到时为首个词）在该字段文本中的位置。session 指定时只检索该采集会话。
+    """
+    tokens = _tokenize(query or "")
+    if not tokens:
+        return []
+    # 校验用的完整查询词（不截断）：候选须在字段文本中包含每个词
+    terms = {t.lower() for t in _TOKEN_RE.findall(query)}
+    limit = max(1, min(200, int(limit) if limit else 50))
+    candidates = []
+    with _lock:
+        for part in _partitions(session):
+            postings = sorted((part.tokens.get(t, set()) for t in tokens), key=len)
+            ids = set(postings[0])
+            for other in postings[1:]:
+                ids &= other
+                if not ids:
+                    break
+            candidates.extend(_BY_ID[i] for i in ids if i in _BY_ID)
+    candidates.sort(key=lambda p: p.get("time") or 0, reverse=True)
+    needle = query.strip().lower()
+    first = min(tokens, key=needle.find)
+    out = []
+    for p in candidates:
+        texts = [(field, _field_text(p, field)) for field in _SEARCH_FIELDS]
+        lows = [text.lower() for _, text in texts]
+        if not all(any(t in low for low in lows) for t in terms):
+            # 录包上的预览只有前 _ENTRY_PREVIEW 字符，再对照索引覆盖的 body 文本确认
+            texts = [(field, _body_text(p, field[:-len("_body")]) if field.endswith("_body") else text)
+                     for field, text in texts]
+            lows = [text.lower() for _, text in texts]
+            if not all(any(t in low for low in lows) for t in terms):
+                continue
+        matches = []
+        for (field, text), low in zip(texts, lows):
+            offset = low.find(needle)
+            length = len(needle)
+            if offset < 0:
+                offset = low.find(first)
+                length = len(first)
+            if offset < 0:
+                continue
+            start = max(0, offset - _SNIPPET_RADIUS)
+            matches.append({
+                "field": field,
+                "offset": offset,
+                "snippet": text[start: offset + length + _SNIPPET_RADIUS],
+            })
+        if matches:
+            out.append({
+                "id": p["id"],
+                "session": p.get("session") or DEFAULT_SESSION,
+                "method": p.get("method"),
+                "url": p.get("url"),
+                "response_status": p.get("response_status"),
+                "matches": matches,
+            })
+            if len(out) >= limit:
+                break
+    return out
+
+
 def get_packet(packet_id: str):
     """按 id 返回一条录包，不存在返回 None。"""
-    for p in _PACKETS:
-        if p.get("id") == packet_id:
-            return p
-    return None
+    return _BY_ID.get(packet_id)
 
 
-def clear_packets():
-    """清空所有录包。"""
-    global _PACKETS
-    _PACKETS = []
-    _persist()
+def get_packet_body(packet_id: str, part: str = "response", decode: bool = True):
+    """
+    返回录包完整 body：(bytes, content_type)；part 为 request 或 response。
+    decode=True 时按 Content-Encoding 解压，否则返回线上原始字节。录包或 body 不存在返回 None。
+    """
+    p = get_packet(packet_id)
+    if not p or part not in ("request", "response"):
+        return None
+    headers = p.get(part + "_headers") or {}
+    ctype = body_store.header_value(headers, "content-type")
+    blob_id = p.get(part + "_body_blob")
+    if not blob_id:
+        preview = p.get(part + "_body_preview")
+        if preview is None:
+            return None
+        return (str(preview).encode("utf-8"), ctype)
+    raw = body_store.get(blob_id)
+    if raw is None:
+        return None
+    if decode:
+        raw = body_store.decompress(raw, body_store.header_value(headers, "content-encoding"))
+    return (raw, ctype)
+
+
+def get_packet_body_text(packet_id: str, part: str = "response", max_chars: int = 200000):
+    """
+    返回录包完整 body 的文本形式（解压并按 charset 解码，最多 max_chars 字符）：
+    {size, content_type, binary, text}；二进制 body 不解码，text 为 None。不存在返回 None。
+    """
+    p = get_packet(packet_id)
+    body = get_packet_body(packet_id, part)
+    if not p or body is None:
+        return None
+    data, ctype = body
+    binary = bool(p.get(part + "_body_binary"))
+    text = None
+    if not binary:
+        text = _truncate(body_store.to_text(data, ctype), max_chars)
+    return {"size": len(data), "content_type": ctype, "binary": binary, "text": text}
+
+
+def clear_packets(session: str = None):
+    """清空录包：session 指定时只清空该采集会话，否则清空所有会话。"""
+    with _lock:
+        for part in _partitions(session):
+            part.clear()
+            del _SESSIONS[part.name]
+        _persist()
 
 
 def _persist():
-    if not _PERSIST_PATH:
+    """标记录包已变更：_PERSIST_DELAY 秒后在后台合并写盘一次（调用方持有 _lock）。"""
+    global _persist_timer
+    if not _PERSIST_PATH or _persist_timer is not None:
         return
-    try:
-        p = Path(_PERSIST_PATH)
-        p.parent.mkdir(parents=True, exist_ok=True)
-        with open(p, "w", encoding="utf-8") as f:
-            json.dump(_PACKETS, f, ensure_ascii=False, indent=0)
-    except Exception:
-        pass
+    _persist_timer = threading.Timer(_PERSIST_DELAY, _write_persist)
+    _persist_timer.daemon = True
+    _persist_timer.start()
+
+
+def _write_persist():
+    """将当前录包写入持久化文件：锁内只取快照，序列化与写盘在锁外进行。"""
+    global _persist_timer
+    with _persist_write_lock:
+        with _lock:
+            if _persist_timer is not None:
+                _persist_timer.cancel()
+                _persist_timer = None
+            if not _PERSIST_PATH:
+                return
+            path = Path(_PERSIST_PATH)
+            items = [p for part in _SESSIONS.values() for p in part.packets]
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = path.with_name(path.name + ".tmp")
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(items, f, ensure_ascii=False, indent=0)
+            tmp.replace(path)
+        except Exception:
+            pass
+
+
+def flush_persist():
+    """立即写盘尚未持久化的录包变更（如停止代理、退出前调用）。"""
+    with _lock:
+        pending = _persist_timer is not None
+    if pending:
+        _write_persist()
+
+
+def _trim_previews(entry):
+    """加载旧文件时把带 blob 的 body 预览截断到 _ENTRY_PREVIEW（完整 body 仍可经 blob 读取）。"""
+    for prefix in ("request", "response"):
+        key = prefix + "_body_preview"
+        preview = entry.get(key)
+        if entry.get(prefix + "_body_blob") and isinstance(preview, str) and len(preview) > _ENTRY_PREVIEW:
+            entry[key] = _truncate(preview, _ENTRY_PREVIEW)
+
+
+atexit.register(flush_persist)
 
 
 def load_packets():
     """从文件加载录包（应用启动时调用）。"""
-    global _PACKETS
     if not _PERSIST_PATH:
         return
+    items = []
     try:
         p = Path(_PERSIST_PATH)
         if p.exists():
             with open(p, "r", encoding="utf-8") as f:
-                _PACKETS = json.load(f)
-            if not isinstance(_PACKETS, list):
-                _PACKETS = []
+                items = json.load(f)
+            if not isinstance(items, list):
+                items = []
     except Exception:
-        _PACKETS = []
+        items = []
+    loaded = {}  # 会话名 -> 该会话最近 _MAX_PACKETS 条录包
+    for x in items:
+        if not isinstance(x, dict) or not x.get("id"):
+            continue
+        x.setdefault("method", "GET")
+        x.setdefault("url", "")
+        x.setdefault("time", 0)
+        x["session"] = normalize_session(x.get("session"))
+        loaded.setdefault(x["session"], deque(maxlen=_MAX_PACKETS)).append(x)
+    with _lock:
+        _SESSIONS.clear()
+        _BY_ID.clear()
+        body_store.reset(
+            x.get(k) for packets in loaded.values() for x in packets
+            for k in ("request_body_blob", "response_body_blob")
+        )
+        for name, packets in loaded.items():
+            part = _SESSIONS[name] = _Partition(name)
+            for x in packets:
+                _trim_previews(x)
+                part.add(x)
@@ -1,23 +1,93 @@
 # -*- coding: utf-8 -*-
-"""录制代理单例：供记录器使用，将浏览器流量录包。无内置浏览器，仅暴露代理端口供本机浏览器配置使用。"""
+"""
+录制代理单例：供记录器使用，将浏览器流量录包。无内置浏览器，仅暴露代理端口供本机浏览器配置使用。
+默认监听器 default 固定在 8888 端口，使用全局流量规则；可在同一代理上另开命名监听器（其它端口），
+每个监听器有自己的采集会话与（可选的）独立规则集，并行的测试任务互不干扰。
+mitmproxy 的运行上下文是进程级的，所有监听器共用一个 mitmproxy 实例与事件循环线程，按流量进入的端口区分。
+"""
+import re
 import threading
+import time
 import os
 from pathlib import Path
 
+DEFAULT_LISTENER = "default"
+DEFAULT_PORT = 8888  # 使用固定端口 8888，方便用户配置监听端口
+MAX_LISTENERS = 16
+_NAME_RE = re.compile(r"^[A-Za-z0-9_-]{1,32}$")
+
+# 可在设置中调整的 mitmproxy 连接与缓冲选项（配置键 -> 默认值），代理重启后生效
+PROXY_TUNING_DEFAULTS = {
+    "proxy_stream_large_bodies": "",     # 超过该大小的 body 不缓冲、直接流式转发（不录制 body），如 5m；空为不限
+    "proxy_body_size_limit": "",         # body 大小上限，超出的请求/响应被拒绝，如 100m；空为不限
+    "proxy_http2": True,                 # 是否与客户端、上游协商 HTTP/2
+    "proxy_http2_ping_keepalive": 58,    # HTTP/2 空闲连接的 PING 保活间隔（秒），0 为不发送
+    "proxy_connection_strategy": "eager",  # eager：收到请求前即连接上游；lazy：按需连接
+    "proxy_ignore_hosts": [],            # 不解密、原样透传 TLS 的主机（写法同 AI API 白名单）
+    "proxy_auth_sessions": False,        # 要求代理认证（接受任意账号密码），以用户名（如对话 id）作为采集会话
+}
+_CONNECTION_STRATEGIES = ("eager", "lazy")
+
 _proxy = None
+_proxy_options = {}  # 启动代理时应用的 mitmproxy 选项，见 set_proxy_tuning
 _lock = threading.Lock()
 
 
+def normalize_tuning(data: dict) -> dict:
+    """校验并清洗代理调优配置（键同 PROXY_TUNING_DEFAULTS，缺省的键取默认值），非法值抛出 ValueError。"""
+    from mitmproxy.utils import human
+    from services.host_whitelist import normalize_entries
+    out = dict(PROXY_TUNING_DEFAULTS)
+    out.update({k: v for k, v in (data or {}).items() if k in PROXY_TUNING_DEFAULTS})
+    for key in ("proxy_stream_large_bodies", "proxy_body_size_limit"):
+        value = str(out[key] or "").strip().lower()
+        if value:
+            try:
+                human.parse_size(value)
+            except ValueError:
+                raise ValueError(f"{key} 须为大小，如 512k、5m、1g")
+        out[key] = value
+    out["proxy_http2"] = bool(out["proxy_http2"])
+    out["proxy_auth_sessions"] = bool(out["proxy_auth_sessions"])
+    try:
+        out["proxy_http2_ping_keepalive"] = max(0, min(3600, int(out["proxy_http2_ping_keepalive"])))
+    except (TypeError, ValueError):
+        raise ValueError("proxy_http2_ping_keepalive 须为整数")
+    if out["proxy_connection_strategy"] not in _CONNECTION_STRATEGIES:
+        raise ValueError("proxy_connection_strategy 须为 eager 或 lazy")
+    hosts = out["proxy_ignore_hosts"]
+    if isinstance(hosts, str):
+        hosts = hosts.splitlines()
+    if not isinstance(hosts, list):
+        raise ValueError("proxy_ignore_hosts 须为列表")
+    out["proxy_ignore_hosts"] = normalize_entries(hosts)
+    return out
+
+
+def set_proxy_tuning(cfg: dict):
+    """设置代理调优选项（配置字典），下次启动或重启代理时生效。非法配置抛出 ValueError。"""
+    global _proxy_options
+    from services.host_whitelist import to_host_patterns
+    tuning = normalize_tuning(cfg)
+    _proxy_options = {
+        "stream_large_bodies": tuning["proxy_stream_large_bodies"] or None,
+        "body_size_limit": tuning["proxy_body_size_limit"] or None,
+        "http2": tuning["proxy_http2"],
+        "http2_ping_keepalive": tuning["proxy_http2_ping_keepalive"],
+        "connection_strategy": tuning["proxy_connection_strategy"],
+        "ignore_hosts": to_host_patterns(tuning["proxy_ignore_hosts"]),
+        "proxyauth": "any" if tuning["proxy_auth_sessions"] else None,
+    }
+    return tuning
+
+
 def ensure_proxy_started():
     """启动 Mitmproxy 录制代理（若未启动）。返回 (True, None) 或 (False, error_message)。"""
     global _proxy
     with _lock:
         if _proxy is not None:
-            try:
-                if _proxy.proxy_url:
-                    return (True, None)
-            except Exception:
-                pass
+            if _proxy.thread is not None and _proxy.thread.is_alive():
+                return (True, None)
             try:
                 _proxy.stop()
             except Exception:
@@ -25,17 +95,193 @@ def ensure_proxy_started():
             _proxy = None
         try:
             from services.mitm_service import MitmProxyService
-            # 使用固定端口 8888，方便用户配置监听端口
-            _proxy = MitmProxyService("0.0.0.0", 8888)
+            _proxy = MitmProxyService("0.0.0.0", DEFAULT_PORT, proxy_options=_proxy_options)
             _proxy.start()
-            if _proxy.proxy_url:
+            err = _proxy.wait_listening()
+            if err is None:
                 return (True, None)
-            return (False, "代理启动失败")
+            _proxy.stop()
+            _proxy = None
+            return (False, err)
         except Exception as e:
             _proxy = None
             return (False, str(e))
 
 
+def _launch(old, proxy_options: dict):
+    """在旧实例的地址与端口上以 proxy_options 启动新实例并恢复其附加监听器，返回 (实例, 监听器错误) 或 (None, error_message)。"""
+    from services.mitm_service import MitmProxyService
+    proxy = MitmProxyService(old.host, old.port, capture_session=old.capture_session, proxy_options=proxy_options)
+    try:
+        proxy.start()
+        err = proxy.wait_listening()
+    except Exception as e:
+        err = str(e)
+    if err:
+        proxy.stop(wait=5.0)
+        return None, err
+    errors = {}
+    for name, cfg in sorted(old.listeners.items(), key=lambda kv: kv[1]["started_at"]):
+        e = proxy.add_listener(name, cfg["port"], cfg["host"], capture_session=cfg["capture_session"],
+                               rules=cfg["rules"], isolated=cfg["isolated"])
+        if e:
+            errors[name] = e
+    return proxy, errors
+
+
+def _restart(old, drain_timeout: float):
+    """
+    排空并停止旧实例，以当前调优选项在原端口启动新实例并恢复附加监听器（须持有 _lock）。
+    mitmproxy 同一进程只能运行一个实例，无法先启动新实例再停旧实例；新实例未能监听时按旧实例的选项重新启动，
+    返回 (实例, 结果, 错误)：成功时错误为 None；失败时实例为恢复后的旧配置实例（恢复也失败时为 None）。
+    """
+    from services import browser_packets
+    start = time.time()
+    in_flight = old.drain(drain_timeout)
+    flushed = browser_packets.flush_pending(max(1.0, drain_timeout - (time.time() - start)))
+    old.stop(wait=5.0)
+    proxy, errors = _launch(old, _proxy_options)
+    if proxy is None:
+        err = errors
+        proxy, errors = _launch(old, old.proxy_options)
+        if proxy is None:
+            return None, None, f"{err}；按原配置恢复也失败: {errors}"
+        return proxy, None, f"{err}（已按原配置恢复代理）"
+    result = {
+        "mode": "restart",
+        "in_flight_dropped": in_flight,
+        "queue_flushed": flushed,
+        "elapsed_ms": round((time.time() - start) * 1000, 1),
+    }
+    if errors:
+        result["listener_errors"] = errors
+    return proxy, result, None
+
+
+def restart_proxy(drain_timeout: float = 10.0, full: bool = False):
+    """
+    以当前调优选项（set_proxy_tuning）重新配置录制代理，代理未启动时直接启动。返回 (True, 结果) 或 (False, error_message)。
+    默认在运行中的代理上直接更新选项：监听端口不关闭、已有连接不中断，新连接使用新选项，不产生采集间隙。
+    full 为 True 或在线更新失败时完整重启：关闭监听端口，等待在途请求录制完成（至多 drain_timeout 秒），
+    刷新录包队列后停止旧实例，以新选项在原端口启动并恢复所有附加监听器（规则集与采集会话不变）。
+    mitmproxy 同一进程只能运行一个实例，完整重启期间端口短暂不可用。
+    """
+    global _proxy
+    with _lock:
+        old = _proxy
+        if old is not None:
+            reason = None
+            if not full:
+                try:
+                    old.apply_options(_proxy_options)
+                    return (True, {"mode": "live"})
+                except Exception as e:
+                    # 在线更新失败（如旧实例已异常退出）时回退到完整重启
+                    reason = str(e)
+            _proxy = None
+            try:
+                _proxy, result, err = _restart(old, drain_timeout)
+            except Exception as e:
+                return (False, str(e))
+            if err:
+                return (False, err)
+            if reason:
+                result["fallback_reason"] = reason
+            return (True, result)
+    ok, err = ensure_proxy_started()
+    return (True, {"mode": "start"}) if ok else (False, err)
+
+
+def _running_proxy():
+    with _lock:
+        return _proxy
+
+
+def start_listener(name: str, port: int, host: str = "0.0.0.0", capture_session: str = None,
+                   isolated_rules: bool = True):
+    """
+    在录制代理上另开一个命名监听器（代理未启动时先启动）。返回 (True, 监听器信息) 或 (False, error_message)。
+    capture_session 为空时录包写入与监听器同名的采集会话；isolated_rules 为 True 时使用独立的空规则集，
+    否则与默认监听器共用全局规则。
+    """
+    name = (name or "").strip()
+    if not _NAME_RE.match(name):
+        return (False, "监听器名称只能包含字母、数字、- 与 _，长度 1-32")
+    if name == DEFAULT_LISTENER:
+        return (False, "default 为默认监听器，不能重复创建")
+    try:
+        port = int(port)
+    except (TypeError, ValueError):
+        return (False, "port 须为整数")
+    if not 1 <= port <= 65535:
+        return (False, "port 须在 1-65535 之间")
+    ok, err = ensure_proxy_started()
+    if not ok:
+        return (False, f"代理启动失败: {err}")
+    proxy = _running_proxy()
+    if proxy is None:
+        return (False, "代理未运行")
+    if len(proxy.listeners) >= MAX_LISTENERS:
+        return (False, f"监听器数量已达上限 {MAX_LISTENERS}")
+    from services.traffic_rules import TrafficRuleManager
+    rules = TrafficRuleManager(isolated=True) if isolated_rules else None
+    err = proxy.add_listener(name, port, host or "0.0.0.0", capture_session=capture_session or name,
+                             rules=rules, isolated=isolated_rules)
+    if err:
+        return (False, err)
+    return (True, _listener_info(name, proxy.listeners[name]))
+
+
+def stop_listener(name: str) -> bool:
+    """关闭命名监听器，不存在返回 False。default 对应整个录制代理，请使用 stop_proxy。"""
+    proxy = _running_proxy()
+    if proxy is None or not name or name == DEFAULT_LISTENER:
+        return False
+    return proxy.remove_listener(name)
+
+
+def _listener_info(name, cfg):
+    return {
+        "name": name,
+        "host": cfg["host"],
+        "port": cfg["port"],
+        "capture_session": cfg["capture_session"],
+        "rules": "isolated" if cfg["isolated"] else "global",
+        "rule_count": len(cfg["rules"].rules),
+        "started_at": cfg["started_at"],
+    }
+
+
+def list_listeners():
+    """当前所有监听器的信息列表（代理未启动时为空），默认监听器在前。"""
+    from services.traffic_rules import traffic_rules
+    proxy = _running_proxy()
+    if proxy is None:
+        return []
+    out = [{
+        "name": DEFAULT_LISTENER,
+        "host": proxy.host,
+        "port": proxy.port,
+        "capture_session": proxy.capture_session,
+        "rules": "global",
+        "rule_count": len(traffic_rules.rules),
+        "started_at": None,
+    }]
+    items = sorted(proxy.listeners.items(), key=lambda kv: kv[1]["started_at"])
+    out.extend(_listener_info(name, cfg) for name, cfg in items)
+    return out
+
+
+def get_listener_rules(name: str = None):
+    """监听器使用的规则集（TrafficRuleManager）；未指定或 default 返回全局规则，监听器不存在返回 None。"""
+    from services.traffic_rules import traffic_rules
+    if not name or name == DEFAULT_LISTENER:
+        return traffic_rules
+    proxy = _running_proxy()
+    cfg = proxy.listeners.get(name) if proxy is not None else None
+    return cfg["rules"] if cfg else None
+
+
 def get_proxy_url():
     """当前录制代理地址，如 http://127.0.0.1:xxxx；未启动时返回 None。"""
     with _lock:
@@ -60,6 +306,30 @@ def get_proxy_port():
         return None
 
 
+def get_proxy_metrics():
+    """当前录制代理的运行指标（连接数、请求速率、收发字节、钩子耗时、事件循环延迟，含所有监听器）；未启动时返回 None。"""
+    with _lock:
+        if _proxy is None:
+            return None
+        return _proxy.metrics.snapshot()
+
+
+def replay_packet(packet_id: str, timeout: float = 30.0, listener: str = None):
+    """
+    通过录制代理重放录包（未启动时先启动），结果见 MitmProxyService.replay；listener 指定时按该监听器的规则集执行。
+    代理无法启动或监听器不存在抛出 RuntimeError，重放超时抛出 TimeoutError，录包不存在返回 None。
+    """
+    ok, err = ensure_proxy_started()
+    if not ok:
+        raise RuntimeError(f"代理启动失败: {err}")
+    proxy = _running_proxy()
+    if proxy is None:
+        raise RuntimeError("代理未运行")
+    if listener == DEFAULT_LISTENER:
+        listener = None
+    return proxy.replay(packet_id, timeout=timeout, listener=listener)
+
+
 def get_mitmproxy_cert_path():
     """
     获取 Mitmproxy CA 证书路径
@@ -77,7 +347,7 @@ def get_mitmproxy_cert_path():
 
 
 def stop_proxy():
-    """停止录制代理。"""
+    """停止录制代理（含所有监听器）。"""
     global _proxy
     with _lock:
         p, _proxy = _proxy, None
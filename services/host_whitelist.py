@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+"""
+主机白名单：代理热路径上判断请求是否属于 AI API（LLM 流量），命中的请求不执行规则、不缓存、不录制。
+条目写法：
+- api.deepseek.com：精确匹配该主机；
+- *.example.com（或 .example.com）：匹配 example.com 及其所有子域；
+- re:正则：对完整 URL 做不区分大小写的搜索，所有正则条目合并为一个预编译正则。
+条目在设置时编译一次，匹配只做集合查找（按域名层级逐级查后缀）与至多一次正则搜索。
+"""
+import re
+
+# 默认放行的 AI API 主机（本项目调用的大模型服务）
+DEFAULT_AI_API_WHITELIST = [
+    "dashscope.aliyuncs.com",   # 阿里云百炼
+    "api.deepseek.com",         # 深度求索
+    "api.siliconflow.cn",       # 硅基流动
+]
+
+
+def normalize_entries(entries):
+    """清洗条目列表：去空白、去重，主机名转小写；非法正则抛出 ValueError。"""
+    out = []
+    seen = set()
+    for raw in entries or []:
+        if not isinstance(raw, str):
+            continue
+        item = raw.strip()
+        if not item or item.startswith("#"):
+            continue
+        if item[:3].lower() == "re:":
+            pattern = item[3:].strip()
+            try:
+                re.compile(pattern)
+            except re.error as e:
+                raise ValueError(f"白名单正则无效: {pattern} ({e})")
+            item = "re:" + pattern
+        else:
+            item = item.lower().rstrip(".")
+        if item not in seen:
+            seen.add(item)
+            out.append(item)
+    return out
+
+
+def _compile(entries):
+    exact = set()
+    suffixes = set()
+    patterns = []
+    for item in entries:
+        if item.startswith("re:"):
+            patterns.append("(?:%s)" % item[3:])
+        elif item.startswith("*."):
+            suffixes.add(item[2:])
+        elif item.startswith("."):
+            suffixes.add(item[1:])
+        else:
+            exact.add(item)
+    regex = re.compile("|".join(patterns), re.IGNORECASE) if patterns else None
+    return frozenset(exact), frozenset(suffixes), regex
+
+
+def to_host_patterns(entries):
+    """
+    把条目转换为 mitmproxy ignore_hosts 等选项使用的正则（匹配 "主机:端口"）：
+    精确主机与 *. 后缀条目转义后锚定，re: 条目原样使用。
+    """
+    patterns = []
+    for item in normalize_entries(entries):
+        if item.startswith("re:"):
+            patterns.append(item[3:])
+        elif item.startswith("*.") or item.startswith("."):
+            patterns.append(r"^(.+\.)?%s(:\d+)?$" % re.escape(item.lstrip("*.")))
+        else:
+            patterns.append(r"^%s(:\d+)?$" % re.escape(item))
+    return patterns
+
+
+class HostWhitelist:
+    def __init__(self, entries=()):
+        self.entries = []
+        self._compiled = (frozenset(), frozenset(), None)
+        self.set_entries(entries)
+
+    def set_entries(self, entries):
+        """替换全部条目并重新编译；编译结果整体替换，匹配线程无需加锁。"""
+        entries = normalize_entries(entries)
+        compiled = _compile(entries)
+        self.entries = entries
+        self._compiled = compiled
+        return entries
+
+    def match(self, host: str, url: str = None) -> bool:
+        exact, suffixes, regex = self._compiled
+        host = (host or "").lower().rstrip(".")
+        if host in exact:
+            return True
+        if suffixes:
+            # 依次检查 a.b.c、b.c、c 是否为后缀条目
+            candidate = host
+            while candidate:
+                if candidate in suffixes:
+                    return True
+                dot = candidate.find(".")
+                if dot < 0:
+                    break
+                candidate = candidate[dot + 1:]
+        if regex is not None and url:
+            return regex.search(url) is not None
+        return False
+
+    def match_request(self, request) -> bool:
+        """按 mitmproxy 请求判断；只有存在正则条目时才拼接完整 URL。"""
+        url = request.pretty_url if self._compiled[2] is not None else None
+        return self.match(request.pretty_host, url)
+
+
+ai_api_whitelist = HostWhitelist(DEFAULT_AI_API_WHITELIST)
@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+"""
+patch_json_body 规则：对 JSON 响应体按路径执行 set / delete。
+路径支持两种写法：
+- JSON Pointer（RFC 6901）：以 / 开头，如 /data/items/0/name，~1 表示 /，~0 表示 ~，数组末尾追加用 -；
+- 点路径：如 data.items[0].name，空串表示根节点。
+同一 flow 命中的多条规则共用一次解析与一次序列化。
+"""
+import copy
+import json
+import re
+
+_DOT_TOKEN_RE = re.compile(r"([^.\[\]]+)|\[(-?\d+|-)\]")
+_MISSING = object()
+
+
+def parse_path(path: str):
+    """把路径解析为键列表（字符串键或整数下标），非法路径抛出 ValueError。"""
+    if not isinstance(path, str):
+        raise ValueError("path 须为字符串")
+    if path == "" or path == "/":
+        return [] if path == "" else [""]
+    if path.startswith("/"):
+        return [t.replace("~1", "/").replace("~0", "~") for t in path[1:].split("/")]
+    tokens = []
+    pos = 0
+    for m in _DOT_TOKEN_RE.finditer(path):
+        gap = path[pos:m.start()]
+        if gap not in ("", "."):
+            raise ValueError(f"无法解析路径: {path}")
+        if m.group(1) is not None:
+            tokens.append(m.group(1))
+        else:
+            idx = m.group(2)
+            tokens.append(idx if idx == "-" else int(idx))
+        pos = m.end()
+    if path[pos:]:
+        raise ValueError(f"无法解析路径: {path}")
+    return tokens
+
+
+def normalize_ops(data: dict):
+    """
+    从规则 data 取出操作列表：data.ops 为 [{op, path, value}]，或 data 本身即为单个操作。
+    返回 [(op, 路径键列表, value)]，非法时抛出 ValueError。
+    """
+    ops = data.get("ops")
+    if ops is None and "op" in data:
+        ops = [data]
+    if not isinstance(ops, list) or not ops:
+        raise ValueError("修改 JSON 需要提供 ops 操作列表（或 op、path、value）")
+    out = []
+    for item in ops:
+        if not isinstance(item, dict):
+            raise ValueError("ops 中的每一项须为对象")
+        op = item.get("op")
+        if op not in ("set", "delete"):
+            raise ValueError(f"不支持的 JSON 操作: {op}，可选 set、delete")
+        if op == "set" and "value" not in item:
+            raise ValueError("set 操作需要提供 value")
+        tokens = parse_path(item.get("path", ""))
+        if op == "delete" and not tokens:
+            raise ValueError("delete 操作不能删除根节点")
+        out.append((op, tokens, item.get("value")))
+    return out
+
+
+def _child(node, token):
+    """按键取子节点，不存在返回 (False, None)。"""
+    if isinstance(node, dict):
+        key = str(token)
+        return (key in node, node.get(key))
+    if isinstance(node, list):
+        try:
+            i = int(token)
+        except (TypeError, ValueError):
+            return (False, None)
+        if -len(node) <= i < len(node):
+            return (True, node[i])
+    return (False, None)
+
+
+def _apply_one(doc, op, tokens, value):
+    """
+    执行单个操作，返回 (新的根节点, 改动的值)：set 为写入的值，delete 为删除的值，无改动为 _MISSING。
+    路径中间节点缺失时 set 自动创建对象。
+    """
+    if not tokens:
+        return value, value
+    node = doc
+    for token in tokens[:-1]:
+        found, child = _child(node, token)
+        if not found:
+            if op == "delete" or not isinstance(node, dict):
+                return doc, _MISSING
+            child = node[str(token)] = {}
+        node = child
+    last = tokens[-1]
+    if isinstance(node, dict):
+        key = str(last)
+        if op == "delete":
+            return doc, node.pop(key, _MISSING)
+        node[key] = value
+        return doc, value
+    if isinstance(node, list):
+        if last == "-":
+            if op == "set":
+                node.append(value)
+                return doc, value
+            return doc, _MISSING
+        try:
+            i = int(last)
+        except (TypeError, ValueError):
+            return doc, _MISSING
+        if op == "set" and i == len(node):
+            node.append(value)
+            return doc, value
+        if not -len(node) <= i < len(node):
+            return doc, _MISSING
+        if op == "delete":
+            return doc, node.pop(i)
+        node[i] = value
+        return doc, value
+    return doc, _MISSING
+
+
+def _json_size(value) -> int:
+    return len(json.dumps(value, ensure_ascii=False, separators=(",", ":")).encode("utf-8"))
+
+
+def apply_rules(text: str, rules):
+    """
+    对 JSON 文本依次执行多条规则的操作：只解析一次、只序列化一次。
+    返回 (新文本或 None, {产生改动的规则 id: 改动字节数})；body 不是 JSON 或没有任何改动时新文本为 None。
+    改动字节数为该规则写入（set）或删除（delete）的值序列化后的 UTF-8 长度之和。
+    """
+    try:
+        doc = json.loads(text)
+    except (TypeError, ValueError):
+        return None, {}
+    changed = {}
+    for rule in rules:
+        try:
+            ops = normalize_ops(rule["data"])
+        except ValueError:
+            continue
+        hit = False
+        size = 0
+        for op, tokens, value in ops:
+            # value 来自规则本身，复制后再插入，避免后续操作改到规则数据
+            doc, touched = _apply_one(doc, op, tokens, copy.deepcopy(value))
+            if touched is not _MISSING:
+                hit = True
+                size += _json_size(touched)
+        if hit:
+            changed[rule["id"]] = size
+    if not changed:
+        return None, {}
+    return json.dumps(doc, ensure_ascii=False, separators=(",", ":")), changed
@@ -4,13 +4,22 @@ Mitmproxy 代理服务：基于 Mitmproxy 的流量拦截和录制服务。
 支持 HTTPS 解密、实时拦截和修改流量、数据包录制等功能。
 """
 import asyncio
+import base64
 import threading
 import logging
-import re
+import time
+import uuid
 
 # 导入数据包存储和规则管理器
-from .browser_packets import add_packet
-from .traffic_rules import traffic_rules
+from .browser_packets import add_packet_async, record_async, normalize_session, get_packet, get_packet_body
+from . import ws_messages
+from . import mock_response
+from . import json_patch
+from .traffic_rules import traffic_rules, TrafficRuleManager
+from .body_rewrite import MultiReplacer, should_stream, build_stream_rewriter
+from .proxy_metrics import ProxyMetrics, headers_size, timed_hook
+from .response_cache import response_cache
+from .host_whitelist import ai_api_whitelist
 
 # 禁用 mitmproxy 的所有日志，避免与 Flask 的 Werkzeug 日志冲突
 def _disable_mitmproxy_logging():
@@ -27,118 +36,436 @@ _disable_mitmproxy_logging()
 _log = logging.getLogger(__name__)
 
 # 在禁用日志后再导入 mitmproxy
-from mitmproxy import options, http
+from mitmproxy import options, http, connection
 from mitmproxy.tools.dump import DumpMaster
 
 
+def _proxy_auth_user(value: str):
+    """解析 Proxy-Authorization: Basic base64(user:pass)，返回用户名；无法解析返回 None。"""
+    scheme, _, token = (value or "").strip().partition(" ")
+    if scheme.lower() != "basic" or not token:
+        return None
+    try:
+        user = base64.b64decode(token.strip()).decode("utf-8", "replace").partition(":")[0]
+    except Exception:
+        return None
+    return user or None
+
+
 class AIInterceptorAddon:
     """Mitmproxy 插件：负责流量录制和执行拦截规则"""
+
+    def __init__(self, capture_session: str = None, metrics: ProxyMetrics = None, rules: TrafficRuleManager = None):
+        """
+        Args:
+            capture_session: 本代理实例的默认采集会话名；客户端通过代理认证用户名指定的会话优先
+            metrics: 运行指标收集器，为 None 时不统计
+            rules: 执行的流量规则集，默认全局 traffic_rules
+        """
+        self.capture_session = capture_session
+        self.metrics = metrics
+        self.rules = rules if rules is not None else traffic_rules
+        # 附加监听器：({名称: {port, capture_session, rules, ...}}, {端口: 名称})，整体替换，读取无需加锁
+        self._listener_table = ({}, {})
+        self._conn_sessions = {}  # 客户端连接 id -> CONNECT 时通过代理认证指定的采集会话
+        self._stream_rewriters = {}  # flow id -> 进行中的流式改写回调
+        self._replay_waiters = {}  # flow id -> 等待重放完成的 Future
+        self._inflight = set()  # 已进入请求阶段、尚未完成响应录制的 flow id（排空时等待）
     
-    # AI API 地址白名单：这些地址不会被拦截，始终放行
-    AI_API_WHITELIST = [
-        r'dashscope\.aliyuncs\.com',      # 阿里云百炼
-        r'api\.deepseek\.com',            # 深度求索
-        r'api\.siliconflow\.cn',          # 硅基流动
-    ]
-    
-    def _is_ai_api_request(self, url: str) -> bool:
+    def _is_ai_api_request(self, flow: http.HTTPFlow) -> bool:
         """
-        检查 URL 是否属于 AI API 白名单
+        检查请求是否属于 AI API 白名单（见 host_whitelist，可在设置中配置）
+        结果缓存在 flow.metadata 中，同一 flow 的各个阶段只判断一次
         
-        Args:
-            url: 请求的完整 URL
-            
         Returns:
             True 如果是 AI API 请求，False 否则
         """
-        for pattern in self.AI_API_WHITELIST:
-            if re.search(pattern, url, re.IGNORECASE):
-                return True
-        return False
+        hit = flow.metadata.get("ai_api")
+        if hit is None:
+            hit = flow.metadata["ai_api"] = ai_api_whitelist.match_request(flow.request)
+        return hit
     
+    def set_listeners(self, listeners: dict):
+        """更新附加监听器表（名称 -> 配置），由 MitmProxyService 在监听端口变化时调用"""
+        self._listener_table = (dict(listeners), {cfg["port"]: name for name, cfg in listeners.items()})
+
+    def _listener(self, flow: http.HTTPFlow):
+        """
+        flow 所属的附加监听器配置：重放 flow 按 metadata 中指定的名称，其余按客户端连接的监听端口；
+        来自默认端口的 flow 返回 None（使用本插件的默认会话与规则）。
+        """
+        by_name, by_port = self._listener_table
+        if not by_name:
+            return None
+        name = flow.metadata.get("listener")
+        if name is None:
+            name = flow.metadata["listener"] = by_port.get(flow.client_conn.proxy_mode.custom_listen_port, "")
+        return by_name.get(name)
+
+    def _rules(self, flow: http.HTTPFlow) -> TrafficRuleManager:
+        listener = self._listener(flow)
+        return listener["rules"] if listener else self.rules
+
+    def _default_session(self, flow: http.HTTPFlow):
+        listener = self._listener(flow)
+        return listener["capture_session"] if listener else self.capture_session
+
+    def _resolve_session(self, flow: http.HTTPFlow) -> str:
+        """
+        确定 flow 所属采集会话：mitmproxy proxyauth 认证结果 > 本请求的 Proxy-Authorization 用户名
+        > 同一客户端连接 CONNECT 时的用户名 > 所属监听器（或本代理实例）的默认会话。
+        会从请求中移除 Proxy-Authorization，避免转发给上游。
+        """
+        auth = flow.metadata.get("proxyauth")
+        user = auth[0] if isinstance(auth, (tuple, list)) and auth else None
+        header = flow.request.headers.get("Proxy-Authorization")
+        if header is not None:
+            user = user or _proxy_auth_user(header)
+            del flow.request.headers["Proxy-Authorization"]
+        if not user:
+            user = self._conn_sessions.get(flow.client_conn.id)
+        return normalize_session(user or self._default_session(flow))
+
+    @timed_hook
+    def http_connect(self, flow: http.HTTPFlow):
+        """CONNECT 隧道建立：记住该客户端连接的采集会话，隧道内的请求沿用"""
+        session = self._resolve_session(flow)
+        if session != normalize_session(self._default_session(flow)):
+            self._conn_sessions[flow.client_conn.id] = session
+
+    def client_connected(self, client):
+        if self.metrics is not None:
+            self.metrics.connection("client", 1)
+
+    def client_disconnected(self, client):
+        self._conn_sessions.pop(client.id, None)
+        if self.metrics is not None:
+            self.metrics.connection("client", -1)
+
+    def server_connected(self, data):
+        if self.metrics is not None:
+            self.metrics.connection("server", 1)
+
+    def server_disconnected(self, data):
+        if self.metrics is not None:
+            self.metrics.connection("server", -1)
+
+    @timed_hook
     def request(self, flow: http.HTTPFlow):
         """
         请求阶段处理
         执行请求阶段的拦截规则（如修改请求头、阻断请求等）
         """
+        self._inflight.add(flow.id)
+        if flow.is_replay == "request" and flow.metadata.get("replay_of"):
+            # 重放的录包沿用原录包的采集会话；重放时附带的代理认证头只用于通过 proxyauth，不转发
+            flow.request.headers.pop("Proxy-Authorization", None)
+            flow.metadata["capture_session"] = normalize_session(flow.metadata.get("capture_session") or self.capture_session)
+        else:
+            flow.metadata["capture_session"] = self._resolve_session(flow)
+        if self.metrics is not None:
+            self.metrics.request(headers_size(flow.request.headers) + len(flow.request.raw_content or b""))
         # 检查是否为 AI API 请求，如果是则放行，不执行任何拦截规则
-        if self._is_ai_api_request(flow.request.pretty_url):
+        if self._is_ai_api_request(flow):
             return
         
         # 执行拦截规则（请求阶段）
-        matched_rules = traffic_rules.match_rules(flow, 'request')
-        for rule in matched_rules:
-            if rule['type'] == 'modify_request_header':
-                # 修改请求头
-                key = rule['data'].get('key')
-                value = rule['data'].get('value')
-                if key and value:
-                    flow.request.headers[key] = value
-            elif rule['type'] == 'block_request':
-                # 阻断请求
-                flow.kill()
+        matched_rules = self._rules(flow).match_rules(flow, 'request')
+        if matched_rules:
+            start = time.perf_counter()
+            for rule in matched_rules:
+                if rule['type'] == 'modify_request_header':
+                    # 修改请求头
+                    key = rule['data'].get('key')
+                    value = rule['data'].get('value')
+                    if key and value:
+                        flow.request.headers[key] = value
+                elif rule['type'] == 'block_request':
+                    # 阻断请求
+                    flow.kill()
+                elif rule['type'] == 'mock_response' and flow.response is None:
+                    # 模拟响应：直接应答，不访问上游；body 来源不可用时放行
+                    mocked = mock_response.resolve(rule['data'])
+                    if mocked is not None:
+                        status, headers, body = mocked
+                        flow.response = http.Response.make(status, body, headers)
+                        flow.metadata["mocked_by"] = rule['id']
+            self._rules(flow).record_apply([r['id'] for r in matched_rules], time.perf_counter() - start)
+
+        # 代理缓存：规则执行后（请求头可能已被修改）再查找，重放请求始终访问上游
+        if response_cache.enabled and flow.response is None and not flow.is_replay and flow.live:
+            # 返回协程由 mitmproxy 等待：磁盘层命中时在线程池读文件，不阻塞事件循环
+            return self._serve_from_cache(flow)
+
+    async def _serve_from_cache(self, flow: http.HTTPFlow):
+        cached = await response_cache.lookup_async(flow.request)
+        if cached is None:
+            return
+        status, headers, body, source = cached
+        # 保留重复的响应头（如多个 Link），按原顺序构造
+        fields = [(k.encode("utf-8", "surrogateescape"), v.encode("utf-8", "surrogateescape")) for k, v in headers]
+        response = http.Response.make(status, b"", http.Headers(fields))
+        response.raw_content = body
+        response.headers["content-length"] = str(len(body))
+        flow.response = response
+        flow.metadata["cache"] = source
+
+    @timed_hook
+    def responseheaders(self, flow: http.HTTPFlow):
+        """
+        响应头到达、body 尚未读取时调用
+        大响应（或长度未知）命中修改响应体规则时启用流式改写，避免整体缓冲与解码
+        """
+        if callable(flow.response.stream) or self._is_ai_api_request(flow):
+            return
+        # 超过 stream_large_bodies 的响应已由 mitmproxy 标记为原样流式转发
+        passthrough = bool(flow.response.stream)
+        matched_rules = self._rules(flow).match_rules(flow, 'response')
+        rules = [r for r in matched_rules if r['type'] == 'modify_response_body']
+        # JSON 修改需要完整 body，不走流式改写
+        if (rules and should_stream(flow.response, passthrough)
+                and not any(r['type'] == 'patch_json_body' for r in matched_rules)):
+            rewriter = build_stream_rewriter(flow, rules)
+            if rewriter is not None:
+                flow.response.stream = rewriter
+                flow.metadata["body_streamed"] = True
+                self._stream_rewriters[flow.id] = rewriter
+                return
+        if passthrough:
+            flow.metadata["body_streamed"] = True
+
+    def _record_stream_rewrite(self, flow: http.HTTPFlow):
+        """流式改写结束（或中断）后登记各规则的改写字节数与耗时。"""
+        rewriter = self._stream_rewriters.pop(flow.id, None)
+        if rewriter is not None:
+            rewritten = dict(zip(rewriter.rule_ids, rewriter.replacer.rewritten_bytes()))
+            self._rules(flow).record_apply(rewriter.rule_ids, rewriter.elapsed, rewritten)
 
+    @timed_hook
     def response(self, flow: http.HTTPFlow):
         """
         响应阶段处理
         执行响应阶段的拦截规则（如修改响应体）并录制数据包
         """
-        # 1. 执行拦截规则（响应阶段）
-        matched_rules = traffic_rules.match_rules(flow, 'response')
-        for rule in matched_rules:
-            if rule['type'] == 'modify_response_body':
-                # 修改响应体
-                old_text = rule['data'].get('old_text')
-                new_text = rule['data'].get('new_text')
-                if old_text and new_text and flow.response.text:
-                    flow.response.text = flow.response.text.replace(old_text, new_text)
+        if self._is_ai_api_request(flow):
+            # LLM 流量：不执行规则、不缓存、不录制，只计入代理指标
+            if self.metrics is not None and flow.response is not None:
+                self.metrics.response(headers_size(flow.response.headers) + len(flow.response.raw_content or b""))
+            self._finish_flow(flow)
+            return
+
+        # 0. 代理缓存：保存上游原始响应（改写规则执行前），缓存命中与模拟响应不再写入
+        if (response_cache.enabled and not flow.metadata.get("cache") and not flow.metadata.get("mocked_by")
+                and not flow.metadata.get("body_streamed")):
+            response_cache.store(flow.request, flow.response)
+
+        # 1. 执行拦截规则（响应阶段）；已流式改写的响应 body 不在此处处理
+        # 同一 flow 命中的多条修改响应体规则合并为一次扫描
+        matched_rules = self._rules(flow).match_rules(flow, 'response')
+        streamed_bytes = None
+        streamed_head = None
+        if flow.metadata.get("body_streamed"):
+            rewriter = self._stream_rewriters.get(flow.id)
+            streamed_bytes = rewriter.bytes_out if rewriter is not None else 0
+            if rewriter is not None:
+                streamed_head = bytes(rewriter.head)
+            self._record_stream_rewrite(flow)
+        else:
+            # 多条 JSON 修改规则共用一次解析与序列化，之后再执行文本替换
+            json_rules = [r for r in matched_rules if r['type'] == 'patch_json_body']
+            if json_rules:
+                start = time.perf_counter()
+                patched, changed = json_patch.apply_rules(flow.response.get_text(strict=False), json_rules)
+                if patched is not None:
+                    flow.response.text = patched
+                    rewritten = changed
+                else:
+                    rewritten = None
+                self._rules(flow).record_apply([r['id'] for r in json_rules], time.perf_counter() - start, rewritten)
+            replacements = []
+            rule_ids = []
+            for rule in matched_rules:
+                if rule['type'] == 'modify_response_body':
+                    old_text = rule['data'].get('old_text')
+                    new_text = rule['data'].get('new_text')
+                    if old_text and new_text:
+                        replacements.append((old_text, new_text))
+                        rule_ids.append(rule['id'])
+            if replacements:
+                start = time.perf_counter()
+                replacer = MultiReplacer(replacements)
+                text = flow.response.text
+                if text:
+                    flow.response.text = replacer.replace(text)
+                rewritten = dict(zip(rule_ids, replacer.rewritten_bytes()))
+                self._rules(flow).record_apply(rule_ids, time.perf_counter() - start, rewritten)
+
+        if self.metrics is not None and flow.response is not None:
+            body_size = streamed_bytes if streamed_bytes is not None else len(flow.response.raw_content or b"")
+            self.metrics.response(headers_size(flow.response.headers) + body_size)
 
         # 2. 录制数据包到现有的存储系统 (browser_packets)
-        # 将 mitmproxy 的对象转换为现有 UI 需要的格式
+        # 热路径上只取线上原始字节（raw_content 不解压、不解码），嗅探与解码预览交给录包线程
         try:
             req_headers = dict(flow.request.headers) if flow.request.headers else {}
             resp_headers = dict(flow.response.headers) if flow.response and flow.response.headers else {}
-            
-            # 简单处理 body 预览（限制为前 1024 字节）
-            req_body = ""
-            resp_body = ""
-            
-            if flow.request.content:
-                req_body = flow.request.content[:1024].decode('utf-8', 'ignore')
-                
-            if flow.response and flow.response.content:
-                resp_body = flow.response.content[:1024].decode('utf-8', 'ignore')
-
-            add_packet(
+            add_packet_async(
                 method=flow.request.method,
                 url=flow.request.pretty_url,
                 request_headers=req_headers,
-                request_body=req_body,
+                request_body=flow.request.raw_content or b"",
                 response_status=flow.response.status_code if flow.response else 0,
                 response_headers=resp_headers,
-                response_body=resp_body
+                response_body=streamed_head if streamed_head is not None else (flow.response.raw_content or b"") if flow.response else b"",
+                session=flow.metadata.get("capture_session") or self.capture_session,
+                packet_id=flow.metadata.get("replay_packet_id"),
+                replay_of=flow.metadata.get("replay_of"),
+                response_truncated=streamed_bytes is not None and (streamed_head is None or streamed_bytes > len(streamed_head)),
             )
         except Exception as e:
             _log.debug("Error recording packet: %s", e)
+        self._finish_flow(flow)
+
+    @timed_hook
+    def error(self, flow: http.HTTPFlow):
+        """flow 出错（如连接中断）：流式改写未正常结束时也要释放并登记"""
+        self._record_stream_rewrite(flow)
+        self._finish_flow(flow)
+
+    def wait_replay(self, flow: http.HTTPFlow) -> asyncio.Future:
+        """登记一个重放 flow，返回在其 response 或 error 钩子执行完后完成的 Future（须在代理事件循环中调用）"""
+        waiter = asyncio.get_running_loop().create_future()
+        self._replay_waiters[flow.id] = waiter
+        return waiter
+
+    def cancel_replay(self, flow: http.HTTPFlow):
+        self._replay_waiters.pop(flow.id, None)
+
+    @property
+    def inflight(self) -> int:
+        """在途（已收到请求、尚未录制完成）的 flow 数"""
+        return len(self._inflight)
+
+    def _finish_flow(self, flow: http.HTTPFlow):
+        """flow 结束（响应已录制或出错）：移出在途集合，并唤醒等待该重放的调用方"""
+        self._inflight.discard(flow.id)
+        waiter = self._replay_waiters.pop(flow.id, None)
+        if waiter is not None and not waiter.done():
+            waiter.set_result(flow)
+
+    @timed_hook
+    def websocket_start(self, flow: http.HTTPFlow):
+        """WebSocket 握手完成：登记连接（AI API 的连接不录制）"""
+        if flow.metadata.get("ai_api"):
+            return
+        record_async(
+            ws_messages.start_connection,
+            conn_id=flow.id,
+            url=flow.request.pretty_url,
+            session=flow.metadata.get("capture_session") or self.capture_session,
+        )
+
+    @timed_hook
+    def websocket_message(self, flow: http.HTTPFlow):
+        """
+        WebSocket 消息：将最新一帧交给录包线程写入有界环形缓冲。
+        录制后只保留 flow 中的最后一帧，避免长连接在 mitmproxy 内部无限累积消息。
+        """
+        try:
+            messages = flow.websocket.messages
+            if flow.metadata.get("ai_api"):
+                del messages[:-1]
+                return
+            msg = messages[-1]
+            record_async(
+                ws_messages.add_frame,
+                conn_id=flow.id,
+                url=flow.request.pretty_url,
+                from_client=msg.from_client,
+                opcode=int(msg.type),
+                payload=msg.content,
+                timestamp=msg.timestamp,
+            )
+            if len(messages) > 1:
+                del messages[:-1]
+        except Exception as e:
+            _log.debug("Error recording websocket message: %s", e)
+
+    @timed_hook
+    def websocket_end(self, flow: http.HTTPFlow):
+        """WebSocket 连接关闭"""
+        if flow.metadata.get("ai_api"):
+            return
+        close_code = getattr(flow.websocket, "close_code", None) if flow.websocket else None
+        record_async(ws_messages.end_connection, conn_id=flow.id, close_code=close_code)
+
+
+# 重放时由 mitmproxy 按实际 body 重新生成或不适用于新连接的请求头
+_REPLAY_DROP_HEADERS = {"content-length", "transfer-encoding", "connection", "keep-alive",
+                        "proxy-authorization", "proxy-connection"}
+
+
+def build_replay_flow(packet_id: str, listener: str = None):
+    """
+    由录包构造交给 mitmproxy 客户端重放的 flow：请求体为 body_store 中的完整原始字节（保留 Content-Encoding）。
+    预先分配新录包 id，响应录制时写入该 id，并以 replay_of 关联原录包。录包不存在返回 None。
+    listener 指定时按该附加监听器的规则集执行。
+    """
+    packet = get_packet(packet_id)
+    if not packet:
+        return None
+    method = (packet.get("method") or "GET").upper()
+    headers = {k: v for k, v in (packet.get("request_headers") or {}).items() if k.lower() not in _REPLAY_DROP_HEADERS}
+    raw = get_packet_body(packet_id, part="request", decode=False)
+    body = raw[0] if raw else b""
+    request = http.Request.make(method, packet.get("url") or "", b"", headers)
+    request.raw_content = body
+    if body or method in ("POST", "PUT", "PATCH"):
+        request.headers["content-length"] = str(len(body))
+    elif "content-length" in request.headers:
+        del request.headers["content-length"]
+    # 开启代理认证采集会话时重放请求同样须通过 proxyauth（接受任意账号），在请求阶段移除
+    request.headers["Proxy-Authorization"] = "Basic " + base64.b64encode(b"replay:").decode("ascii")
+    client = connection.Client(peername=("127.0.0.1", 0), sockname=("127.0.0.1", 0), timestamp_start=time.time())
+    flow = http.HTTPFlow(client, connection.Server(address=(request.host, request.port)))
+    flow.request = request
+    flow.metadata["replay_of"] = packet_id
+    flow.metadata["replay_packet_id"] = str(uuid.uuid4())[:8]
+    flow.metadata["capture_session"] = packet.get("session")
+    if listener:
+        flow.metadata["listener"] = listener
+    return flow
 
 
 class MitmProxyService:
     """Mitmproxy 代理服务封装类，管理代理的启动和停止"""
     
-    def __init__(self, host="127.0.0.1", port=8080):
+    def __init__(self, host="127.0.0.1", port=8080, capture_session=None, proxy_auth_sessions=False, proxy_options=None):
         """
         初始化 Mitmproxy 服务
         
         Args:
             host: 监听地址，默认 127.0.0.1
             port: 监听端口，默认 8080
+            capture_session: 本端口录包写入的采集会话，默认 default
+            proxy_auth_sessions: 为 True 时要求代理认证（接受任意账号），以用户名作为采集会话
+            proxy_options: 启动时应用的其它 mitmproxy 选项（如 stream_large_bodies、http2、ignore_hosts）
         """
         self.host = host
         self.port = port
+        self.capture_session = capture_session
+        self.proxy_auth_sessions = proxy_auth_sessions
+        self.proxy_options = dict(proxy_options or {})
+        if proxy_auth_sessions:
+            self.proxy_options["proxyauth"] = "any"
+        self.listeners = {}  # 附加监听器名称 -> {port, host, capture_session, rules, isolated, started_at}
+        self._listeners_lock = threading.Lock()
         self.master = None
         self.loop = None
         self.thread = None
         self._started = False
+        self._addon = None
+        self.metrics = ProxyMetrics()
 
     def start(self) -> int:
         """
@@ -150,6 +477,7 @@ class MitmProxyService:
         if self._started:
             return self.port
             
+        self.metrics = ProxyMetrics()
         self.loop = asyncio.new_event_loop()
         self.thread = threading.Thread(target=self._run_loop, daemon=True)
         self.thread.start()
@@ -167,9 +495,17 @@ class MitmProxyService:
             # 在事件循环运行中创建 DumpMaster
             async def create_and_run():
                 self.master = DumpMaster(opts, with_termlog=False, with_dumper=False)
+                # 重放请求互不等待，各自完成后即返回；调优选项（含 proxyauth）由插件注册，须在 DumpMaster 创建后设置
+                self.master.options.update(client_replay_concurrency=-1, **self.proxy_options)
                 # 添加自定义插件
-                self.master.addons.add(AIInterceptorAddon())
-                await self.master.run()
+                self._addon = AIInterceptorAddon(self.capture_session, self.metrics)
+                self.master.addons.add(self._addon)
+                # 事件循环延迟探测与代理同在一个循环中运行
+                probe = asyncio.ensure_future(self.metrics.probe_event_loop())
+                try:
+                    await self.master.run()
+                finally:
+                    probe.cancel()
             
             self.loop.run_until_complete(create_and_run())
         except Exception as e:
@@ -177,11 +513,214 @@ class MitmProxyService:
         finally:
             self.loop.close()
 
-    def stop(self):
-        """停止 Mitmproxy 代理服务"""
+    def _wait_ready(self, timeout: float = 5.0) -> bool:
+        """等待代理事件循环与插件就绪（start 之后 DumpMaster 在后台线程中创建）"""
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            if self._addon is not None and self.loop is not None and self.loop.is_running():
+                return True
+            if not self._started or (self.thread is not None and not self.thread.is_alive()):
+                return False
+            time.sleep(0.02)
+        return False
+
+    def wait_listening(self, timeout: float = 5.0):
+        """
+        等待监听端口就绪。成功返回 None，失败返回错误说明（如端口被占用）。
+        mitmproxy 监听失败不会退出事件循环，需检查 proxyserver 的服务实例状态。
+        """
+        deadline = time.time() + timeout
+        if not self._wait_ready(timeout):
+            return "代理未能启动"
+        server = self.master.addons.get("proxyserver")
+        while time.time() < deadline:
+            instances = list(server.servers) if server is not None else []
+            if instances and all(inst.is_running for inst in instances):
+                return None
+            for inst in instances:
+                if inst.last_exception is not None:
+                    return str(inst.last_exception).split("\n")[0]
+            time.sleep(0.02)
+        return "等待监听超时"
+
+    @staticmethod
+    def _listener_mode(host: str, port: int) -> str:
+        return f"regular@{host}:{port}" if host else f"regular@{port}"
+
+    async def _apply_modes(self, modes):
+        """在代理事件循环中更新监听模式列表，等待端口增减完成"""
+        self.master.options.update(mode=modes)
+        server = self.master.addons.get("proxyserver")
+        task = getattr(server, "_update_task", None)
+        if task is not None:
+            await task
+
+    def _run_in_loop(self, coro, timeout: float = 10.0):
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result(timeout)
+
+    async def _update_options(self, proxy_options: dict):
+        self.master.options.update(**proxy_options)
+
+    def apply_options(self, proxy_options: dict):
+        """
+        在运行中的代理上直接更新 mitmproxy 选项：监听端口不关闭，已有连接沿用旧选项，新连接与新请求使用新选项。
+        代理未运行抛出 RuntimeError，选项非法抛出 mitmproxy 的 OptionsError。
+        """
+        if not self._wait_ready():
+            raise RuntimeError("代理未运行")
+        self._run_in_loop(self._update_options(proxy_options))
+        self.proxy_options = dict(proxy_options)
+
+    async def _close_clients(self, timeout: float = 1.0):
+        """断开所有客户端连接（与 mitmproxy 空闲超时断开的方式相同），等待连接处理结束，至多 timeout 秒"""
+        server = self.master.addons.get("proxyserver")
+        for handler in list(server.connections.values()):
+            io = handler.transports.get(handler.client)
+            if io is not None and io.handler is not None:
+                io.handler.cancel("proxy restart")
+        deadline = time.time() + timeout
+        while server.connections and time.time() < deadline:
+            await asyncio.sleep(0.02)
+
+    def drain(self, timeout: float = 10.0) -> int:
+        """
+        排空代理：关闭所有监听端口（不再接受新连接），等待在途请求完成，至多 timeout 秒；
+        随后断开仍保持的客户端连接（如 keep-alive），客户端会重新连接到重启后的实例，
+        而不是停在已无人服务的旧连接上。返回断开时仍在途的 flow 数。
+        """
+        if not self._wait_ready(1.0):
+            return 0
+        deadline = time.time() + max(0.0, timeout)
+        try:
+            self._run_in_loop(self._apply_modes([]), timeout=max(1.0, timeout))
+        except Exception as e:
+            _log.debug("Mitmproxy drain error: %s", e)
+        while self._addon.inflight and time.time() < deadline:
+            time.sleep(0.02)
+        in_flight = self._addon.inflight
+        try:
+            self._run_in_loop(self._close_clients(), timeout=5.0)
+        except Exception as e:
+            _log.debug("Mitmproxy close clients error: %s", e)
+        return in_flight
+
+    def add_listener(self, name: str, port: int, host: str = "0.0.0.0", capture_session: str = None,
+                     rules: TrafficRuleManager = None, isolated: bool = False):
+        """
+        在运行中的代理上增加一个监听端口（与默认端口共用同一事件循环与 mitmproxy 实例）。
+        该端口进入的流量录入 capture_session，执行 rules（默认全局规则）。
+        成功返回 None，失败返回错误说明（端口被占用等）。
+        """
+        if not self._wait_ready():
+            return "代理未运行"
+        mode = self._listener_mode(host, port)
+        with self._listeners_lock:
+            if name in self.listeners:
+                return f"监听器 {name} 已存在"
+            if port == self.port or any(cfg["port"] == port for cfg in self.listeners.values()):
+                return f"端口 {port} 已被其它监听器使用"
+            modes = list(self.master.options.mode)
+            cfg = {"port": port, "host": host, "mode": mode, "capture_session": capture_session,
+                   "rules": rules if rules is not None else traffic_rules, "isolated": bool(isolated),
+                   "started_at": time.time()}
+            # 先登记再监听，端口就绪后进入的第一个连接即可找到所属监听器
+            listeners = dict(self.listeners, **{name: cfg})
+            self._addon.set_listeners(listeners)
+            try:
+                self._run_in_loop(self._apply_modes(modes + [mode]))
+                error = None
+                for inst in self.master.addons.get("proxyserver").servers:
+                    if inst.mode.full_spec == mode and not inst.is_running:
+                        error = str(inst.last_exception or "监听失败").split("\n")[0]
+            except Exception as e:
+                error = str(e) or "监听失败"
+            if error:
+                try:
+                    self._run_in_loop(self._apply_modes(modes))
+                except Exception:
+                    pass
+                self._addon.set_listeners(self.listeners)
+                return error
+            self.listeners = listeners
+        return None
+
+    def remove_listener(self, name: str) -> bool:
+        """关闭附加监听端口，不存在返回 False"""
+        with self._listeners_lock:
+            cfg = self.listeners.get(name)
+            if cfg is None:
+                return False
+            if self._wait_ready():
+                modes = [m for m in self.master.options.mode if m != cfg["mode"]]
+                try:
+                    self._run_in_loop(self._apply_modes(modes))
+                except Exception:
+                    pass
+            self.listeners = {k: v for k, v in self.listeners.items() if k != name}
+            if self._addon is not None:
+                self._addon.set_listeners(self.listeners)
+        return True
+
+    async def _replay_flow(self, flow: http.HTTPFlow, timeout: float):
+        waiter = self._addon.wait_replay(flow)
+        try:
+            self.master.addons.get("clientplayback").start_replay([flow])
+            return await asyncio.wait_for(waiter, timeout)
+        finally:
+            self._addon.cancel_replay(flow)
+
+    def replay(self, packet_id: str, timeout: float = 30.0, listener: str = None):
+        """
+        通过运行中的代理重放录包（mitmproxy 客户端重放），流量规则与录制逻辑与普通请求一致。
+        返回 {packet_id, replay_of, status, headers, body, content_type, error}，body 为解压后的字节；
+        新响应录为 id 为 packet_id 的新录包。录包不存在返回 None，代理未就绪抛出 RuntimeError，超时抛出 TimeoutError。
+        listener 指定附加监听器时按其规则集执行。
+        """
+        if not self._wait_ready():
+            raise RuntimeError("代理未运行")
+        if listener and listener not in self.listeners:
+            raise RuntimeError(f"监听器 {listener} 不存在")
+        flow = build_replay_flow(packet_id, listener)
+        if flow is None:
+            return None
+        future = asyncio.run_coroutine_threadsafe(self._replay_flow(flow, timeout), self.loop)
+        try:
+            flow = future.result(timeout + 1)
+        except TimeoutError:
+            future.cancel()
+            raise TimeoutError(f"重放超时（{timeout:g} 秒）")
+        result = {
+            "packet_id": flow.metadata.get("replay_packet_id"),
+            "replay_of": packet_id,
+            "status": None,
+            "headers": {},
+            "body": b"",
+            "content_type": "",
+            "error": flow.error.msg if flow.error else None,
+        }
+        response = flow.response
+        if response is not None:
+            try:
+                body = response.content
+            except ValueError:
+                body = response.raw_content
+            result.update(status=response.status_code, headers=dict(response.headers), body=body or b"",
+                          content_type=response.headers.get("content-type", ""))
+            if flow.metadata.get("body_streamed"):
+                # 流式改写的响应 body 未在代理内缓冲
+                result["error"] = "响应已流式转发，body 未缓冲"
+        return result
+
+    def stop(self, wait: float = 0):
+        """停止 Mitmproxy 代理服务；wait 大于 0 时等待事件循环线程退出（端口释放）至多 wait 秒"""
         if self.master:
-            self.master.shutdown()
+            try:
+                self.master.shutdown()
+            except RuntimeError:
+                pass  # 启动失败时事件循环已关闭，无需再通知退出
         self._started = False
+        if wait and self.thread is not None:
+            self.thread.join(wait)
 
     @property
     def proxy_url(self) -> str:
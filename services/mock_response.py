@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+"""
+mock_response 规则：在请求阶段直接由代理应答，不访问上游。
+响应体来源三选一：data.body（内联文本）、data.body_file（本地文件）、data.packet_id（已录制录包的响应）。
+文件与录包 body 在添加、加载规则时读入内存，文件修改由规则热加载线程定期检查，请求阶段不读磁盘。
+"""
+import threading
+from pathlib import Path
+
+from . import browser_packets
+
+# 逐跳头与长度头不沿用，由 mitmproxy 按新 body 重新生成
+_DROP_HEADERS = {"content-length", "transfer-encoding", "connection", "keep-alive", "content-encoding"}
+
+_BODIES = {}  # 来源 -> (文件 mtime_ns 或 None, body bytes)
+_lock = threading.Lock()
+
+
+def validate(data: dict, check_sources: bool = True):
+    """
+    校验 mock_response 的 data，合法返回 None，否则返回错误说明。
+    check_sources 为 True 时同时检查 body_file 与 packet_id 当前是否存在（添加规则时检查，从文件加载时不检查）。
+    """
+    if not any(k in data for k in ("body", "body_file", "packet_id")):
+        return "模拟响应需要提供 body、body_file 或 packet_id 之一"
+    status = data.get("status", 200)
+    try:
+        if not 100 <= int(status) <= 599:
+            return "status 须在 100-599 之间"
+    except (TypeError, ValueError):
+        return "status 须为整数"
+    if "headers" in data and not isinstance(data["headers"], dict):
+        return "headers 须为对象"
+    if not check_sources:
+        return None
+    if "body_file" in data and not Path(str(data["body_file"])).is_file():
+        return f"body_file 不存在: {data['body_file']}"
+    if "packet_id" in data and not browser_packets.get_packet(str(data["packet_id"])):
+        return f"未找到 ID 为 {data['packet_id']} 的数据包"
+    return None
+
+
+def _source(data: dict):
+    """规则引用的外部 body 来源：("packet", id)、("file", 路径)；内联 body 返回 None。"""
+    if "packet_id" in data:
+        return ("packet", str(data["packet_id"]))
+    if "body_file" in data:
+        return ("file", str(data["body_file"]))
+    return None
+
+
+def preload(data: dict):
+    """
+    读取规则引用的 body 来源并缓存，供 resolve 在代理事件循环内直接取用。
+    添加、加载规则时在写锁外调用；文件按 mtime 判断是否需要重新读取，录包 body 不会变化只读一次。
+    来源不可用时移除旧缓存，resolve 随之放行。
+    """
+    source = _source(data)
+    if source is None:
+        return
+    kind, key = source
+    if kind == "file":
+        p = Path(key)
+        try:
+            version = p.stat().st_mtime_ns
+        except OSError:
+            version = None
+        with _lock:
+            cached = _BODIES.get(source)
+        if version is not None and cached is not None and cached[0] == version:
+            return
+        try:
+            body = p.read_bytes() if version is not None else None
+        except OSError:
+            body = None
+    else:
+        version = body = None
+        if browser_packets.get_packet(key):
+            with _lock:
+                if source in _BODIES:
+                    return
+            body = browser_packets.get_packet_body(key, part="response")
+            body = body[0] if body is not None else None
+    with _lock:
+        if body is None:
+            _BODIES.pop(source, None)
+        else:
+            _BODIES[source] = (version, body)
+
+
+def refresh(items):
+    """
+    按当前全部 mock_response 规则的 data 重新检查来源（规则热加载线程定期调用）：
+    读取修改过的文件、补读此前不可用的来源，并丢弃已无规则引用的缓存。
+    """
+    sources = set()
+    for data in items:
+        preload(data)
+        sources.add(_source(data))
+    with _lock:
+        for source in [s for s in _BODIES if s not in sources]:
+            del _BODIES[source]
+
+
+def resolve(data: dict):
+    """
+    按规则 data 生成模拟响应：(status, headers dict, body bytes)。在代理事件循环内调用，只读 preload 的缓存，不做磁盘 I/O。
+    body 来源不可用（文件被删除、录包已淘汰、尚未读取）时返回 None，由调用方放行到上游。
+    """
+    status = int(data.get("status", 200))
+    headers = {}
+    source = _source(data)
+    if source is not None:
+        with _lock:
+            cached = _BODIES.get(source)
+        if cached is None:
+            return None
+        body = cached[1]
+    if "packet_id" in data:
+        packet = browser_packets.get_packet(str(data["packet_id"]))
+        if not packet:
+            return None
+        if "status" not in data:
+            status = int(packet.get("response_status") or 200)
+        headers = {k: v for k, v in (packet.get("response_headers") or {}).items() if k.lower() not in _DROP_HEADERS}
+    elif source is None:
+        body = data.get("body") or ""
+        if isinstance(body, str):
+            body = body.encode("utf-8")
+    override = {str(k): str(v) for k, v in (data.get("headers") or {}).items()}
+    if override:
+        names = {k.lower() for k in override}
+        headers = {k: v for k, v in headers.items() if k.lower() not in names}
+        headers.update(override)
+    return status, headers, body
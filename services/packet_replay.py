@@ -0,0 +1,241 @@
+# -*- coding: utf-8 -*-
+"""
+批量重发录包：多个录包或同一录包的多组参数变体并发重发，用于对比测试。
+- 共用一个带连接池的 requests.Session（keep-alive），同一主机的连接在任务间复用；
+- 线程池限制总并发，按主机限速（每秒请求数），避免压垮目标；
+- 请求体取 body_store 中的完整原始字节，不使用截断的预览；
+- 结果为紧凑表格：状态码、响应长度、耗时、响应体哈希、是否与原录包响应一致，完整响应体不返回。
+"""
+import hashlib
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.cookiejar import DefaultCookiePolicy
+from urllib.parse import urlsplit, urlencode, unquote_plus, urlunsplit
+
+import requests
+import urllib3
+from requests.adapters import HTTPAdapter
+
+from . import browser_packets
+from . import json_patch
+
+urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+
+MAX_JOBS = 500  # 单次批量重发最多任务数
+MAX_CONCURRENCY = 32
+_POOL_SIZE = MAX_CONCURRENCY
+# 逐跳头与由 requests 按新 body 重新生成的头不沿用
+_UNSAFE_HEADERS = {"content-length", "host", "connection", "keep-alive", "transfer-encoding",
+                   "upgrade-insecure-requests", "proxy-authorization", "proxy-connection"}
+RESULT_COLUMNS = ["packet_id", "variant", "method", "url", "status", "length", "time_ms", "body_hash", "same_body", "error"]
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def _get_session() -> requests.Session:
+    """进程内共用的连接池 Session。不保存 Cookie，各次重发只使用录包自身的 Cookie 头。"""
+    global _session
+    with _session_lock:
+        if _session is None:
+            s = requests.Session()
+            adapter = HTTPAdapter(pool_connections=_POOL_SIZE, pool_maxsize=_POOL_SIZE, max_retries=0)
+            s.mount("http://", adapter)
+            s.mount("https://", adapter)
+            s.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+            s.verify = False
+            _session = s
+        return _session
+
+
+class _HostRateLimiter:
+    """按主机限速：同一主机相邻两次请求的发出时间至少间隔 1 / rps 秒。"""
+
+    def __init__(self, rps: float):
+        self._interval = 1.0 / rps if rps else 0.0
+        self._next = {}  # host -> 下一个可用的发出时间
+        self._lock = threading.Lock()
+
+    def wait(self, host: str):
+        if not self._interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next.get(host, now))
+            self._next[host] = slot + self._interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+def _with_params(url: str, params: dict) -> str:
+    """合并 query 参数：同名参数替换，值为 None 时删除；未涉及的参数保留原始写法（不重新编码）。"""
+    parts = urlsplit(url)
+    kept = [seg for seg in parts.query.split("&")
+            if seg and unquote_plus(seg.partition("=")[0]) not in params]
+    added = urlencode([(k, str(v)) for k, v in params.items() if v is not None])
+    return urlunsplit(parts._replace(query="&".join(kept + ([added] if added else []))))
+
+
+def build_request(packet_id: str, variant: dict = None):
+    """
+    由录包构造请求：(method, url, headers, body bytes)。录包不存在返回 None，变体非法抛出 ValueError。
+    variant 可包含：
+    - method / url：替换方法或完整 URL；
+    - params：合并到 query 的参数（值为 null 删除该参数）；
+    - headers：合并的请求头（值为 null 删除该头）；
+    - body：替换整个请求体（字符串）；
+    - ops：对 JSON 请求体执行 set/delete，格式同 patch_json_body 规则。
+    """
+    packet = browser_packets.get_packet(packet_id)
+    if not packet:
+        return None
+    variant = variant or {}
+    method = str(variant.get("method") or packet.get("method") or "GET").upper()
+    url = variant.get("url") or packet.get("url") or ""
+    if variant.get("params"):
+        if not isinstance(variant["params"], dict):
+            raise ValueError("params 须为对象")
+        url = _with_params(url, variant["params"])
+
+    headers = {k: v for k, v in (packet.get("request_headers") or {}).items() if k.lower() not in _UNSAFE_HEADERS}
+    override = variant.get("headers") or {}
+    if not isinstance(override, dict):
+        raise ValueError("headers 须为对象")
+    if override:
+        names = {k.lower() for k in override}
+        headers = {k: v for k, v in headers.items() if k.lower() not in names}
+        headers.update({str(k): str(v) for k, v in override.items() if v is not None})
+
+    if "body" in variant:
+        body = variant["body"]
+        body = body.encode("utf-8") if isinstance(body, str) else json.dumps(body, ensure_ascii=False).encode("utf-8")
+        headers = {k: v for k, v in headers.items() if k.lower() != "content-encoding"}
+    else:
+        # 保留原始线上字节（含 Content-Encoding），与原请求完全一致
+        raw = browser_packets.get_packet_body(packet_id, part="request", decode=bool(variant.get("ops")))
+        body = raw[0] if raw else b""
+    if variant.get("ops"):
+        json_patch.normalize_ops({"ops": variant["ops"]})
+        try:
+            json.loads(body or b"null")
+        except ValueError:
+            raise ValueError("请求体不是 JSON，无法执行 ops")
+        text, _ = json_patch.apply_rules(body.decode("utf-8"), [{"id": 0, "data": {"ops": variant["ops"]}}])
+        if text is not None:
+            body = text.encode("utf-8")
+        headers = {k: v for k, v in headers.items() if k.lower() != "content-encoding"}
+    return method, url, headers, body
+
+
+def body_hash(data: bytes) -> str:
+    return hashlib.sha256(data or b"").hexdigest()[:16]
+
+
+def _original_hash(packet_id: str):
+    """原录包响应体（解压后）的哈希，body 不可用时返回 None。"""
+    stored = browser_packets.get_packet_body(packet_id, part="response")
+    return body_hash(stored[0]) if stored else None
+
+
+def _send(session, limiter, job, timeout):
+    packet_id, index, method, url, headers, body = job
+    row = {"packet_id": packet_id, "variant": index, "method": method, "url": url,
+           "status": None, "length": None, "time_ms": None, "body_hash": None, "same_body": None, "error": None}
+    limiter.wait(urlsplit(url).netloc)
+    start = time.perf_counter()
+    try:
+        resp = session.request(method, url, headers=headers, data=body or None,
+                               timeout=timeout, allow_redirects=False)
+        content = resp.content
+        row.update(status=resp.status_code, length=len(content), body_hash=body_hash(content))
+    except Exception as e:
+        # 含非 latin-1 请求头导致的 UnicodeEncodeError 等：只记入本任务，不影响同批其它任务
+        row["error"] = str(e)[:200]
+    row["time_ms"] = round((time.perf_counter() - start) * 1000, 1)
+    return row
+
+
+def send_direct(packet_id: str, timeout: float = 30):
+    """
+    不经过代理直接重发单个录包（代理不可用时的回退）：不执行流量规则，也不录制新录包。
+    返回结构同 MitmProxyService.replay（packet_id 为 None），录包不存在返回 None。
+    """
+    built = build_request(packet_id)
+    if built is None:
+        return None
+    method, url, headers, body = built
+    result = {"packet_id": None, "replay_of": packet_id, "status": None, "headers": {},
+              "body": b"", "content_type": "", "error": None}
+    try:
+        resp = _get_session().request(method, url, headers=headers, data=body or None,
+                                      timeout=timeout, allow_redirects=False)
+    except Exception as e:
+        result["error"] = str(e)
+        return result
+    result.update(status=resp.status_code, headers=dict(resp.headers), body=resp.content,
+                  content_type=resp.headers.get("content-type", ""))
+    return result
+
+
+def replay_many(packet_ids, variants=None, concurrency: int = 8, per_host_rps: float = None, timeout: float = 30):
+    """
+    并发重发：每个录包 × 每组变体为一个任务（未提供变体时按原样重发一次）。
+    返回 {columns, rows, summary}；rows 为与 columns 对应的数组，按任务顺序排列。
+    录包不存在或变体非法的任务在 error 列说明，不影响其它任务。
+    """
+    variants = variants or [{}]
+    jobs = []
+    rows = [None] * (len(packet_ids) * len(variants))
+    if len(rows) > MAX_JOBS:
+        raise ValueError(f"任务数 {len(rows)} 超过上限 {MAX_JOBS}")
+    slot = 0
+    for pid in packet_ids:
+        for index, variant in enumerate(variants):
+            try:
+                built = build_request(pid, variant)
+                error = None if built else f"未找到 ID 为 {pid} 的数据包"
+            except ValueError as e:
+                built, error = None, str(e)
+            if built is None:
+                rows[slot] = {"packet_id": pid, "variant": index, "method": None, "url": None, "status": None,
+                              "length": None, "time_ms": None, "body_hash": None, "same_body": None, "error": error}
+            else:
+                jobs.append((slot, (pid, index) + built))
+            slot += 1
+
+    session = _get_session()
+    limiter = _HostRateLimiter(per_host_rps)
+    concurrency = max(1, min(MAX_CONCURRENCY, int(concurrency or 1)))
+    start = time.perf_counter()
+    if jobs:
+        with ThreadPoolExecutor(max_workers=min(concurrency, len(jobs))) as pool:
+            futures = [(slot, pool.submit(_send, session, limiter, job, timeout)) for slot, job in jobs]
+            for slot, future in futures:
+                rows[slot] = future.result()
+    elapsed = time.perf_counter() - start
+
+    originals = {}
+    for r in rows:
+        if r["body_hash"] is None:
+            continue
+        if r["packet_id"] not in originals:
+            originals[r["packet_id"]] = _original_hash(r["packet_id"])
+        orig = originals[r["packet_id"]]
+        r["same_body"] = None if orig is None else r["body_hash"] == orig
+
+    statuses = {}
+    for r in rows:
+        key = str(r["status"]) if r["status"] is not None else "error"
+        statuses[key] = statuses.get(key, 0) + 1
+    return {
+        "columns": RESULT_COLUMNS,
+        "rows": [[r[c] for c in RESULT_COLUMNS] for r in rows],
+        "summary": {
+            "total": len(rows),
+            "elapsed_ms": round(elapsed * 1000, 1),
+            "status_counts": statuses,
+            "distinct_body_hashes": len({r["body_hash"] for r in rows if r["body_hash"]}),
+        },
+    }
@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+"""
+代理运行指标：活动连接数、请求速率、收发字节、插件钩子耗时与事件循环延迟。
+每个 MitmProxyService 持有一个 ProxyMetrics，由 AIInterceptorAddon 在钩子中更新，snapshot() 供接口读取。
+"""
+import asyncio
+import functools
+import threading
+import time
+from collections import deque
+
+_RATE_WINDOW = 10  # 请求速率按最近 10 秒计算
+_LAG_INTERVAL = 0.5  # 事件循环延迟探测间隔（秒）
+_LAG_SAMPLES = 120
+
+
+def headers_size(headers) -> int:
+    """估算 header 线上字节数（name: value\r\n）。"""
+    if not headers:
+        return 0
+    return sum(len(k) + len(v) + 4 for k, v in headers.items())
+
+
+class ProxyMetrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.started_at = time.time()
+        self.client_connections = 0
+        self.server_connections = 0
+        self.requests_total = 0
+        self.responses_total = 0
+        self.bytes_in = 0  # 客户端发往代理的请求（头 + body）
+        self.bytes_out = 0  # 代理返回客户端的响应（头 + body）
+        self._buckets = deque()  # [(整秒时间戳, 请求数)]
+        self._hooks = {}  # 钩子名 -> [调用次数, 累计耗时, 最大耗时]
+        self._lag = deque(maxlen=_LAG_SAMPLES)  # 最近的事件循环延迟样本（秒）
+
+    def connection(self, side: str, delta: int):
+        """side 为 client 或 server，delta 为 +1 / -1。"""
+        with self._lock:
+            if side == "client":
+                self.client_connections = max(0, self.client_connections + delta)
+            else:
+                self.server_connections = max(0, self.server_connections + delta)
+
+    def request(self, size: int):
+        sec = int(time.time())
+        with self._lock:
+            self.requests_total += 1
+            self.bytes_in += size
+            if self._buckets and self._buckets[-1][0] == sec:
+                self._buckets[-1][1] += 1
+            else:
+                self._buckets.append([sec, 1])
+                while self._buckets and self._buckets[0][0] <= sec - _RATE_WINDOW:
+                    self._buckets.popleft()
+
+    def response(self, size: int):
+        with self._lock:
+            self.responses_total += 1
+            self.bytes_out += size
+
+    def observe_hook(self, name: str, seconds: float):
+        with self._lock:
+            h = self._hooks.get(name)
+            if h is None:
+                h = self._hooks[name] = [0, 0.0, 0.0]
+            h[0] += 1
+            h[1] += seconds
+            if seconds > h[2]:
+                h[2] = seconds
+
+    async def probe_event_loop(self, interval: float = _LAG_INTERVAL):
+        """在代理事件循环中常驻：每次 sleep(interval) 实际多睡的时间即为事件循环延迟。"""
+        loop = asyncio.get_running_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(interval)
+            lag = max(0.0, loop.time() - start - interval)
+            with self._lock:
+                self._lag.append(lag)
+
+    def snapshot(self) -> dict:
+        now = time.time()
+        sec = int(now)
+        with self._lock:
+            recent = sum(c for s, c in self._buckets if s > sec - _RATE_WINDOW)
+            hooks = {
+                name: {
+                    "calls": calls,
+                    "total_ms": round(total * 1000, 3),
+                    "avg_us": round(total / calls * 1e6, 2) if calls else 0,
+                    "max_ms": round(peak * 1000, 3),
+                }
+                for name, (calls, total, peak) in self._hooks.items()
+            }
+            lag = list(self._lag)
+            out = {
+                "uptime_s": round(now - self.started_at, 1),
+                "client_connections": self.client_connections,
+                "server_connections": self.server_connections,
+                "requests_total": self.requests_total,
+                "responses_total": self.responses_total,
+                "bytes_in": self.bytes_in,
+                "bytes_out": self.bytes_out,
+            }
+        # 当前这一秒未结束，按窗口内实际经过的时间折算
+        window = min(_RATE_WINDOW, max(1.0, now - self.started_at))
+        out["requests_per_s"] = round(recent / window, 2)
+        out["hooks"] = hooks
+        out["event_loop_lag_ms"] = {
+            "last": round(lag[-1] * 1000, 2) if lag else None,
+            "max": round(max(lag) * 1000, 2) if lag else None,
+            "avg": round(sum(lag) / len(lag) * 1000, 2) if lag else None,
+        }
+        return out
+
+
+def timed_hook(fn):
+    """插件钩子装饰器：把调用耗时计入 self.metrics（未设置 metrics 时不计）。"""
+    name = fn.__name__
+
+    @functools.wraps(fn)
+    def wrapper(self, *args, **kwargs):
+        metrics = self.metrics
+        if metrics is None:
+            return fn(self, *args, **kwargs)
+        start = time.perf_counter()
+        try:
+            return fn(self, *args, **kwargs)
+        finally:
+            metrics.observe_hook(name, time.perf_counter() - start)
+
+    return wrapper
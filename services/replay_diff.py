@@ -0,0 +1,212 @@
+# -*- coding: utf-8 -*-
+"""
+重放结果与原录包的结构化对比：状态码、响应头增删改、长度变化，以及按字符预算截断的 body 差异。
+- 两边都是 JSON 时按路径列出 added / removed / changed；
+- 文本按行对比（unified diff，上下文 1 行）；
+- 二进制只比较是否一致。
+差异总长度（含响应头差异）受 max_chars 限制，超出部分只计数不展开，避免大 body 进入上下文；
+文本对比前两侧各截断到 _DIFF_INPUT_CHARS 字符、_DIFF_INPUT_LINES 行，difflib 的耗时与 body 大小无关。
+"""
+import difflib
+import json
+
+from . import browser_packets
+from .body_store import is_text, to_text
+
+DEFAULT_MAX_CHARS = 2000
+_VALUE_CHARS = 80  # 单个 JSON 值在差异中最多展示的字符数
+_MAX_JSON_CHANGES = 10000  # JSON 差异遍历上限，超出后不再统计
+_DIFF_INPUT_CHARS = 64 * 1024  # 文本对比时每侧最多参与 diff 的字符数
+_DIFF_INPUT_LINES = 2000  # 文本对比时每侧最多参与 diff 的行数
+# 每次响应都会变化或与 body 长度重复的响应头，不参与对比
+_VOLATILE_HEADERS = {"date", "age", "expires", "connection", "keep-alive", "transfer-encoding",
+                     "content-length", "server-timing", "x-request-id", "x-trace-id", "cf-ray"}
+
+
+def diff_headers(old: dict, new: dict) -> dict:
+    """响应头对比（名称不区分大小写）：{added: {名: 值}, removed: [名], changed: {名: [旧, 新]}}，无变化的键省略。"""
+    a = {str(k).lower(): v for k, v in (old or {}).items() if str(k).lower() not in _VOLATILE_HEADERS}
+    b = {str(k).lower(): v for k, v in (new or {}).items() if str(k).lower() not in _VOLATILE_HEADERS}
+    out = {}
+    added = {k: b[k] for k in b if k not in a}
+    removed = [k for k in a if k not in b]
+    changed = {k: [a[k], b[k]] for k in a if k in b and a[k] != b[k]}
+    if added:
+        out["added"] = added
+    if removed:
+        out["removed"] = removed
+    if changed:
+        out["changed"] = changed
+    return out
+
+
+def _budget_headers(diff: dict, max_chars: int):
+    """按字符预算裁剪响应头差异（单个值最多 _VALUE_CHARS 字符），返回 (裁剪后的差异, 已用字符数)。"""
+    def clip(v):
+        v = str(v)
+        return v if len(v) <= _VALUE_CHARS else v[:_VALUE_CHARS] + "…"
+
+    items = [("added", k, clip(v)) for k, v in diff.get("added", {}).items()]
+    items += [("removed", k, None) for k in diff.get("removed", [])]
+    items += [("changed", k, [clip(v) for v in pair]) for k, pair in diff.get("changed", {}).items()]
+    out = {}
+    used = 0
+    for op, name, value in items:
+        size = len(json.dumps([name, value], ensure_ascii=False))
+        if used + size > max_chars:
+            out["truncated"] = True
+            break
+        used += size
+        if op == "removed":
+            out.setdefault("removed", []).append(name)
+        else:
+            out.setdefault(op, {})[name] = value
+    return out, used
+
+
+def _short(value) -> str:
+    s = json.dumps(value, ensure_ascii=False)
+    return s if len(s) <= _VALUE_CHARS else s[:_VALUE_CHARS] + "…"
+
+
+def _pointer(path) -> str:
+    return "".join("/" + str(p).replace("~", "~0").replace("/", "~1") for p in path) or "/"
+
+
+def _walk_json(a, b, path, out):
+    """深度优先收集 JSON 差异 (op, JSON Pointer, 旧值, 新值)，达到遍历上限后停止。"""
+    if len(out) >= _MAX_JSON_CHANGES:
+        return
+    if isinstance(a, dict) and isinstance(b, dict):
+        for k in a:
+            if k not in b:
+                out.append(("removed", path + [k], a[k], None))
+            else:
+                _walk_json(a[k], b[k], path + [k], out)
+        for k in b:
+            if k not in a:
+                out.append(("added", path + [k], None, b[k]))
+    elif isinstance(a, list) and isinstance(b, list):
+        for i in range(min(len(a), len(b))):
+            _walk_json(a[i], b[i], path + [i], out)
+        for i in range(len(b), len(a)):
+            out.append(("removed", path + [i], a[i], None))
+        for i in range(len(a), len(b)):
+            out.append(("added", path + [i], None, b[i]))
+    elif a != b or type(a) is not type(b):
+        out.append(("changed", path, a, b))
+
+
+def _json_diff(a, b, max_chars: int) -> dict:
+    changes = []
+    _walk_json(a, b, [], changes)
+    shown = []
+    used = 0
+    for op, path, old, new in changes:
+        item = {"op": op, "path": _pointer(path)}
+        if op != "added":
+            item["old"] = _short(old)
+        if op != "removed":
+            item["new"] = _short(new)
+        size = len(json.dumps(item, ensure_ascii=False))
+        if used + size > max_chars:
+            break
+        shown.append(item)
+        used += size
+    out = {"kind": "json", "total_changes": len(changes), "changes": shown}
+    if len(shown) < len(changes):
+        out["truncated"] = True
+    return out
+
+
+def _clip_input(text: str):
+    """截断参与 diff 的文本，返回 (行列表, 是否截断)。"""
+    lines = text[:_DIFF_INPUT_CHARS].splitlines()
+    clipped = len(text) > _DIFF_INPUT_CHARS or len(lines) > _DIFF_INPUT_LINES
+    return lines[:_DIFF_INPUT_LINES], clipped
+
+
+def _text_diff(a: str, b: str, max_chars: int) -> dict:
+    a_lines, a_clipped = _clip_input(a)
+    b_lines, b_clipped = _clip_input(b)
+    lines = difflib.unified_diff(a_lines, b_lines, "original", "replay", n=1, lineterm="")
+    shown = []
+    used = 0
+    added = removed = 0
+    truncated = False
+    for line in lines:
+        if line.startswith(("---", "+++")):
+            continue
+        if line.startswith("+"):
+            added += 1
+        elif line.startswith("-"):
+            removed += 1
+        if truncated:
+            continue
+        if len(line) > 200:
+            line = line[:200] + "…"
+        if used + len(line) + 1 > max_chars:
+            truncated = True
+            continue
+        shown.append(line)
+        used += len(line) + 1
+    out = {"kind": "text", "lines_added": added, "lines_removed": removed, "diff": "\n".join(shown)}
+    if truncated:
+        out["truncated"] = True
+    if a_clipped or b_clipped:
+        # 行数统计只覆盖截断后参与对比的部分
+        out["input_truncated"] = True
+    return out
+
+
+def _parse_json(text: str):
+    try:
+        return True, json.loads(text)
+    except (TypeError, ValueError):
+        return False, None
+
+
+def diff_bodies(old: bytes, old_type: str, new: bytes, new_type: str, max_chars: int = DEFAULT_MAX_CHARS) -> dict:
+    """对比两个已解压的 body，返回 {identical} 或带 kind（json / text / binary）的差异。"""
+    if old == new:
+        return {"identical": True}
+    if not (is_text(old_type, old[:512]) and is_text(new_type, new[:512])):
+        return {"identical": False, "kind": "binary"}
+    old_text = to_text(old, old_type)
+    new_text = to_text(new, new_type)
+    ok_a, doc_a = _parse_json(old_text)
+    ok_b, doc_b = _parse_json(new_text) if ok_a else (False, None)
+    if ok_a and ok_b:
+        out = _json_diff(doc_a, doc_b, max_chars)
+        if not out["total_changes"]:
+            # 仅格式（空白、键顺序）不同
+            return {"identical": False, "kind": "json", "total_changes": 0, "changes": [], "note": "仅格式不同"}
+    else:
+        out = _text_diff(old_text, new_text, max_chars)
+    out["identical"] = False
+    return out
+
+
+def diff_replay(packet_id: str, status, headers: dict, body: bytes, content_type: str = "",
+                max_chars: int = DEFAULT_MAX_CHARS):
+    """
+    对比原录包的响应与重放得到的响应（body 为已解压字节），原录包不存在返回 None。
+    返回 {status, headers, length, body}；status 与 headers 无变化时省略。
+    响应头差异计入 max_chars，body 差异使用剩余预算。
+    """
+    packet = browser_packets.get_packet(packet_id)
+    if not packet:
+        return None
+    stored = browser_packets.get_packet_body(packet_id, part="response")
+    old_body, old_type = stored if stored else (b"", "")
+    body = body or b""
+    out = {}
+    if packet.get("response_status") != status:
+        out["status"] = {"old": packet.get("response_status"), "new": status}
+    header_diff = diff_headers(packet.get("response_headers"), headers)
+    used = 0
+    if header_diff:
+        out["headers"], used = _budget_headers(header_diff, max_chars)
+    out["length"] = {"old": len(old_body), "new": len(body), "delta": len(body) - len(old_body)}
+    out["body"] = diff_bodies(old_body, old_type, body, content_type, max(0, max_chars - used))
+    return out
@@ -0,0 +1,390 @@
+# -*- coding: utf-8 -*-
+"""
+代理缓存（可选开启）：在 mitmproxy 插件内缓存可缓存的 GET 响应，重复请求直接由代理应答，不访问上游。
+- 缓存键：方法 + URL + 响应 Vary 头所列请求头的取值；同一 URL 的 Vary 头名单单独记录；
+- 两级存储：内存 LRU（按字节上限淘汰）+ 磁盘 LRU（data/proxy_cache，重启后仍可命中）；
+- 磁盘写入交给录包线程异步执行，磁盘命中的读取在线程池执行，均不阻塞代理事件循环；
+- 有效期取 Cache-Control 的 s-maxage / max-age，其次 Expires；都没有时只对带 Cache-Control: public 的响应
+  使用默认 TTL，或按 Last-Modified 启发式取距今时长的 10%（不超过默认 TTL），其余响应不缓存；
+- no-store、private、no-cache、Vary: *、带 Set-Cookie 的响应及带 Authorization、Cookie 的请求不缓存；
+- 缓存中保存的是上游原始响应（改写规则执行前），命中后响应阶段规则照常执行。
+"""
+import asyncio
+import hashlib
+import json
+import os
+import struct
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from email.utils import parsedate_to_datetime
+from pathlib import Path
+
+from .browser_packets import record_async
+
+DEFAULT_TTL = 300
+DEFAULT_MEMORY_MB = 64
+DEFAULT_DISK_MB = 512
+_CACHEABLE_STATUS = {200, 203, 204, 300, 301, 308, 404, 410}
+# 逐跳头不缓存，命中时按缓存的 body 重新生成 Content-Length
+_HOP_HEADERS = {"connection", "keep-alive", "transfer-encoding", "content-length", "proxy-connection"}
+_MAX_VARY_INDEX = 100000
+_SUFFIX = ".cache"
+_HEURISTIC_FRACTION = 0.1  # 启发式有效期：Last-Modified 距今时长的 10%
+
+
+def _header(headers, name: str) -> str:
+    return headers.get(name, "") or ""
+
+
+def _cache_control(headers) -> dict:
+    """解析 Cache-Control 为 {指令: 值或 True}。"""
+    out = {}
+    for part in _header(headers, "cache-control").lower().split(","):
+        part = part.strip()
+        if not part:
+            continue
+        name, _, value = part.partition("=")
+        out[name.strip()] = value.strip().strip('"') if value else True
+    return out
+
+
+def freshness_ttl(headers, default_ttl: float):
+    """按响应头计算可缓存秒数；不可缓存返回 None。"""
+    cc = _cache_control(headers)
+    if "no-store" in cc or "private" in cc or "no-cache" in cc:
+        return None
+    if _header(headers, "vary").strip() == "*" or "set-cookie" in headers:
+        return None
+    for directive in ("s-maxage", "max-age"):
+        if directive in cc:
+            try:
+                ttl = int(cc[directive])
+            except (TypeError, ValueError):
+                return None
+            return ttl if ttl > 0 else None
+    expires = _header(headers, "expires")
+    if expires:
+        try:
+            base = parsedate_to_datetime(_header(headers, "date")).timestamp() if _header(headers, "date") else time.time()
+            ttl = parsedate_to_datetime(expires).timestamp() - base
+        except (TypeError, ValueError, IndexError):
+            return None  # 非法 Expires 视为已过期
+        return ttl if ttl > 0 else None
+    if default_ttl <= 0:
+        return None
+    if "public" in cc:
+        return default_ttl
+    last_modified = _header(headers, "last-modified")
+    if not last_modified:
+        return None  # 无任何新鲜度信息的响应不缓存
+    try:
+        now = parsedate_to_datetime(_header(headers, "date")).timestamp() if _header(headers, "date") else time.time()
+        age = now - parsedate_to_datetime(last_modified).timestamp()
+    except (TypeError, ValueError, IndexError):
+        return None
+    ttl = min(default_ttl, age * _HEURISTIC_FRACTION)
+    return ttl if ttl >= 1 else None
+
+
+def _cacheable_request(request) -> bool:
+    """只缓存不带凭据的 GET：带 Authorization 或 Cookie 的响应可能因用户/会话而异。"""
+    return request.method == "GET" and "authorization" not in request.headers and "cookie" not in request.headers
+
+
+def _vary_names(headers):
+    return sorted({v.strip().lower() for v in _header(headers, "vary").split(",") if v.strip()})
+
+
+def _cache_key(base: str, vary, request_headers) -> str:
+    if not vary:
+        return base
+    return base + "\n" + "\n".join(f"{name}:{_header(request_headers, name)}" for name in vary)
+
+
+class _Entry:
+    __slots__ = ("status", "headers", "body", "expires", "size")
+
+    def __init__(self, status, headers, body, expires):
+        self.status = status
+        self.headers = headers  # [(名, 值)]
+        self.body = body  # 线上原始字节（保留 Content-Encoding）
+        self.expires = expires
+        self.size = len(body) + sum(len(k) + len(v) for k, v in headers)
+
+
+_DiskRef = namedtuple("_DiskRef", "key digest path")
+
+
+class ResponseCache:
+    """进程内单例，所有代理实例共用。"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.enabled = False
+        self.default_ttl = DEFAULT_TTL
+        self._max_memory = DEFAULT_MEMORY_MB * 1024 * 1024
+        self._max_disk = DEFAULT_DISK_MB * 1024 * 1024
+        self._memory = OrderedDict()  # 缓存键 -> _Entry
+        self._memory_bytes = 0
+        self._disk_dir = None
+        self._disk = OrderedDict()  # 缓存键摘要 -> (字节数, 过期时间)
+        self._disk_bytes = 0
+        self._vary = OrderedDict()  # "方法 URL" -> Vary 头名单
+        self._stats = {"hits_memory": 0, "hits_disk": 0, "misses": 0, "bypass": 0, "stores": 0, "evictions": 0}
+
+    # ---------- 配置 ----------
+
+    def configure(self, enabled: bool = None, ttl_seconds: float = None, memory_mb: float = None, disk_mb: float = None):
+        """更新缓存配置，立即生效；调小容量时按 LRU 淘汰超出部分。"""
+        with self._lock:
+            if enabled is not None:
+                self.enabled = bool(enabled)
+            if ttl_seconds is not None:
+                self.default_ttl = max(0.0, float(ttl_seconds))
+            if memory_mb is not None:
+                self._max_memory = max(0, int(float(memory_mb) * 1024 * 1024))
+            if disk_mb is not None:
+                self._max_disk = max(0, int(float(disk_mb) * 1024 * 1024))
+            self._evict_memory()
+            self._evict_disk()
+
+    def set_disk_dir(self, path):
+        """设置磁盘缓存目录并按文件修改时间重建磁盘 LRU 索引。"""
+        d = Path(path) if path else None
+        if d is not None:
+            d.mkdir(parents=True, exist_ok=True)
+        found = []
+        if d is not None:
+            for f in d.glob("*" + _SUFFIX):
+                meta = self._read_file(f, meta_only=True)
+                if meta is None:
+                    continue
+                try:
+                    st = f.stat()
+                    found.append((st.st_mtime, f.stem, st.st_size, meta["expires"], meta.get("base"), meta.get("vary") or []))
+                except (OSError, KeyError):
+                    continue
+        found.sort(key=lambda x: x[0])
+        with self._lock:
+            self._disk_dir = d
+            self._disk.clear()
+            self._disk_bytes = 0
+            for _, digest, size, expires, base, vary in found:
+                self._disk[digest] = (size, expires)
+                self._disk_bytes += size
+                if base:
+                    # 重启后据磁盘条目恢复 Vary 名单，磁盘缓存才能命中
+                    self._vary[base] = vary
+            self._evict_disk()
+
+    # ---------- 读写 ----------
+
+    def lookup(self, request):
+        """查找请求对应的未过期缓存，返回 (status, headers, body, 来源 memory|disk) 或 None。"""
+        found = self._lookup_memory(request)
+        if isinstance(found, _DiskRef):
+            return self._load_disk(found)
+        return found
+
+    async def lookup_async(self, request):
+        """同 lookup；磁盘层的文件读取放到线程池执行，供代理事件循环内调用。"""
+        found = self._lookup_memory(request)
+        if isinstance(found, _DiskRef):
+            return await asyncio.get_running_loop().run_in_executor(None, self._load_disk, found)
+        return found
+
+    def _lookup_memory(self, request):
+        """只查内存层与磁盘索引：返回命中结果、None，或需要读盘时返回 _DiskRef。"""
+        if not self.enabled or not _cacheable_request(request):
+            return None
+        cc = _cache_control(request.headers)
+        if "no-cache" in cc or "no-store" in cc or "no-cache" in _header(request.headers, "pragma").lower():
+            with self._lock:
+                self._stats["bypass"] += 1
+            return None
+        base = f"GET {request.pretty_url}"
+        now = time.time()
+        with self._lock:
+            vary = self._vary.get(base)
+            if vary is None:
+                self._stats["misses"] += 1
+                return None
+            key = _cache_key(base, vary, request.headers)
+            entry = self._memory.get(key)
+            if entry is not None:
+                if entry.expires > now:
+                    self._memory.move_to_end(key)
+                    self._stats["hits_memory"] += 1
+                    return entry.status, entry.headers, entry.body, "memory"
+                self._drop_memory(key)
+            digest = self._digest(key)
+            disk = self._disk.get(digest)
+            if disk is None or disk[1] <= now or self._disk_dir is None:
+                if disk is not None:
+                    self._drop_disk(digest)
+                self._stats["misses"] += 1
+                return None
+            return _DiskRef(key, digest, self._disk_dir / (digest + _SUFFIX))
+
+    def _load_disk(self, ref):
+        """读取磁盘缓存文件并提升到内存层。"""
+        loaded = self._read_file(ref.path)
+        with self._lock:
+            if loaded is None or loaded[0].get("key") != ref.key:
+                if loaded is None:
+                    self._drop_disk(ref.digest)
+                self._stats["misses"] += 1
+                return None
+            meta, body = loaded
+            entry = _Entry(meta["status"], [tuple(h) for h in meta["headers"]], body, meta["expires"])
+            if ref.digest in self._disk:
+                self._disk.move_to_end(ref.digest)
+            self._put_memory(ref.key, entry)
+            self._stats["hits_disk"] += 1
+            return entry.status, entry.headers, entry.body, "disk"
+
+    def store(self, request, response) -> bool:
+        """上游响应可缓存时写入内存与磁盘，返回是否已缓存。"""
+        if not self.enabled or not _cacheable_request(request):
+            return False
+        if response is None or response.status_code not in _CACHEABLE_STATUS or response.raw_content is None:
+            return False
+        ttl = freshness_ttl(response.headers, self.default_ttl)
+        if ttl is None:
+            return False
+        headers = [(k, v) for k, v in response.headers.items(multi=True) if k.lower() not in _HOP_HEADERS]
+        entry = _Entry(response.status_code, headers, response.raw_content, time.time() + ttl)
+        base = f"GET {request.pretty_url}"
+        vary = _vary_names(response.headers)
+        key = _cache_key(base, vary, request.headers)
+        with self._lock:
+            if entry.size > max(self._max_memory, self._max_disk):
+                return False
+            self._vary[base] = vary
+            self._vary.move_to_end(base)
+            while len(self._vary) > _MAX_VARY_INDEX:
+                self._vary.popitem(last=False)
+            self._put_memory(key, entry)
+            self._stats["stores"] += 1
+            disk_dir = self._disk_dir if self._max_disk else None
+        if disk_dir is not None:
+            record_async(self._write_disk, key=key, base=base, vary=vary, entry=entry)
+        return True
+
+    def clear(self):
+        """清空内存与磁盘缓存（统计保留）。"""
+        with self._lock:
+            self._memory.clear()
+            self._memory_bytes = 0
+            self._vary.clear()
+            for digest in list(self._disk):
+                self._drop_disk(digest)
+
+    def stats(self) -> dict:
+        with self._lock:
+            s = dict(self._stats)
+            s.update(
+                enabled=self.enabled,
+                default_ttl=self.default_ttl,
+                memory_entries=len(self._memory),
+                memory_bytes=self._memory_bytes,
+                memory_limit=self._max_memory,
+                disk_entries=len(self._disk),
+                disk_bytes=self._disk_bytes,
+                disk_limit=self._max_disk,
+            )
+        hits = s["hits_memory"] + s["hits_disk"]
+        total = hits + s["misses"]
+        s["hit_ratio"] = round(hits / total, 4) if total else None
+        return s
+
+    # ---------- 内部（调用方持有 _lock） ----------
+
+    @staticmethod
+    def _digest(key: str) -> str:
+        return hashlib.sha256(key.encode("utf-8", "surrogateescape")).hexdigest()[:32]
+
+    def _put_memory(self, key, entry):
+        old = self._memory.pop(key, None)
+        if old is not None:
+            self._memory_bytes -= old.size
+        # 单条超过内存上限 1/8 的大响应只放磁盘
+        if entry.size * 8 > self._max_memory:
+            return
+        self._memory[key] = entry
+        self._memory_bytes += entry.size
+        self._evict_memory()
+
+    def _drop_memory(self, key):
+        entry = self._memory.pop(key, None)
+        if entry is not None:
+            self._memory_bytes -= entry.size
+
+    def _evict_memory(self):
+        while self._memory and self._memory_bytes > self._max_memory:
+            _, entry = self._memory.popitem(last=False)
+            self._memory_bytes -= entry.size
+            self._stats["evictions"] += 1
+
+    def _drop_disk(self, digest):
+        info = self._disk.pop(digest, None)
+        if info is None:
+            return
+        self._disk_bytes -= info[0]
+        if self._disk_dir is not None:
+            try:
+                (self._disk_dir / (digest + _SUFFIX)).unlink()
+            except OSError:
+                pass
+
+    def _evict_disk(self):
+        while self._disk and self._disk_bytes > self._max_disk:
+            digest = next(iter(self._disk))
+            self._drop_disk(digest)
+            self._stats["evictions"] += 1
+
+    # ---------- 磁盘文件：4 字节元数据长度 + 元数据 JSON + body ----------
+
+    def _write_disk(self, key, base, vary, entry):
+        """在录包线程中执行：写临时文件后原子替换，再登记到磁盘 LRU。"""
+        with self._lock:
+            disk_dir = self._disk_dir
+        if disk_dir is None:
+            return
+        digest = self._digest(key)
+        meta = json.dumps({"key": key, "base": base, "vary": vary, "status": entry.status,
+                           "headers": entry.headers, "expires": entry.expires}, ensure_ascii=False).encode("utf-8")
+        path = disk_dir / (digest + _SUFFIX)
+        tmp = path.with_suffix(".tmp")
+        try:
+            with open(tmp, "wb") as f:
+                f.write(struct.pack(">I", len(meta)))
+                f.write(meta)
+                f.write(entry.body)
+            os.replace(tmp, path)
+            size = path.stat().st_size
+        except OSError:
+            return
+        with self._lock:
+            old = self._disk.pop(digest, None)
+            if old is not None:
+                self._disk_bytes -= old[0]
+            self._disk[digest] = (size, entry.expires)
+            self._disk_bytes += size
+            self._evict_disk()
+
+    @staticmethod
+    def _read_file(path, meta_only: bool = False):
+        try:
+            with open(path, "rb") as f:
+                (n,) = struct.unpack(">I", f.read(4))
+                meta = json.loads(f.read(n).decode("utf-8"))
+                if meta_only:
+                    return meta
+                return meta, f.read()
+        except (OSError, ValueError, struct.error):
+            return None
+
+
+response_cache = ResponseCache()
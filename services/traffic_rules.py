@@ -2,86 +2,773 @@
 """
 流量规则管理器：单例模式，用于存储和管理 AI 下发的流量拦截规则。
 规则类型包括：修改请求头、修改响应体、阻断请求等。
+
+规则在添加时预编译，并按阶段建立匹配索引：
+- 以 ^scheme://host 开头、能提取出完整字面量主机名且不含顶层 | 的规则按主机分桶，只对同主机的 URL 求值；
+- 其余规则按段合并为组合分支正则，一次扫描即可排除整段都不命中的情况，命中时再逐条复核该段；
+- 含反向引用或无法合并的规则单独求值。
+
+规则可设置 ttl_seconds / max_hits：到期或命中次数达到上限后由后台调度线程（最小堆）从快照中移除。
+设置持久化路径后，规则变更写入 data/traffic_rules.json；后台线程按 mtime 检测文件被外部修改并热加载。
+设置了 max_hits 的规则连同已命中次数 hits 一并写入规则文件（后台线程每 _RELOAD_INTERVAL 秒合并写入一次），
+重启后从文件恢复计数，命中上限跨进程生效。
 """
+import heapq
+import json
+import os
 import re
+import threading
+import time
+from pathlib import Path
 from typing import List, Dict, Optional
 
+from . import json_patch
+from . import mock_response
+
+PHASES = ("request", "response")
+RULE_TYPES = ("modify_request_header", "modify_response_body", "block_request", "mock_response", "patch_json_body")
+# 类型名无法体现阶段的规则：mock_response 在请求阶段直接应答，patch_json_body 修改响应 JSON
+_PHASE_OVERRIDES = {"mock_response": ("request",), "patch_json_body": ("response",)}
+_RELOAD_INTERVAL = 1.0  # 规则文件 mtime 检查间隔（秒）
+_MERGE_CHUNK = 64  # 每条组合正则合并的规则数；闸门命中时只需逐条复核这一段
+# 反向引用与条件分组 (?(1)...) 引用的组号在多条规则拼接后会错位，不能并入组合正则
+_BACKREF_RE = re.compile(r"\\[1-9]|\(\?P=|\(\?\(")
+_GLOBAL_FLAGS_RE = re.compile(r"^\(\?([aiLmsux]+)\)")
+_NAMED_GROUP_RE = re.compile(r"(?<!\\)\(\?P<\w+>")
+# ^http://、^https://、^https?://（/ 可转义）之后紧跟由字母数字、- 与 \. 组成的主机名，
+# 且以 / : $ 结尾（结尾符之后不能跟量词，如 /? 使结尾可省略），才视为完整的字面量主机
+_QUANTIFIERS = ("?", "*", "+", "{")
+_ANCHORED_HOST_RE = re.compile(r"^\^https?\??:(?:\\?/){2}((?:[A-Za-z0-9-]|\\\.)+)(?:\\?/|:|\$)")
+
+
+def validate_rule(rule_type: str, data: dict, check_sources: bool = True) -> Optional[str]:
+    """
+    校验规则类型与 data 参数，合法返回 None，否则返回错误说明。
+    check_sources 为 False 时不检查规则引用的外部资源（文件、录包）是否存在。
+    """
+    if rule_type not in RULE_TYPES:
+        return f"不支持的修改类型: {rule_type}"
+    if not isinstance(data, dict):
+        return "data 须为对象"
+    if rule_type == "modify_request_header":
+        if "key" not in data or "value" not in data:
+            return "修改请求头需要提供 key 和 value 参数"
+    elif rule_type == "modify_response_body":
+        if "old_text" not in data or "new_text" not in data:
+            return "修改响应体需要提供 old_text 和 new_text 参数"
+    elif rule_type == "mock_response":
+        return mock_response.validate(data, check_sources=check_sources)
+    elif rule_type == "patch_json_body":
+        try:
+            json_patch.normalize_ops(data)
+        except ValueError as e:
+            return str(e)
+    return None
+
+
+def _rule_phases(rule_type: str):
+    """规则生效的阶段：类型含 response 的只在响应阶段，含 request 的只在请求阶段，否则两阶段都生效。"""
+    if rule_type in _PHASE_OVERRIDES:
+        return _PHASE_OVERRIDES[rule_type]
+    if "response" in rule_type:
+        return ("response",)
+    if "request" in rule_type:
+        return ("request",)
+    return PHASES
+
+
+def _has_top_level_alternation(pattern: str) -> bool:
+    """正则在分组与字符集之外是否含未转义的 |（整条正则是多个分支的或）。"""
+    depth = 0
+    i = 0
+    n = len(pattern)
+    while i < n:
+        ch = pattern[i]
+        if ch == "\\":
+            i += 2
+            continue
+        if ch == "[":
+            # 跳过字符集：开头的 ^ 与紧随其后的 ] 是字面量
+            i += 1
+            if i < n and pattern[i] == "^":
+                i += 1
+            if i < n and pattern[i] == "]":
+                i += 1
+            while i < n and pattern[i] != "]":
+                i += 2 if pattern[i] == "\\" else 1
+        elif ch == "(":
+            depth += 1
+        elif ch == ")":
+            depth = max(0, depth - 1)
+        elif ch == "|" and depth == 0:
+            return True
+        i += 1
+    return False
+
+
+def _literal_host(pattern: str) -> Optional[str]:
+    """
+    从锚定在 URL 开头的正则中提取字面量主机名，无法确定时返回 None。
+    含顶层 | 的正则其余分支可能匹配任意主机，结尾符带量词的正则可能匹配更长的主机名，均不分桶。
+    """
+    if _has_top_level_alternation(pattern):
+        return None
+    m = _ANCHORED_HOST_RE.match(pattern)
+    if not m or pattern[m.end():m.end() + 1] in _QUANTIFIERS:
+        return None
+    return m.group(1).replace("\\.", ".")
+
+
+def _url_host(url: str) -> str:
+    """取 URL 中 scheme:// 之后到 / : ? # 之前的部分，与 _literal_host 的提取口径一致。"""
+    i = url.find("://")
+    if i < 0:
+        return ""
+    rest = url[i + 3:]
+    for j, ch in enumerate(rest):
+        if ch in "/:?#":
+            return rest[:j]
+    return rest
+
+
+def _merge_part(pattern: str) -> Optional[str]:
+    """生成规则在组合正则中的分支片段。含反向引用或无法嵌入的规则返回 None，需单独求值。"""
+    if _BACKREF_RE.search(pattern):
+        return None
+    # 开头的全局内联标志（如 (?i)）改写为作用域标志，才能嵌入组合正则
+    m = _GLOBAL_FLAGS_RE.match(pattern)
+    if m:
+        pattern = "(?%s:%s)" % (m.group(1), pattern[m.end():])
+    # 组合正则只作闸门，不需要分组名；去掉命名避免多条规则同名冲突
+    pattern = _NAMED_GROUP_RE.sub("(?:", pattern)
+    part = "(?:%s)" % pattern
+    try:
+        re.compile(part)
+    except re.error:
+        return None
+    return part
+
+
+class _PhaseMatcher:
+    """单个阶段的预编译匹配器。"""
+
+    def __init__(self, entries, chunk_cache):
+        """
+        entries: [(order, rule, compiled, part)]，order 为规则添加顺序，part 见 _merge_part。
+        chunk_cache: 组合正则源码 -> 已编译对象；追加规则时只有最后一段需要重新编译。
+        """
+        self.by_host = {}  # 字面量主机 -> [(order, rule, compiled)]
+        self.singles = []  # 单独求值的规则
+        self.merged = []  # [(组合正则, [(order, rule, compiled)])]
+        mergeable = []
+        for order, rule, compiled, part in entries:
+            host = _literal_host(rule["regex"])
+            if host is not None:
+                self.by_host.setdefault(host, []).append((order, rule, compiled))
+            elif part is None:
+                self.singles.append((order, rule, compiled))
+            else:
+                mergeable.append((order, rule, compiled, part))
+        for i in range(0, len(mergeable), _MERGE_CHUNK):
+            chunk = mergeable[i:i + _MERGE_CHUNK]
+            members = [(order, rule, compiled) for order, rule, compiled, _ in chunk]
+            source = "|".join(part for _, _, _, part in chunk)
+            combined = chunk_cache.get(source)
+            if combined is None:
+                try:
+                    combined = chunk_cache[source] = re.compile(source)
+                except (re.error, RecursionError, OverflowError):
+                    # 组合失败（如超出正则引擎限制）时整段退回逐条求值
+                    self.singles.extend(members)
+                    continue
+            self.merged.append((combined, members))
+
+    def match(self, url: str) -> List[Dict]:
+        hits = []
+        for order, rule, compiled in self.by_host.get(_url_host(url), ()):
+            if compiled.search(url):
+                hits.append((order, rule))
+        for combined, members in self.merged:
+            # 组合正则一次扫描作为闸门：整段都不命中（绝大多数 flow）时直接跳过
+            if combined.search(url) is None:
+                continue
+            for order, rule, compiled in members:
+                if compiled.search(url):
+                    hits.append((order, rule))
+        for order, rule, compiled in self.singles:
+            if compiled.search(url):
+                hits.append((order, rule))
+        if len(hits) > 1:
+            hits.sort(key=lambda h: h[0])
+        return [rule for _, rule in hits]
+
+
+class _RuleStats:
+    """单条规则的运行统计（可变，不属于快照）。"""
+
+    __slots__ = ("hits", "last_hit", "bytes_rewritten", "apply_time")
+
+    def __init__(self, hits: int = 0):
+        self.hits = hits
+        self.last_hit = None
+        self.bytes_rewritten = 0
+        self.apply_time = 0.0
+
+    def to_dict(self):
+        return {
+            "hits": self.hits,
+            "last_hit": self.last_hit,
+            "bytes_rewritten": self.bytes_rewritten,
+            "apply_time_ms": round(self.apply_time * 1000, 3),
+        }
+
+
+class _ExpiryScheduler:
+    """
+    规则过期调度：最小堆按到期时间排序，后台线程等待到最早的到期时间后回调 on_expire(规则 id 列表)。
+    只在首次登记时启动线程；规则已被删除或清空的过期项由 on_expire 忽略。
+    """
+
+    def __init__(self, on_expire):
+        self._on_expire = on_expire
+        self._heap = []  # [(到期时间, 规则 id)]
+        self._cond = threading.Condition()
+        self._thread = None
+
+    def schedule(self, when: float, rule_id: str):
+        with self._cond:
+            heapq.heappush(self._heap, (when, rule_id))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="traffic-rule-expiry", daemon=True)
+                self._thread.start()
+            self._cond.notify()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._heap:
+                    self._cond.wait()
+                delay = self._heap[0][0] - time.time()
+                if delay > 0:
+                    self._cond.wait(delay)
+                    continue
+                now = time.time()
+                due = []
+                while self._heap and self._heap[0][0] <= now:
+                    due.append(heapq.heappop(self._heap)[1])
+            try:
+                self._on_expire(due)
+            except Exception:
+                pass
+
+
+class _RuleSnapshot:
+    """
+    不可变的规则快照：规则元组与各阶段预编译匹配器，发布后不再修改。
+    代理线程每次匹配只读取一次当前快照引用，无需加锁。
+    """
+
+    __slots__ = ("entries", "rules", "matchers")
+
+    def __init__(self, entries=(), chunk_cache=None):
+        """entries: ((rule, compiled, part), ...)，按添加顺序。"""
+        self.entries = tuple(entries)
+        self.rules = tuple(rule for rule, _, _ in self.entries)
+        by_phase = {phase: [] for phase in PHASES}
+        for order, (rule, compiled, part) in enumerate(self.entries):
+            if not rule["enabled"]:
+                continue
+            for phase in _rule_phases(rule["type"]):
+                by_phase[phase].append((order, rule, compiled, part))
+        cache = chunk_cache if chunk_cache is not None else {}
+        self.matchers = {phase: _PhaseMatcher(by_phase[phase], cache) for phase in PHASES}
+
 
 class TrafficRuleManager:
-    """流量规则管理器单例类"""
-    
+    """
+    流量规则管理器单例类
+
+    写时复制：add_rule / clear_rules 等修改在写锁内基于旧快照构建新的 _RuleSnapshot，
+    再整体替换 self._snapshot 引用；match_url 只读一次引用，读到的总是一致的完整快照。
+
+    TrafficRuleManager() 返回全局单例；TrafficRuleManager(isolated=True) 创建独立的规则集
+    （供额外的代理监听器使用，只保存在内存中）。
+    """
+
     _instance = None
-    
-    def __new__(cls):
-        """实现单例模式"""
+
+    def __new__(cls, isolated: bool = False):
+        """实现单例模式；isolated 为 True 时返回新的独立实例"""
+        if isolated:
+            return cls._create()
         if cls._instance is None:
-            cls._instance = super(TrafficRuleManager, cls).__new__(cls)
-            cls._instance.rules = []
+            cls._instance = cls._create()
         return cls._instance
 
-    def add_rule(self, rule_type: str, url_regex: str, action_data: dict) -> str:
+    @classmethod
+    def _create(cls):
+        inst = super(TrafficRuleManager, cls).__new__(cls)
+        inst._write_lock = threading.Lock()
+        inst._chunk_cache = {}  # 组合正则源码 -> 已编译对象，仅在写锁内访问
+        inst._snapshot = _RuleSnapshot()
+        inst._stats_lock = threading.Lock()
+        inst._stats = {}  # 规则 id -> _RuleStats
+        inst._phase_stats = {phase: [0, 0.0] for phase in PHASES}  # 阶段 -> [匹配次数, 累计耗时]
+        inst._next_id = 1  # 规则 id 单调递增，清空后也不复用，避免过期调度误删新规则
+        inst._expiry = _ExpiryScheduler(inst.remove_rules)
+        inst._persist_path = None
+        inst._file_mtime = None
+        inst._watcher = None
+        inst._hits_dirty = False  # 有 max_hits 规则的命中计数尚未写入规则文件
+        return inst
+
+    def _publish(self, entries, persist: bool = True):
+        """基于 entries 构建新快照并替换当前引用（须在写锁内调用），默认同时写入规则文件。"""
+        cache = self._chunk_cache
+        snapshot = _RuleSnapshot(entries, cache)
+        # 只保留新快照仍在使用的组合正则
+        used = {id(combined) for m in snapshot.matchers.values() for combined, _ in m.merged}
+        for source in [k for k, v in cache.items() if id(v) not in used]:
+            del cache[source]
+        self._snapshot = snapshot
+        if persist:
+            self._persist()
+
+    @staticmethod
+    def _prepare(rule_type: str, url_regex: str, action_data: dict, ttl_seconds: float = None,
+                 max_hits: int = None, expires_at: float = None, enabled: bool = True):
+        """编译规则并预读模拟响应 body（锁外进行），返回尚未分配 id 的 (rule, compiled, part)。非法正则抛出 re.error。"""
+        compiled = re.compile(url_regex)
+        if rule_type == "mock_response":
+            mock_response.preload(action_data)
+        if expires_at is None and ttl_seconds:
+            expires_at = time.time() + float(ttl_seconds)
+        rule = {
+            "id": None,
+            "type": rule_type,
+            "regex": url_regex,
+            "data": action_data,
+            "enabled": bool(enabled),
+            "expires_at": expires_at,
+            "max_hits": int(max_hits) if max_hits else None,
+        }
+        return rule, compiled, _merge_part(url_regex)
+
+    def _append(self, prepared, replace: bool = False) -> List[str]:
+        """为预编译的规则分配 id 并一次性发布（批量导入只重建一次快照），返回新规则 id 列表。"""
+        with self._write_lock:
+            entries = () if replace else self._snapshot.entries
+            added = []
+            with self._stats_lock:
+                if replace:
+                    self._stats = {}
+                for rule, compiled, part in prepared:
+                    rule["id"] = str(self._next_id)
+                    self._next_id += 1
+                    self._stats[rule["id"]] = _RuleStats()
+                    added.append((rule, compiled, part))
+            if replace:
+                self._chunk_cache.clear()
+            self._publish(entries + tuple(added))
+        for rule, _, _ in added:
+            if rule["expires_at"] is not None:
+                self._expiry.schedule(rule["expires_at"], rule["id"])
+        return [rule["id"] for rule, _, _ in added]
+
+    def add_rule(self, rule_type: str, url_regex: str, action_data: dict,
+                 ttl_seconds: float = None, max_hits: int = None) -> str:
         """
         添加新的流量拦截规则
-        
+
         Args:
             rule_type: 规则类型，如 'modify_request_header', 'modify_response_body', 'block_request' 等
             url_regex: 匹配 URL 的正则表达式
             action_data: 规则执行所需的具体数据
-            
+            ttl_seconds: 可选，规则存活秒数，到期后自动移除
+            max_hits: 可选，命中次数上限，达到后不再生效并自动移除
+
         Returns:
             新规则的 ID
+
+        Raises:
+            re.error: url_regex 不是合法的正则表达式
         """
-        rule = {
-            "id": str(len(self.rules) + 1),
-            "type": rule_type,
-            "regex": url_regex,
-            "data": action_data,
-            "enabled": True
-        }
-        self.rules.append(rule)
-        return rule["id"]
+        # 编译放在锁外，避免慢正则阻塞其他写入
+        prepared = self._prepare(rule_type, url_regex, action_data, ttl_seconds=ttl_seconds, max_hits=max_hits)
+        return self._append([prepared])[0]
+
+    def import_rules(self, items, replace: bool = False):
+        """
+        批量导入规则，所有合法规则只发布一次快照
+
+        Args:
+            items: 规则列表，每项含 type、regex（或 url_regex）、data，可选 enabled、ttl_seconds、expires_at、max_hits
+            replace: 为 True 时替换现有全部规则，否则追加
+
+        Returns:
+            (新规则 id 列表, [{"index": 序号, "error": 错误说明}])
+        """
+        prepared = []
+        errors = []
+        now = time.time()
+        for i, item in enumerate(items or []):
+            if not isinstance(item, dict):
+                errors.append({"index": i, "error": "规则须为对象"})
+                continue
+            rule_type = item.get("type") or item.get("modification_type") or ""
+            url_regex = item.get("regex") or item.get("url_regex") or ""
+            data = item.get("data") or {}
+            err = "url_regex 不能为空" if not url_regex else validate_rule(rule_type, data)
+            if err is None:
+                try:
+                    expires_at = item.get("expires_at")
+                    expires_at = float(expires_at) if expires_at is not None else None
+                    if expires_at is not None and expires_at <= now:
+                        err = "规则已过期"
+                    else:
+                        prepared.append(self._prepare(
+                            rule_type, url_regex, data,
+                            ttl_seconds=item.get("ttl_seconds"), max_hits=item.get("max_hits"),
+                            expires_at=expires_at, enabled=item.get("enabled", True),
+                        ))
+                        continue
+                except re.error as e:
+                    err = f"url_regex 不是合法的正则表达式: {e}"
+                except (TypeError, ValueError):
+                    err = "ttl_seconds、expires_at 须为数字，max_hits 须为整数"
+            errors.append({"index": i, "error": err})
+        if not prepared and not replace:
+            return [], errors
+        return self._append(prepared, replace=replace), errors
+
+    def export_rules(self) -> List[Dict]:
+        """导出规则定义（不含运行统计），可直接用于 import_rules。"""
+        return [dict(rule) for rule in self._snapshot.rules]
+
+    def remove_rules(self, rule_ids) -> int:
+        """按 id 移除规则（过期调度也走这里），返回实际移除的条数。"""
+        rule_ids = set(rule_ids)
+        if not rule_ids:
+            return 0
+        with self._write_lock:
+            entries = self._snapshot.entries
+            kept = tuple(e for e in entries if e[0]["id"] not in rule_ids)
+            if len(kept) == len(entries):
+                return 0
+            with self._stats_lock:
+                for rule_id in rule_ids:
+                    self._stats.pop(rule_id, None)
+            self._publish(kept)
+        return len(entries) - len(kept)
+
+    @property
+    def rules(self):
+        """当前快照中的规则元组（只读）"""
+        return self._snapshot.rules
+
+    def get_rules(self, with_stats: bool = False) -> List[Dict]:
+        """
+        获取所有规则列表（副本，修改返回值不影响已发布的快照）
 
-    def get_rules(self) -> List[Dict]:
-        """获取所有规则列表"""
-        return self.rules
+        Args:
+            with_stats: 为 True 时每条规则附带 hits、last_hit、bytes_rewritten、apply_time_ms
+        """
+        rules = [dict(rule) for rule in self._snapshot.rules]
+        if with_stats:
+            with self._stats_lock:
+                for rule in rules:
+                    stats = self._stats.get(rule["id"])
+                    rule.update(stats.to_dict() if stats else _RuleStats().to_dict())
+        return rules
+
+    def get_match_stats(self) -> Dict:
+        """各阶段规则匹配的调用次数与累计/平均耗时。"""
+        with self._stats_lock:
+            return {
+                phase: {
+                    "calls": calls,
+                    "total_ms": round(total * 1000, 3),
+                    "avg_us": round(total / calls * 1e6, 2) if calls else 0,
+                }
+                for phase, (calls, total) in self._phase_stats.items()
+            }
+
+    def record_apply(self, rule_ids, seconds: float, rewritten: Dict[str, int] = None):
+        """
+        记录规则执行耗时与改写字节数
+
+        Args:
+            rule_ids: 本次共同执行的规则 id，耗时在这些规则之间平均分摊
+            seconds: 执行耗时（秒）
+            rewritten: 规则 id -> 被替换的字节数
+        """
+        rule_ids = list(rule_ids)
+        if not rule_ids:
+            return
+        share = seconds / len(rule_ids)
+        with self._stats_lock:
+            for rule_id in rule_ids:
+                stats = self._stats.get(rule_id)
+                if stats is not None:
+                    stats.apply_time += share
+                    if rewritten:
+                        stats.bytes_rewritten += rewritten.get(rule_id, 0)
 
     def clear_rules(self):
         """清空所有规则"""
-        self.rules = []
+        with self._write_lock:
+            self._chunk_cache.clear()
+            self._snapshot = _RuleSnapshot()
+            self._persist()
+            with self._stats_lock:
+                self._stats = {}
+                self._phase_stats = {phase: [0, 0.0] for phase in PHASES}
 
-    def match_rules(self, flow, phase: str) -> List[Dict]:
+    def dry_run(self, items, packets, sample_limit: int = 10) -> Dict:
         """
-        根据请求/响应匹配适用的规则
-        
+        试运行候选规则：用与代理相同的预编译匹配器评估一组录包，不影响当前生效的规则。
+
         Args:
-            flow: mitmproxy 的 HTTPFlow 对象
-            phase: 阶段标识，'request' 或 'response'
-            
+            items: 候选规则列表，格式同 import_rules
+            packets: [(录包 id, url)]，按希望返回样例的顺序（通常时间倒序）
+            sample_limit: 每条规则最多返回的样例录包 id 数
+
         Returns:
-            匹配的规则列表
+            {"rules": [{index, type, regex, match_count, sample_ids}], "errors": [...],
+             "total_packets", "distinct_urls", "elapsed_ms"}
         """
-        matched = []
-        url = flow.request.pretty_url
-        
-        for rule in self.rules:
-            if not rule["enabled"]:
+        start = time.perf_counter()
+        entries = []
+        errors = []
+        for i, item in enumerate(items or []):
+            if not isinstance(item, dict):
+                errors.append({"index": i, "error": "规则须为对象"})
                 continue
-            
-            # 根据阶段过滤规则类型
-            if phase == 'request' and 'response' in rule['type']:
+            rule_type = item.get("type") or item.get("modification_type") or ""
+            url_regex = item.get("regex") or item.get("url_regex") or ""
+            data = item.get("data") or {}
+            err = "url_regex 不能为空" if not url_regex else validate_rule(rule_type, data, check_sources=False)
+            if err is None:
+                try:
+                    rule, compiled, part = self._prepare(rule_type, url_regex, data)
+                    rule["id"] = str(i)
+                    entries.append((rule, compiled, part))
+                    continue
+                except re.error as e:
+                    err = f"url_regex 不是合法的正则表达式: {e}"
+            errors.append({"index": i, "error": err})
+        # 临时快照使用独立的组合正则缓存，不触碰当前生效的快照
+        matchers = list(_RuleSnapshot(entries, {}).matchers.values())
+        results = {rule["id"]: {"index": int(rule["id"]), "type": rule["type"], "regex": rule["regex"],
+                                "match_count": 0, "sample_ids": []} for rule, _, _ in entries}
+        # 同一 URL 只匹配一次
+        url_hits = {}
+        total = 0
+        for pid, url in packets:
+            total += 1
+            hits = url_hits.get(url)
+            if hits is None:
+                hits = url_hits[url] = {rule["id"] for m in matchers for rule in m.match(url)}
+            for rule_id in hits:
+                r = results[rule_id]
+                r["match_count"] += 1
+                if len(r["sample_ids"]) < sample_limit:
+                    r["sample_ids"].append(pid)
+        return {
+            "rules": sorted(results.values(), key=lambda r: r["index"]),
+            "errors": errors,
+            "total_packets": total,
+            "distinct_urls": len(url_hits),
+            "elapsed_ms": round((time.perf_counter() - start) * 1000, 2),
+        }
+
+    def set_persist_path(self, path):
+        """设置规则文件路径（如 data/traffic_rules.json），并启动 mtime 检查线程。"""
+        self._persist_path = Path(path) if path else None
+        if self._persist_path is not None and self._watcher is None:
+            self._watcher = threading.Thread(target=self._watch_loop, name="traffic-rule-reload", daemon=True)
+            self._watcher.start()
+
+    def _persist(self):
+        """把当前快照写入规则文件（须在写锁内调用）。先写临时文件再替换，避免读到半个文件。"""
+        p = self._persist_path
+        if p is None:
+            return
+        try:
+            p.parent.mkdir(parents=True, exist_ok=True)
+            tmp = p.with_name(p.name + ".tmp")
+            with self._stats_lock:
+                self._hits_dirty = False
+                rules = [self._with_hits(rule) for rule in self._snapshot.rules]
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(rules, f, ensure_ascii=False, indent=2)
+            os.replace(tmp, p)
+            self._file_mtime = p.stat().st_mtime_ns
+        except Exception:
+            pass
+
+    def _with_hits(self, rule: Dict) -> Dict:
+        """持久化用的规则：设置了 max_hits 时附带已命中次数（须持有 _stats_lock）。"""
+        stats = self._stats.get(rule["id"])
+        if not rule.get("max_hits") or stats is None or not stats.hits:
+            return rule
+        return dict(rule, hits=stats.hits)
+
+    def load_rules(self) -> int:
+        """
+        从规则文件加载并编译规则（应用启动时与文件变化时调用），替换当前全部规则。
+        保留文件中的规则 id；已过期或无法编译的规则跳过。返回加载条数。
+        """
+        p = self._persist_path
+        if p is None:
+            return 0
+        try:
+            mtime = p.stat().st_mtime_ns
+            with open(p, "r", encoding="utf-8") as f:
+                items = json.load(f)
+            if not isinstance(items, list):
+                items = []
+        except FileNotFoundError:
+            return 0
+        except Exception:
+            # 文件正在被编辑或内容非法：保留当前规则，等下次变化再试
+            return 0
+        now = time.time()
+        entries = []
+        seen = set()
+        saved_hits = {}  # 规则 id -> 文件中记录的已命中次数
+        for item in items:
+            if not isinstance(item, dict) or not item.get("id") or not item.get("regex"):
                 continue
-            if phase == 'response' and 'request' in rule['type']:
+            if str(item["id"]) in seen:
                 continue
+            if validate_rule(item.get("type"), item.get("data") or {}, check_sources=False) is not None:
+                continue
+            expires_at = item.get("expires_at")
+            try:
+                if expires_at is not None and float(expires_at) <= now:
+                    continue
+                hits = max(0, int(item.get("hits") or 0))
+                if item.get("max_hits") and hits >= int(item["max_hits"]):
+                    continue  # 命中次数已达上限
+                entries.append(self._prepare(
+                    item["type"], item["regex"], item.get("data") or {}, max_hits=item.get("max_hits"),
+                    expires_at=float(expires_at) if expires_at is not None else None,
+                    enabled=item.get("enabled", True),
+                ))
+            except (re.error, TypeError, ValueError):
+                continue
+            entries[-1][0]["id"] = str(item["id"])
+            seen.add(str(item["id"]))
+            if hits:
+                saved_hits[str(item["id"])] = hits
+        with self._write_lock:
+            with self._stats_lock:
+                # 同 id 的规则保留运行统计；首次加载时从文件恢复命中次数
+                stats = {}
+                for rule, _, _ in entries:
+                    rule_id = rule["id"]
+                    stats[rule_id] = self._stats.get(rule_id) or _RuleStats()
+                    stats[rule_id].hits = max(stats[rule_id].hits, saved_hits.get(rule_id, 0))
+                self._stats = stats
+            ids = [int(rule["id"]) for rule, _, _ in entries if rule["id"].isdigit()]
+            self._next_id = max([self._next_id] + [i + 1 for i in ids])
+            self._publish(tuple(entries), persist=False)
+            self._file_mtime = mtime
+        for rule, _, _ in entries:
+            if rule["expires_at"] is not None:
+                self._expiry.schedule(rule["expires_at"], rule["id"])
+        return len(entries)
+
+    def check_reload(self) -> bool:
+        """规则文件 mtime 与上次读写时不同则热加载，返回是否重新加载。"""
+        p = self._persist_path
+        if p is None:
+            return False
+        try:
+            mtime = p.stat().st_mtime_ns
+        except OSError:
+            return False
+        if mtime == self._file_mtime:
+            return False
+        self.load_rules()
+        return True
 
-            # 使用正则表达式匹配 URL
+    def _watch_loop(self):
+        while True:
+            time.sleep(_RELOAD_INTERVAL)
             try:
-                if re.search(rule["regex"], url):
-                    matched.append(rule)
-            except re.error:
-                # 正则表达式错误，跳过该规则
+                self.check_reload()
+                mock_response.refresh([r["data"] for r in self._snapshot.rules if r["type"] == "mock_response"])
+                if self._hits_dirty:
+                    with self._write_lock:
+                        self._persist()
+            except Exception:
                 pass
-                
-        return matched
+
+    def match_url(self, url: str, phase: str) -> List[Dict]:
+        """
+        按 URL 与阶段返回命中的规则（按添加顺序）
+
+        Args:
+            url: 完整 URL
+            phase: 阶段标识，'request' 或 'response'
+        """
+        matcher = self._snapshot.matchers.get(phase)
+        if matcher is None:
+            return []
+        return matcher.match(url)
+
+    def match_rules(self, flow, phase: str) -> List[Dict]:
+        """
+        根据请求/响应匹配适用的规则
+
+        Args:
+            flow: mitmproxy 的 HTTPFlow 对象
+            phase: 阶段标识，'request' 或 'response'
+
+        Returns:
+            匹配的规则列表
+        """
+        # 同一 flow 同一阶段只匹配、计数一次（响应阶段 responseheaders 与 response 两个钩子共用结果）
+        key = "traffic_rules_" + phase
+        cached = flow.metadata.get(key)
+        if cached is not None:
+            return cached
+        start = time.perf_counter()
+        rules = self.match_url(flow.request.pretty_url, phase)
+        elapsed = time.perf_counter() - start
+        now = time.time()
+        exhausted = []
+        with self._stats_lock:
+            phase_stats = self._phase_stats.get(phase)
+            if phase_stats is not None:
+                phase_stats[0] += 1
+                phase_stats[1] += elapsed
+            if rules:
+                active = []
+                for rule in rules:
+                    stats = self._stats.get(rule["id"])
+                    if stats is None:
+                        active.append(rule)
+                        continue
+                    limit = rule.get("max_hits")
+                    if limit and stats.hits >= limit:
+                        # 已达上限、等待调度线程移除的规则不再生效
+                        continue
+                    stats.hits += 1
+                    stats.last_hit = now
+                    active.append(rule)
+                    if limit:
+                        self._hits_dirty = True
+                    if limit and stats.hits >= limit:
+                        exhausted.append(rule["id"])
+                rules = active
+        # 快照重建交给调度线程，不在代理线程上进行
+        for rule_id in exhausted:
+            self._expiry.schedule(now, rule_id)
+        flow.metadata[key] = rules
+        return rules
 
 
 # 创建全局单例实例
@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+"""
+WebSocket 消息录制存储：按连接保存有界的帧环形缓冲，供记录器页与 AI 工具查看。
+- 每条连接最多保留 _MAX_FRAMES_PER_CONNECTION 帧，超出时淘汰最早的帧；连接数超出上限时淘汰最早的连接。
+- 帧载荷不超过 _INLINE_MAX 字节时内联保存，超过时存入 body_store，仅保留 blob id。
+"""
+import base64
+import threading
+import time
+from collections import OrderedDict, deque
+
+from . import body_store
+from .browser_packets import DEFAULT_SESSION, normalize_session
+
+_CONNECTIONS = OrderedDict()  # 连接 id -> 连接信息（含 frames 环形缓冲）
+_lock = threading.RLock()
+_MAX_CONNECTIONS = 500
+_MAX_FRAMES_PER_CONNECTION = 1000
+_INLINE_MAX = 4096  # 载荷超过该字节数时存入 body_store
+_PREVIEW_CHARS = 1024
+
+# RFC 6455 操作码
+OPCODE_NAMES = {0: "continuation", 1: "text", 2: "binary", 8: "close", 9: "ping", 10: "pong"}
+
+
+def _release_frames(conn):
+    for fr in conn["frames"]:
+        body_store.release(fr.get("payload_blob"))
+
+
+def _get_or_create(conn_id, url=""):
+    conn = _CONNECTIONS.get(conn_id)
+    if conn is None:
+        conn = _CONNECTIONS[conn_id] = {
+            "id": conn_id,
+            "session": DEFAULT_SESSION,
+            "url": url or "",
+            "start_time": time.time(),
+            "end_time": None,
+            "close_code": None,
+            "frame_count": 0,
+            "bytes_client": 0,
+            "bytes_server": 0,
+            "frames": deque(),
+        }
+        while len(_CONNECTIONS) > _MAX_CONNECTIONS:
+            _, old = _CONNECTIONS.popitem(last=False)
+            _release_frames(old)
+    elif url and not conn["url"]:
+        conn["url"] = url
+    return conn
+
+
+def start_connection(conn_id: str, url: str, timestamp: float = None, session: str = None):
+    """记录 WebSocket 连接建立，session 为所属采集会话。"""
+    with _lock:
+        conn = _get_or_create(conn_id, url)
+        conn["session"] = normalize_session(session)
+        if timestamp:
+            conn["start_time"] = timestamp
+
+
+def end_connection(conn_id: str, close_code: int = None, timestamp: float = None):
+    """记录 WebSocket 连接关闭。"""
+    with _lock:
+        conn = _CONNECTIONS.get(conn_id)
+        if conn is not None:
+            conn["end_time"] = timestamp or time.time()
+            conn["close_code"] = close_code
+
+
+def add_frame(conn_id: str, url: str, from_client: bool, opcode: int, payload: bytes, timestamp: float = None):
+    """记录一帧。payload 为原始字节（文本帧为 UTF-8），大载荷存入 body_store。返回帧 id。"""
+    payload = payload or b""
+    if isinstance(payload, str):
+        payload = payload.encode("utf-8")
+    frame = {
+        "time": timestamp or time.time(),
+        "direction": "client_to_server" if from_client else "server_to_client",
+        "opcode": int(opcode),
+        "opcode_name": OPCODE_NAMES.get(int(opcode), str(opcode)),
+        "size": len(payload),
+        "payload_blob": None,
+        "payload_inline": None,
+    }
+    if len(payload) > _INLINE_MAX:
+        frame["payload_blob"] = body_store.put(payload)
+    else:
+        frame["payload_inline"] = payload
+    with _lock:
+        conn = _get_or_create(conn_id, url)
+        conn["frame_count"] += 1
+        frame["id"] = conn["frame_count"]
+        conn["bytes_client" if from_client else "bytes_server"] += len(payload)
+        conn["frames"].append(frame)
+        while len(conn["frames"]) > _MAX_FRAMES_PER_CONNECTION:
+            body_store.release(conn["frames"].popleft().get("payload_blob"))
+    return frame["id"]
+
+
+def _conn_summary(conn):
+    return {k: v for k, v in conn.items() if k != "frames"} | {"frames_retained": len(conn["frames"])}
+
+
+def _frame_summary(frame):
+    out = {k: v for k, v in frame.items() if k != "payload_inline"}
+    data = frame.get("payload_inline")
+    if data is not None and frame["opcode"] in (0, 1):
+        out["payload_preview"] = data[:_PREVIEW_CHARS * 4].decode("utf-8", errors="replace")[:_PREVIEW_CHARS]
+    else:
+        out["payload_preview"] = None
+    return out
+
+
+def list_connections(url_contains: str = None, limit: int = 200, session: str = None):
+    """返回 WebSocket 连接列表（不含帧），可选按 URL、采集会话过滤，按建立时间倒序，最多 limit 条。"""
+    session = normalize_session(session) if session else None
+    with _lock:
+        out = [_conn_summary(c) for c in _CONNECTIONS.values() if session is None or c["session"] == session]
+    if url_contains and url_contains.strip():
+        q = url_contains.strip().lower()
+        out = [c for c in out if q in (c.get("url") or "").lower()]
+    out.reverse()
+    return out[: max(1, min(1000, int(limit) if limit else 200))]
+
+
+def list_frames(conn_id: str, direction: str = None, limit: int = 200):
+    """返回某连接的帧列表（载荷仅含文本预览），按时间倒序，最多 limit 条；连接不存在返回 None。"""
+    with _lock:
+        conn = _CONNECTIONS.get(conn_id)
+        if conn is None:
+            return None
+        frames = list(conn["frames"])
+    if direction in ("client_to_server", "server_to_client"):
+        frames = [f for f in frames if f["direction"] == direction]
+    frames.reverse()
+    return [_frame_summary(f) for f in frames[: max(1, min(1000, int(limit) if limit else 200))]]
+
+
+def get_frame(conn_id: str, frame_id: int, max_chars: int = 200000):
+    """
+    按连接 id 与帧 id 返回一帧详情，不存在返回 None。
+    文本帧返回 payload_text（最多 max_chars 字符），其他帧返回 payload_base64。
+    """
+    with _lock:
+        conn = _CONNECTIONS.get(conn_id)
+        if conn is None:
+            return None
+        frame = next((f for f in conn["frames"] if f["id"] == frame_id), None)
+    if frame is None:
+        return None
+    data = frame.get("payload_inline")
+    if data is None:
+        data = body_store.get(frame.get("payload_blob")) or b""
+    out = _frame_summary(frame)
+    out["url"] = conn["url"]
+    if frame["opcode"] in (0, 1):
+        out["payload_text"] = data.decode("utf-8", errors="replace")[:max_chars]
+    else:
+        out["payload_base64"] = base64.b64encode(data[:max_chars]).decode("ascii")
+    return out
+
+
+def clear_messages():
+    """清空所有 WebSocket 录制。"""
+    with _lock:
+        for conn in _CONNECTIONS.values():
+            _release_frames(conn)
+        _CONNECTIONS.clear()
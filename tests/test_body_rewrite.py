@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+"""流式改写的判定与改写结果前缀的保留。"""
+from mitmproxy import http
+
+from services.body_rewrite import RECORD_LIMIT, STREAM_THRESHOLD, StreamRewriter, should_stream
+
+
+def _response(**headers):
+    response = http.Response.make(200)
+    response.headers.pop("content-length", None)
+    for name, value in headers.items():
+        response.headers[name.replace("_", "-")] = value
+    return response
+
+
+def test_should_stream_skips_binary_media():
+    assert not should_stream(_response(content_type="video/mp4"))
+    assert not should_stream(_response(content_type="image/png"), passthrough=True)
+    assert should_stream(_response(content_type="text/html"))
+    assert should_stream(_response(content_type="text/html"), passthrough=True)
+
+
+def test_should_stream_uses_decoded_size_estimate():
+    small = str(STREAM_THRESHOLD // 2)
+    assert not should_stream(_response(content_type="application/json", content_length=small))
+    assert should_stream(_response(content_type="application/json", content_length=small, content_encoding="gzip"))
+
+
+def test_stream_rewriter_keeps_bounded_prefix():
+    rewriter = StreamRewriter([(b"foo", b"bar")])
+    chunk = b"foo " * 50000
+    out = b"".join(rewriter(chunk) + rewriter(chunk) + rewriter(b""))
+    assert len(rewriter.head) == RECORD_LIMIT
+    assert bytes(rewriter.head) == out[:RECORD_LIMIT]
+    assert b"foo" not in out
@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+"""录包全文检索：分词边界、单字符与超长词、候选的子串校验。"""
+import pytest
+
+from services import browser_packets
+
+
+@pytest.fixture(autouse=True)
+def _isolated_store(monkeypatch):
+    monkeypatch.setattr(browser_packets, "_PERSIST_PATH", None)
+    browser_packets.clear_packets()
+    yield
+    browser_packets.clear_packets()
+
+
+def _add(body, url="https://example.com/"):
+    return browser_packets.add_packet("GET", url, {}, None, 200, {"Content-Type": "text/plain"}, body, session="search-test")
+
+
+def _search(query):
+    return {r["id"] for r in browser_packets.search_packets(query, session="search-test")}
+
+
+def test_terms_split_on_underscore_dash_and_dot():
+    pid = _add('{"access_token": "x", "user-id": 7, "api.v2": 1}')
+    assert pid in _search("token")
+    assert pid in _search("access_token")
+    assert pid in _search("user")
+    assert pid in _search("v2")
+
+
+def test_single_char_and_long_terms():
+    long_term = "a" * 80
+    pid = _add("q=7&key=" + long_term)
+    other = _add("key=" + "a" * 70)
+    assert pid in _search("7")
+    assert _search(long_term) == {pid}
+    assert other not in _search(long_term)
+
+
+def test_entries_keep_small_preview_but_search_whole_body():
+    body = ("x" * 3000 + " needle_marker " + "y" * 3000).encode()
+    pid = _add(body)
+    entry = browser_packets.get_packet(pid)
+    assert len(entry["response_body_preview"]) <= browser_packets._ENTRY_PREVIEW + 1
+    hits = browser_packets.search_packets("needle_marker", session="search-test")
+    assert [h["id"] for h in hits] == [pid]
+    assert "needle_marker" in hits[0]["matches"][0]["snippet"]
@@ -0,0 +1,22 @@
+# -*- coding: utf-8 -*-
+"""patch_json_body：多条规则共用一次解析，并按规则统计各自改动的字节数。"""
+import json
+
+from services import json_patch
+
+
+def test_apply_rules_reports_bytes_per_rule():
+    body = json.dumps({"user": {"name": "alice", "token": "x" * 1000}, "items": [1, 2, 3]})
+    rules = [
+        {"id": "set-name", "data": {"op": "set", "path": "/user/name", "value": "bob"}},
+        {"id": "drop-token", "data": {"op": "delete", "path": "user.token"}},
+        {"id": "missing", "data": {"op": "delete", "path": "/nope"}},
+    ]
+    text, changed = json_patch.apply_rules(body, rules)
+    assert json.loads(text) == {"user": {"name": "bob"}, "items": [1, 2, 3]}
+    assert changed == {"set-name": len('"bob"'), "drop-token": 1002}
+
+
+def test_apply_rules_without_changes():
+    assert json_patch.apply_rules("not json", []) == (None, {})
+    assert json_patch.apply_rules("{}", [{"id": 1, "data": {"op": "delete", "path": "/a"}}]) == (None, {})
@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+"""mock_response 规则：body 文件在添加规则时读入，请求阶段不读磁盘，文件修改由 refresh 重新读取。"""
+from services import mock_response
+from services.traffic_rules import TrafficRuleManager
+
+
+def test_body_file_is_preloaded_and_refreshed(tmp_path):
+    body_file = tmp_path / "mock.json"
+    body_file.write_bytes(b'{"v": 1}')
+    data = {"body_file": str(body_file), "headers": {"Content-Type": "application/json"}}
+    manager = TrafficRuleManager(isolated=True)
+    manager.add_rule("mock_response", r"^https://api\.example\.com/", data)
+
+    # 请求阶段只用已读入的 body：文件被删除也不再访问磁盘
+    body_file.unlink()
+    assert mock_response.resolve(data) == (200, {"Content-Type": "application/json"}, b'{"v": 1}')
+
+    body_file.write_bytes(b'{"v": 2}')
+    mock_response.refresh([data])
+    assert mock_response.resolve(data)[2] == b'{"v": 2}'
+
+    # 规则移除后缓存随下次 refresh 丢弃，来源不可用时放行
+    mock_response.refresh([])
+    assert mock_response.resolve(data) is None
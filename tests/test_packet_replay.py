@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+"""批量重放：变体只改写涉及的 query 参数；单个任务的异常只记入该任务的结果。"""
+from services import packet_replay
+
+
+def test_with_params_keeps_untouched_params_verbatim():
+    url = "https://example.com/s?q=a%20b&tag=x+y&flag&page=1"
+    assert packet_replay._with_params(url, {"page": 2}) == "https://example.com/s?q=a%20b&tag=x+y&flag&page=2"
+    assert packet_replay._with_params(url, {"q": None}) == "https://example.com/s?tag=x+y&flag&page=1"
+    assert packet_replay._with_params("https://example.com/s", {"k": "v w"}) == "https://example.com/s?k=v+w"
+
+
+class _Session:
+    def request(self, method, url, headers=None, **kwargs):
+        "".join(headers.values()).encode("latin-1")
+        raise AssertionError("unreachable")
+
+
+def test_send_reports_non_request_errors_in_row():
+    job = ("1", 0, "GET", "https://example.com/", {"X-Name": "名字"}, b"")
+    row = packet_replay._send(_Session(), packet_replay._HostRateLimiter(None), job, 5)
+    assert row["status"] is None
+    assert "latin-1" in row["error"]
+    assert row["time_ms"] is not None
@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+"""录制代理完整重启：复用重启前建立的 keep-alive 连接的客户端应能重新连上新实例。"""
+import socket
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+from services import browser_session
+
+
+class _Upstream(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        body = b"ok"
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def test_keepalive_connection_survives_full_restart(monkeypatch):
+    upstream = ThreadingHTTPServer(("127.0.0.1", 0), _Upstream)
+    threading.Thread(target=upstream.serve_forever, daemon=True).start()
+    port = _free_port()
+    monkeypatch.setattr(browser_session, "DEFAULT_PORT", port)
+    url = "http://127.0.0.1:%d/" % upstream.server_address[1]
+    proxies = {"http": "http://127.0.0.1:%d" % port}
+    try:
+        assert browser_session.ensure_proxy_started() == (True, None)
+        with requests.Session() as client:
+            client.trust_env = False
+            assert client.get(url, proxies=proxies, timeout=5).text == "ok"
+            ok, result = browser_session.restart_proxy(drain_timeout=2, full=True)
+            assert ok, result
+            assert client.get(url, proxies=proxies, timeout=5).text == "ok"
+    finally:
+        browser_session.stop_proxy()
+        upstream.shutdown()
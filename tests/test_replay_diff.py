@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+"""重放差异的字符预算：大 body 的文本对比与响应头差异都受 max_chars 约束。"""
+import json
+import time
+
+from services import replay_diff
+
+
+def test_text_diff_input_is_bounded():
+    old = "\n".join("line %d" % i for i in range(200000))
+    new = "\n".join("line %d changed" % i for i in range(200000))
+    start = time.time()
+    out = replay_diff.diff_bodies(old.encode(), "text/plain", new.encode(), "text/plain", max_chars=500)
+    assert time.time() - start < 5
+    assert out["input_truncated"] and out["truncated"]
+    assert len(out["diff"]) <= 500
+
+
+def test_header_diff_counts_toward_budget():
+    diff = {"added": {"x-h%d" % i: "v" * 500 for i in range(50)}}
+    out, used = replay_diff._budget_headers(diff, 300)
+    assert out["truncated"]
+    assert used <= 300
+    assert len(json.dumps(out, ensure_ascii=False)) < 400
@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+"""代理缓存的可缓存性判断：有效期计算与带凭据请求的处理；磁盘层命中不在事件循环线程读盘。"""
+import asyncio
+import threading
+from email.utils import formatdate
+
+from mitmproxy import http
+
+from services.browser_packets import flush_pending
+from services.response_cache import ResponseCache, freshness_ttl
+
+
+def _headers(**kv):
+    return http.Headers(**{k.replace("_", "-"): v for k, v in kv.items()})
+
+
+def test_freshness_ttl_requires_freshness_information():
+    assert freshness_ttl(_headers(content_type="text/html"), 300) is None
+    assert freshness_ttl(_headers(cache_control="public"), 300) == 300
+    assert freshness_ttl(_headers(cache_control="max-age=60"), 300) == 60
+
+
+def test_freshness_ttl_last_modified_heuristic():
+    now = 1_700_000_000
+    headers = _headers(date=formatdate(now, usegmt=True), last_modified=formatdate(now - 1000, usegmt=True))
+    assert freshness_ttl(headers, 300) == 100
+    headers = _headers(date=formatdate(now, usegmt=True), last_modified=formatdate(now - 100000, usegmt=True))
+    assert freshness_ttl(headers, 300) == 300
+
+
+def test_requests_with_cookie_are_not_cached():
+    cache = ResponseCache()
+    cache.configure(enabled=True, disk_mb=0)
+    response = http.Response.make(200, b"secret", {"Cache-Control": "max-age=60"})
+    request = http.Request.make("GET", "http://example.com/me", b"", {"Cookie": "sid=1"})
+    assert cache.store(request, response) is False
+    assert cache.lookup(request) is None
+    anonymous = http.Request.make("GET", "http://example.com/me")
+    assert cache.store(anonymous, response) is True
+    assert cache.lookup(request) is None
+    assert cache.lookup(anonymous) is not None
+
+
+def test_disk_hit_is_read_off_the_event_loop(tmp_path):
+    cache = ResponseCache()
+    cache.configure(enabled=True)
+    cache.set_disk_dir(tmp_path)
+    request = http.Request.make("GET", "http://example.com/app.js")
+    response = http.Response.make(200, b"x" * 100, {"Cache-Control": "max-age=60"})
+    assert cache.store(request, response) is True
+    assert flush_pending()
+    cache.configure(memory_mb=0)  # 清空内存层，只剩磁盘条目
+
+    readers = []
+    read_file = cache._read_file
+
+    def spy(path, meta_only=False):
+        readers.append(threading.get_ident())
+        return read_file(path, meta_only)
+
+    cache._read_file = spy
+
+    async def lookup():
+        return threading.get_ident(), await cache.lookup_async(request)
+
+    loop_thread, cached = asyncio.run(lookup())
+    assert cached[2] == b"x" * 100 and cached[3] == "disk"
+    assert readers and loop_thread not in readers
@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+"""流量规则匹配索引的回归测试：分桶、合并匹配的结果须与逐条 re.search 一致。"""
+import re
+
+from services.traffic_rules import TrafficRuleManager
+
+PATTERNS = [
+    r"^https://a\.com/|foo",
+    r"^https://b\.com/.*|^https://c\.com/",
+    r"^https://a\.com/|^https://a\.comx",
+    r"^https?://d\.com/(x|y)",
+    r"^https://e\.com/[|]",
+    r"^https://e\.com/\|z",
+    r"^http://f\.com:8080/",
+    r"(?i)^https://G\.com/",
+    r"api/v\d+/user",
+    r"(a)\1",
+    r"^https://example\.com/?",
+    r"^https://example\.com:?",
+    r"^https://example\.com/*x?",
+    r"^https://a\.b\.com\/?",
+    r"(a)?(?(1)b|c)",
+]
+
+URLS = [
+    "http://x.com/foo",
+    "https://a.com/",
+    "https://a.comx/p",
+    "https://b.com/q",
+    "https://c.com/z",
+    "https://d.com/y",
+    "http://d.com/x",
+    "https://e.com/|",
+    "https://e.com/|z",
+    "http://f.com:8080/",
+    "https://g.com/",
+    "https://h.com/api/v2/user",
+    "https://h.com/aa",
+    "https://h.com/none",
+    "https://example.company.com/x",
+    "https://example.com/",
+    "https://a.b.community/",
+    "https://h.com/ab",
+    "https://h.com/c",
+]
+
+
+def test_match_url_agrees_with_re_search():
+    manager = TrafficRuleManager(isolated=True)
+    for pattern in PATTERNS:
+        manager.add_rule("block_request", pattern, {})
+    for url in URLS:
+        expected = [p for p in PATTERNS if re.search(p, url)]
+        got = [rule["regex"] for rule in manager.match_url(url, "request")]
+        assert got == expected, url
+
+
+class _Flow:
+    def __init__(self, url):
+        self.metadata = {}
+        self.request = type("Request", (), {"pretty_url": url})()
+
+
+def test_max_hits_survive_reload(tmp_path):
+    path = tmp_path / "rules.json"
+    manager = TrafficRuleManager(isolated=True)
+    manager.set_persist_path(path)
+    manager.add_rule("block_request", r"^https://a\.com/", {}, max_hits=3)
+    for _ in range(2):
+        assert manager.match_rules(_Flow("https://a.com/x"), "request")
+    with manager._write_lock:
+        manager._persist()
+
+    restarted = TrafficRuleManager(isolated=True)
+    restarted.set_persist_path(path)
+    assert restarted.load_rules() == 1
+    assert restarted.match_rules(_Flow("https://a.com/y"), "request")
+    assert restarted.match_rules(_Flow("https://a.com/z"), "request") == []
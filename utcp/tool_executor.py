@@ -8,6 +8,7 @@ from . import file_tool
 from . import traffic_tools
 from services import knowledge_base
 from services import browser_packets
+from services import ws_messages
 
 
 def execute_tool(name: str, arguments: dict, llm_judge_callback=None, safe_mode: bool = False, project_root=None, uploads_dir=None, unlimited_wait: bool = False) -> str:
@@ -102,7 +103,11 @@ def execute_tool(name: str, arguments: dict, llm_judge_callback=None, safe_mode:
                     limit = 50
             else:
                 limit = 50
-            items = browser_packets.list_packets(url_contains=url_contains, limit=limit)
+            session = (args.get("capture_session") or "").strip() or None
+            if args.get("grouped") is True:
+                groups = browser_packets.list_packet_groups(url_contains=url_contains, limit=limit, session=session)
+                return json.dumps({"success": True, "protocol": "UTCP", "message": "ok", "data": {"groups": groups, "count": len(groups)}}, ensure_ascii=False)
+            items = browser_packets.list_packets(url_contains=url_contains, limit=limit, session=session)
             return json.dumps({"success": True, "protocol": "UTCP", "message": "ok", "data": {"packets": items, "count": len(items)}}, ensure_ascii=False)
 
         if name == "get_browser_packet":
@@ -112,32 +117,125 @@ def execute_tool(name: str, arguments: dict, llm_judge_callback=None, safe_mode:
             p = browser_packets.get_packet(packet_id)
             if not p:
                 return json.dumps({"success": False, "protocol": "UTCP", "message": "未找到该录包", "data": None}, ensure_ascii=False)
+            if args.get("include_full_body") is True:
+                p = dict(p)
+                p["request_body_full"] = browser_packets.get_packet_body_text(packet_id, "request", max_chars=50000)
+                p["response_body_full"] = browser_packets.get_packet_body_text(packet_id, "response", max_chars=50000)
             return json.dumps({"success": True, "protocol": "UTCP", "message": "ok", "data": p}, ensure_ascii=False)
 
+        if name == "search_browser_packets":
+            query = (args.get("query") or "").strip()
+            if not query:
+                return json.dumps({"success": False, "protocol": "UTCP", "message": "缺少 query", "data": None}, ensure_ascii=False)
+            limit = args.get("limit")
+            try:
+                limit = max(1, min(200, int(limit))) if limit is not None else 20
+            except (TypeError, ValueError):
+                limit = 20
+            session = (args.get("capture_session") or "").strip() or None
+            results = browser_packets.search_packets(query, limit=limit, session=session)
+            return json.dumps({"success": True, "protocol": "UTCP", "message": "ok", "data": {"results": results, "count": len(results)}}, ensure_ascii=False)
+
+        if name == "list_websocket_messages":
+            conn_id = (args.get("connection_id") or "").strip()
+            limit = args.get("limit")
+            try:
+                limit = max(1, min(200, int(limit))) if limit is not None else 50
+            except (TypeError, ValueError):
+                limit = 50
+            if not conn_id:
+                session = (args.get("capture_session") or "").strip() or None
+                conns = ws_messages.list_connections(url_contains=args.get("url_contains") or "", limit=limit, session=session)
+                return json.dumps({"success": True, "protocol": "UTCP", "message": "ok", "data": {"connections": conns, "count": len(conns)}}, ensure_ascii=False)
+            frames = ws_messages.list_frames(conn_id, direction=args.get("direction"), limit=limit)
+            if frames is None:
+                return json.dumps({"success": False, "protocol": "UTCP", "message": "未找到该 WebSocket 连接", "data": None}, ensure_ascii=False)
+            return json.dumps({"success": True, "protocol": "UTCP", "message": "ok", "data": {"frames": frames, "count": len(frames)}}, ensure_ascii=False)
+
+        if name == "get_websocket_message":
+            conn_id = (args.get("connection_id") or "").strip()
+            try:
+                frame_id = int(args.get("frame_id"))
+            except (TypeError, ValueError):
+                frame_id = None
+            if not conn_id or frame_id is None:
+                return json.dumps({"success": False, "protocol": "UTCP", "message": "缺少 connection_id 或 frame_id", "data": None}, ensure_ascii=False)
+            frame = ws_messages.get_frame(conn_id, frame_id, max_chars=50000)
+            if not frame:
+                return json.dumps({"success": False, "protocol": "UTCP", "message": "未找到该帧", "data": None}, ensure_ascii=False)
+            return json.dumps({"success": True, "protocol": "UTCP", "message": "ok", "data": frame}, ensure_ascii=False)
+
         if name == "add_traffic_modification":
             url_regex = args.get("url_regex") or ""
             modification_type = args.get("modification_type") or ""
             data = args.get("data") or {}
-            result = traffic_tools.add_traffic_modification(url_regex, modification_type, data)
+            result = traffic_tools.add_traffic_modification(
+                url_regex, modification_type, data,
+                ttl_seconds=args.get("ttl_seconds"), max_hits=args.get("max_hits"),
+                listener=(args.get("listener") or "").strip() or None,
+            )
             return json.dumps({"success": result.get("success", False), "protocol": "UTCP", "message": result.get("message", ""), "data": result}, ensure_ascii=False)
 
         if name == "clear_traffic_rules":
-            result = traffic_tools.clear_traffic_rules()
+            result = traffic_tools.clear_traffic_rules(listener=(args.get("listener") or "").strip() or None)
             return json.dumps({"success": result.get("success", False), "protocol": "UTCP", "message": result.get("message", ""), "data": result}, ensure_ascii=False)
 
         if name == "list_traffic_rules":
-            result = traffic_tools.list_traffic_rules()
+            result = traffic_tools.list_traffic_rules(listener=(args.get("listener") or "").strip() or None)
             return json.dumps({"success": result.get("success", False), "protocol": "UTCP", "message": result.get("message", ""), "data": result}, ensure_ascii=False)
 
+        if name == "dry_run_traffic_rules":
+            sample_limit = args.get("sample_limit")
+            try:
+                sample_limit = max(1, min(100, int(sample_limit))) if sample_limit is not None else 10
+            except (TypeError, ValueError):
+                sample_limit = 10
+            session = (args.get("capture_session") or "").strip() or None
+            result = traffic_tools.dry_run_traffic_rules(args.get("rules") or [], capture_session=session, sample_limit=sample_limit)
+            return json.dumps({"success": result.get("success", False), "protocol": "UTCP", "message": result.get("message", result.get("error", "")), "data": result.get("data")}, ensure_ascii=False)
+
         if name == "replay_packet":
             packet_id = (args.get("packet_id") or "").strip()
             if not packet_id:
                 return json.dumps({"success": False, "protocol": "UTCP", "message": "缺少 packet_id", "data": None}, ensure_ascii=False)
-            result = traffic_tools.replay_packet(packet_id)
+            try:
+                max_diff_chars = max(200, min(20000, int(args.get("max_diff_chars") or 2000)))
+            except (TypeError, ValueError):
+                max_diff_chars = 2000
+            result = traffic_tools.replay_packet(packet_id, max_diff_chars=max_diff_chars,
+                                                 listener=(args.get("listener") or "").strip() or None)
             if "error" in result:
                 return json.dumps({"success": False, "protocol": "UTCP", "message": result.get("error", ""), "data": result}, ensure_ascii=False)
             return json.dumps({"success": True, "protocol": "UTCP", "message": "重发成功", "data": result}, ensure_ascii=False)
 
+        if name == "replay_packets":
+            packet_ids = args.get("packet_ids") or []
+            if isinstance(packet_ids, str):
+                packet_ids = [p for p in packet_ids.replace(",", " ").split() if p]
+            try:
+                concurrency = int(args.get("concurrency") or 8)
+            except (TypeError, ValueError):
+                concurrency = 8
+            result = traffic_tools.replay_packets(
+                packet_ids,
+                variations=args.get("variations"),
+                concurrency=concurrency,
+                per_host_rps=args.get("per_host_rps"),
+                timeout=args.get("timeout_seconds"),
+            )
+            return json.dumps({"success": result.get("success", False), "protocol": "UTCP", "message": result.get("message", result.get("error", "")), "data": result.get("data")}, ensure_ascii=False)
+
+        if name == "proxy_listeners":
+            isolated = args.get("isolated_rules")
+            result = traffic_tools.proxy_listeners(
+                action=(args.get("action") or "list").strip(),
+                name=(args.get("name") or "").strip() or None,
+                port=args.get("port"),
+                capture_session=(args.get("capture_session") or "").strip() or None,
+                isolated_rules=True if isolated is None else bool(isolated),
+            )
+            return json.dumps({"success": result.get("success", False), "protocol": "UTCP", "message": result.get("message", result.get("error", "")), "data": result.get("data")}, ensure_ascii=False)
+
         return json.dumps({"success": False, "error": f"未知工具: {name}"}, ensure_ascii=False)
     except Exception as e:
         return json.dumps({"success": False, "error": str(e)}, ensure_ascii=False)
@@ -161,6 +161,14 @@ def get_openai_tools():
                             "type": "integer",
                             "description": "可选。返回最多几条，默认 50，最大 200。",
                         },
+                        "capture_session": {
+                            "type": "string",
+                            "description": "可选。采集会话名：附加监听器的采集会话，或设置中开启「代理认证采集会话」后浏览器代理认证使用的用户名（如对话 id）；只在该会话的录包中查询，不传则查询全部会话。",
+                        },
+                        "grouped": {
+                            "type": "boolean",
+                            "description": "可选。为 true 时按 URL 模板分组返回（/item/123 与 /item/124 合并为 /item/{int}），每组含数量 count 与代表录包 packet_id，适合爬取流量较多时先概览接口，默认 false。",
+                        },
                     },
                 },
             },
@@ -169,7 +177,7 @@ def get_openai_tools():
             "type": "function",
             "function": {
                 "name": "get_browser_packet",
-                "description": "根据 id 获取记录器某条录包的详情（请求头、请求体预览、响应头、响应体预览）。id 来自 list_browser_packets。",
+                "description": "根据 id 获取记录器某条录包的详情（请求头、请求体预览、响应头、响应体预览，预览只含前 1KB）。id 来自 list_browser_packets。",
                 "parameters": {
                     "type": "object",
                     "properties": {
@@ -177,16 +185,99 @@ def get_openai_tools():
                             "type": "string",
                             "description": "录包 id。",
                         },
+                        "include_full_body": {
+                            "type": "boolean",
+                            "description": "可选。为 true 时额外返回解压并解码后的完整请求/响应 body（文本最多 5 万字符；二进制 body 只返回大小与类型，不解码），默认 false。",
+                        },
                     },
                     "required": ["packet_id"],
                 },
             },
         },
+        {
+            "type": "function",
+            "function": {
+                "name": "search_browser_packets",
+                "description": "在记录器录包的请求/响应头与 body（前 64KB）中全文检索（如 token、报错信息、参数名），返回命中的录包 id、字段与片段位置，无需逐条调用 get_browser_packet。",
+                "parameters": {
+                    "type": "object",
+                    "properties": {
+                        "query": {
+                            "type": "string",
+                            "description": "检索内容，按词匹配（_ - . 等符号视为分隔，token 可命中 access_token），所有词都出现的录包才算命中，例如 access_token、SQL syntax。",
+                        },
+                        "limit": {
+                            "type": "integer",
+                            "description": "可选。返回最多几条，默认 20，最大 200。",
+                        },
+                        "capture_session": {
+                            "type": "string",
+                            "description": "可选。只检索该采集会话的录包，含义同 list_browser_packets 的 capture_session。",
+                        },
+                    },
+                    "required": ["query"],
+                },
+            },
+        },
+        {
+            "type": "function",
+            "function": {
+                "name": "list_websocket_messages",
+                "description": "列出记录器录制的 WebSocket 流量。不传 connection_id 时返回连接列表（URL、帧数、收发字节）；传入 connection_id 时返回该连接的帧列表（方向、操作码、大小、时间、文本预览）。",
+                "parameters": {
+                    "type": "object",
+                    "properties": {
+                        "connection_id": {
+                            "type": "string",
+                            "description": "可选。WebSocket 连接 id，来自不带该参数时的返回结果。",
+                        },
+                        "url_contains": {
+                            "type": "string",
+                            "description": "可选。列连接时只返回 URL 中包含该字符串的连接。",
+                        },
+                        "capture_session": {
+                            "type": "string",
+                            "description": "可选。列连接时只返回该采集会话的连接。",
+                        },
+                        "direction": {
+                            "type": "string",
+                            "enum": ["client_to_server", "server_to_client"],
+                            "description": "可选。列帧时只返回该方向的帧。",
+                        },
+                        "limit": {
+                            "type": "integer",
+                            "description": "可选。返回最多几条，默认 50，最大 200。",
+                        },
+                    },
+                },
+            },
+        },
+        {
+            "type": "function",
+            "function": {
+                "name": "get_websocket_message",
+                "description": "获取某 WebSocket 帧的完整载荷（文本帧返回文本，二进制帧返回 base64）。id 来自 list_websocket_messages。",
+                "parameters": {
+                    "type": "object",
+                    "properties": {
+                        "connection_id": {
+                            "type": "string",
+                            "description": "WebSocket 连接 id。",
+                        },
+                        "frame_id": {
+                            "type": "integer",
+                            "description": "帧 id。",
+                        },
+                    },
+                    "required": ["connection_id", "frame_id"],
+                },
+            },
+        },
         {
             "type": "function",
             "function": {
                 "name": "add_traffic_modification",
-                "description": "添加网络流量修改规则。可以修改请求头、替换响应内容或阻断请求。当用户需要拦截、修改或阻断特定网站流量时使用此工具。",
+                "description": "添加网络流量修改规则。可以修改请求头、替换响应内容、按路径修改 JSON 响应、阻断请求或由代理直接返回模拟响应（不访问上游）。当用户需要拦截、修改、阻断或 mock 特定网站流量时使用此工具。",
                 "parameters": {
                     "type": "object",
                     "properties": {
@@ -196,12 +287,12 @@ def get_openai_tools():
                         },
                         "modification_type": {
                             "type": "string",
-                            "enum": ["modify_request_header", "modify_response_body", "block_request"],
-                            "description": "修改类型：modify_request_header（修改请求头）、modify_response_body（修改响应体）、block_request（阻断请求）",
+                            "enum": ["modify_request_header", "modify_response_body", "block_request", "mock_response", "patch_json_body"],
+                            "description": "修改类型：modify_request_header（修改请求头）、modify_response_body（修改响应体）、block_request（阻断请求）、mock_response（代理直接返回模拟响应）、patch_json_body（按路径修改 JSON 响应体）",
                         },
                         "data": {
                             "type": "object",
-                            "description": "修改的具体数据。修改请求头时需包含 'key' 和 'value'；修改响应体时需包含 'old_text' 和 'new_text'；阻断请求时可为空对象。",
+                            "description": "修改的具体数据。修改请求头时需包含 'key' 和 'value'；修改响应体时需包含 'old_text' 和 'new_text'；阻断请求时可为空对象；模拟响应时需包含 'body'、'body_file' 或 'packet_id' 之一，可选 'status'、'headers'；修改 JSON 时需包含 'ops'。",
                             "properties": {
                                 "key": {
                                     "type": "string",
@@ -218,9 +309,54 @@ def get_openai_tools():
                                 "new_text": {
                                     "type": "string",
                                     "description": "替换后的新文本（仅在修改响应体时使用）"
+                                },
+                                "status": {
+                                    "type": "integer",
+                                    "description": "模拟响应的状态码，默认 200；使用 packet_id 时默认沿用录包状态码（仅在模拟响应时使用）"
+                                },
+                                "headers": {
+                                    "type": "object",
+                                    "description": "模拟响应的响应头；使用 packet_id 时覆盖录包中的同名头（仅在模拟响应时使用）"
+                                },
+                                "body": {
+                                    "type": "string",
+                                    "description": "模拟响应的内联 body 文本（仅在模拟响应时使用）"
+                                },
+                                "body_file": {
+                                    "type": "string",
+                                    "description": "模拟响应 body 的本地文件路径，文件修改后自动生效（仅在模拟响应时使用）"
+                                },
+                                "packet_id": {
+                                    "type": "string",
+                                    "description": "以该录包的响应（状态码、响应头、完整 body）作为模拟响应（仅在模拟响应时使用）"
+                                },
+                                "ops": {
+                                    "type": "array",
+                                    "description": "JSON 修改操作列表，按顺序执行（仅在修改 JSON 时使用）。path 可写 JSON Pointer（如 /data/items/0/name）或点路径（如 data.items[0].name）；set 的中间节点不存在时自动创建，数组末尾追加用 -。",
+                                    "items": {
+                                        "type": "object",
+                                        "properties": {
+                                            "op": {"type": "string", "enum": ["set", "delete"]},
+                                            "path": {"type": "string"},
+                                            "value": {"description": "set 操作写入的值，可为任意 JSON 类型"}
+                                        },
+                                        "required": ["op", "path"]
+                                    }
                                 }
                             }
                         },
+                        "ttl_seconds": {
+                            "type": "number",
+                            "description": "可选，规则存活秒数，到期后自动移除。临时性的修改建议设置，避免规则堆积。",
+                        },
+                        "max_hits": {
+                            "type": "integer",
+                            "description": "可选，规则命中次数上限，达到后自动失效并移除。",
+                        },
+                        "listener": {
+                            "type": "string",
+                            "description": "可选。规则所属的代理监听器名称（见 proxy_listeners），只作用于该监听器；不填为默认代理使用的全局规则。",
+                        },
                     },
                     "required": ["url_regex", "modification_type", "data"],
                 },
@@ -233,7 +369,12 @@ def get_openai_tools():
                 "description": "清除所有流量拦截规则。当需要重置流量拦截状态时使用。",
                 "parameters": {
                     "type": "object",
-                    "properties": {},
+                    "properties": {
+                        "listener": {
+                            "type": "string",
+                            "description": "可选。只清空该代理监听器的规则集；不填为全局规则。",
+                        },
+                    },
                 },
             },
         },
@@ -241,10 +382,49 @@ def get_openai_tools():
             "type": "function",
             "function": {
                 "name": "list_traffic_rules",
-                "description": "列出所有当前的流量拦截规则。用于查看已设置的拦截规则。",
+                "description": "列出所有当前的流量拦截规则及其运行统计（hits 命中次数、last_hit 最近命中时间、bytes_rewritten 改写字节数、apply_time_ms 执行耗时），以及各阶段匹配耗时。用于查看已设置的规则、发现从未命中或开销大的规则。",
+                "parameters": {
+                    "type": "object",
+                    "properties": {
+                        "listener": {
+                            "type": "string",
+                            "description": "可选。列出该代理监听器的规则集；不填为全局规则。",
+                        },
+                    },
+                },
+            },
+        },
+        {
+            "type": "function",
+            "function": {
+                "name": "dry_run_traffic_rules",
+                "description": "试运行候选流量规则：在已录制的录包上评估这些规则会命中哪些请求，返回每条规则的命中数与样例录包 id，不实际安装规则。添加规则前用于确认 url_regex 范围是否正确。",
                 "parameters": {
                     "type": "object",
-                    "properties": {},
+                    "properties": {
+                        "rules": {
+                            "type": "array",
+                            "description": "候选规则列表，每条格式同 add_traffic_modification 的参数。",
+                            "items": {
+                                "type": "object",
+                                "properties": {
+                                    "url_regex": {"type": "string"},
+                                    "modification_type": {"type": "string"},
+                                    "data": {"type": "object"}
+                                },
+                                "required": ["url_regex", "modification_type"]
+                            }
+                        },
+                        "capture_session": {
+                            "type": "string",
+                            "description": "可选。只评估该采集会话的录包，含义同 list_browser_packets 的 capture_session。",
+                        },
+                        "sample_limit": {
+                            "type": "integer",
+                            "description": "可选。每条规则最多返回几条样例录包 id，默认 10，最大 100。",
+                        },
+                    },
+                    "required": ["rules"],
                 },
             },
         },
@@ -252,17 +432,108 @@ def get_openai_tools():
             "type": "function",
             "function": {
                 "name": "replay_packet",
-                "description": "重发已录制的网络请求（根据 packet_id）。用于测试 API 接口或复现 Bug。",
+                "description": "重发已录制的网络请求（根据 packet_id）。用于测试 API 接口或复现 Bug。通过录制代理重放，请求体为录制的完整内容，流量规则照常生效；新响应录为新录包（返回 new_packet_id，其 replay_of 指向原录包）。结果中的 diff 为与原响应的结构化差异：状态码变化、响应头增删改、长度变化，以及 JSON 按路径或文本按行的 body 差异（按字符预算截断）。",
                 "parameters": {
                     "type": "object",
                     "properties": {
                         "packet_id": {
                             "type": "string",
                             "description": "要重发的录包 ID"
+                        },
+                        "max_diff_chars": {
+                            "type": "integer",
+                            "description": "可选。body 差异最多展示的字符数，默认 2000。"
+                        },
+                        "listener": {
+                            "type": "string",
+                            "description": "可选。按该代理监听器的规则集重放（见 proxy_listeners）；不填使用全局规则。"
                         }
                     },
                     "required": ["packet_id"]
                 }
             },
         },
+        {
+            "type": "function",
+            "function": {
+                "name": "replay_packets",
+                "description": "批量并发重发已录制的请求，用于对比测试：多个录包各重发一次，或同一录包按多组参数变体各重发一次（录包 × 变体）。复用连接池并发发送，可按主机限速。返回紧凑结果表（packet_id、variant、method、url、status、length、time_ms、body_hash、same_body、error），body_hash 相同表示响应体相同，same_body 表示是否与原录包响应体一致。",
+                "parameters": {
+                    "type": "object",
+                    "properties": {
+                        "packet_ids": {
+                            "type": "array",
+                            "items": {"type": "string"},
+                            "description": "要重发的录包 ID 列表"
+                        },
+                        "variations": {
+                            "type": "array",
+                            "description": "可选。参数变体列表，每个录包按每组变体各重发一次（最多 500 个任务）。",
+                            "items": {
+                                "type": "object",
+                                "properties": {
+                                    "method": {"type": "string", "description": "替换请求方法"},
+                                    "url": {"type": "string", "description": "替换完整 URL"},
+                                    "params": {"type": "object", "description": "合并到 query 的参数，值为 null 删除该参数"},
+                                    "headers": {"type": "object", "description": "合并的请求头，值为 null 删除该头"},
+                                    "body": {"type": "string", "description": "替换整个请求体"},
+                                    "ops": {
+                                        "type": "array",
+                                        "description": "对 JSON 请求体执行的操作：[{op: set|delete, path, value}]，path 为 JSON Pointer 或点路径",
+                                        "items": {"type": "object"}
+                                    }
+                                }
+                            }
+                        },
+                        "concurrency": {
+                            "type": "integer",
+                            "description": "可选。最大并发数，默认 8，最大 32。"
+                        },
+                        "per_host_rps": {
+                            "type": "number",
+                            "description": "可选。每个主机每秒最多发出的请求数，不填不限速。"
+                        },
+                        "timeout_seconds": {
+                            "type": "number",
+                            "description": "可选。单个请求超时秒数，默认 30。"
+                        }
+                    },
+                    "required": ["packet_ids"]
+                }
+            },
+        },
+        {
+            "type": "function",
+            "function": {
+                "name": "proxy_listeners",
+                "description": "管理录制代理监听器：在不同端口启动多个代理实例，每个监听器有自己的采集会话与独立规则集，可并行用于不同测试任务而互不干扰。list 列出全部监听器（默认代理为 default，端口 8888），start 启动，stop 停止。",
+                "parameters": {
+                    "type": "object",
+                    "properties": {
+                        "action": {
+                            "type": "string",
+                            "enum": ["list", "start", "stop"],
+                            "description": "操作：list（列出）、start（启动）、stop（停止）"
+                        },
+                        "name": {
+                            "type": "string",
+                            "description": "监听器名称（start / stop 必填），字母、数字、- 与 _"
+                        },
+                        "port": {
+                            "type": "integer",
+                            "description": "监听端口（start 必填）"
+                        },
+                        "capture_session": {
+                            "type": "string",
+                            "description": "可选。录包写入的采集会话，默认与监听器同名"
+                        },
+                        "isolated_rules": {
+                            "type": "boolean",
+                            "description": "可选。是否使用独立规则集，默认 true；false 时与默认代理共用全局规则"
+                        }
+                    },
+                    "required": ["action"]
+                }
+            },
+        },
     ]
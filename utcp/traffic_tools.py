@@ -3,12 +3,24 @@
 流量控制工具：UTCP 工具实现，允许 AI 通过 UTCP 协议控制网络流量。
 支持添加拦截规则、修改请求头/响应体、阻断请求、重发数据包等功能。
 """
-import requests
-from services.traffic_rules import traffic_rules
-from services.browser_packets import get_packet
+import re
 
+from services.traffic_rules import traffic_rules, validate_rule
+from services.browser_packets import get_packet, packet_urls as get_packet_urls
+from services import packet_replay, browser_session, replay_diff
+from services.body_store import to_text
 
-def add_traffic_modification(url_regex: str, modification_type: str, data: dict) -> dict:
+
+def _rules_for(listener: str = None):
+    """监听器对应的规则集，未指定时为全局规则；监听器不存在抛出 ValueError。"""
+    manager = browser_session.get_listener_rules(listener)
+    if manager is None:
+        raise ValueError(f"监听器 {listener} 不存在")
+    return manager
+
+
+def add_traffic_modification(url_regex: str, modification_type: str, data: dict,
+                             ttl_seconds: float = None, max_hits: int = None, listener: str = None) -> dict:
     """
     添加网络流量修改规则
     
@@ -18,9 +30,16 @@ def add_traffic_modification(url_regex: str, modification_type: str, data: dict)
             - 'modify_request_header': 修改请求头
             - 'modify_response_body': 修改响应体
             - 'block_request': 阻断请求
+            - 'mock_response': 代理直接返回模拟响应，不访问上游
+            - 'patch_json_body': 按 JSON Pointer 或点路径 set/delete 响应 JSON
         data: 修改的具体数据：
             - header 修改需包含 'key' 和 'value'
             - body 修改需包含 'old_text' 和 'new_text'
+            - 模拟响应需包含 'body'、'body_file' 或 'packet_id' 之一，可选 'status'、'headers'
+            - JSON 修改需包含 'ops'：[{'op': 'set'|'delete', 'path': ..., 'value': ...}]
+        ttl_seconds: 可选，规则存活秒数，到期后自动移除
+        max_hits: 可选，命中次数上限，达到后自动移除
+        listener: 可选，规则所属的代理监听器（使用独立规则集的监听器），默认全局规则
     
     Returns:
         包含执行结果的字典
@@ -30,103 +49,230 @@ def add_traffic_modification(url_regex: str, modification_type: str, data: dict)
         if not url_regex:
             return {"success": False, "error": "url_regex 不能为空"}
             
-        if modification_type not in ['modify_request_header', 'modify_response_body', 'block_request']:
-            return {"success": False, "error": f"不支持的修改类型: {modification_type}"}
-        
-        # 验证 data 参数
-        if modification_type == 'modify_request_header':
-            if 'key' not in data or 'value' not in data:
-                return {"success": False, "error": "修改请求头需要提供 key 和 value 参数"}
-        elif modification_type == 'modify_response_body':
-            if 'old_text' not in data or 'new_text' not in data:
-                return {"success": False, "error": "修改响应体需要提供 old_text 和 new_text 参数"}
+        # 验证修改类型与 data 参数
+        err = validate_rule(modification_type, data)
+        if err:
+            return {"success": False, "error": err}
         
-        # 添加规则
-        rule_id = traffic_rules.add_rule(modification_type, url_regex, data)
+        try:
+            ttl_seconds = float(ttl_seconds) if ttl_seconds not in (None, "") else None
+            max_hits = int(max_hits) if max_hits not in (None, "") else None
+        except (TypeError, ValueError):
+            return {"success": False, "error": "ttl_seconds 须为数字，max_hits 须为整数"}
+        if (ttl_seconds is not None and ttl_seconds <= 0) or (max_hits is not None and max_hits <= 0):
+            return {"success": False, "error": "ttl_seconds 与 max_hits 须大于 0"}
+
+        # 添加规则（正则在添加时预编译，非法正则直接报错）
+        try:
+            rule_id = _rules_for(listener).add_rule(modification_type, url_regex, data,
+                                             ttl_seconds=ttl_seconds, max_hits=max_hits)
+        except re.error as e:
+            return {"success": False, "error": f"url_regex 不是合法的正则表达式: {e}"}
         
+        details = f"当 URL 匹配 '{url_regex}' 时执行 {modification_type}"
+        if ttl_seconds:
+            details += f"，{ttl_seconds:g} 秒后过期"
+        if max_hits:
+            details += f"，命中 {max_hits} 次后失效"
         return {
             "success": True,
             "message": f"规则已添加，ID: {rule_id}",
-            "details": f"当 URL 匹配 '{url_regex}' 时执行 {modification_type}"
+            "details": details
         }
     except Exception as e:
         return {"success": False, "error": str(e)}
 
 
-def clear_traffic_rules() -> dict:
+def clear_traffic_rules(listener: str = None) -> dict:
     """
     清除所有流量拦截规则
     
+    Args:
+        listener: 可选，只清空该代理监听器的规则集，默认全局规则
+    
     Returns:
         包含执行结果的字典
     """
     try:
-        traffic_rules.clear_rules()
+        _rules_for(listener).clear_rules()
         return {"success": True, "message": "所有拦截规则已清空"}
     except Exception as e:
         return {"success": False, "error": str(e)}
 
 
-def list_traffic_rules() -> dict:
+def list_traffic_rules(listener: str = None) -> dict:
     """
-    列出所有当前的流量拦截规则
+    列出所有当前的流量拦截规则，附带每条规则的命中次数、最近命中时间、改写字节数与执行耗时
+    
+    Args:
+        listener: 可选，列出该代理监听器的规则集，默认全局规则
     
     Returns:
-        包含规则列表的字典
+        包含规则列表与各阶段匹配耗时的字典
     """
     try:
-        rules = traffic_rules.get_rules()
+        manager = _rules_for(listener)
+        rules = manager.get_rules(with_stats=True)
         return {
             "success": True,
             "message": f"当前共有 {len(rules)} 条规则",
-            "data": {"rules": rules, "count": len(rules)}
+            "data": {"rules": rules, "count": len(rules), "matching": manager.get_match_stats()}
         }
     except Exception as e:
         return {"success": False, "error": str(e)}
 
 
-def replay_packet(packet_id: str) -> dict:
+def dry_run_traffic_rules(rules: list, capture_session: str = None, sample_limit: int = 10) -> dict:
+    """
+    试运行候选规则：评估这些规则在已录制的录包上会命中哪些请求，不实际安装规则
+    
+    Args:
+        rules: 候选规则列表，每条含 url_regex（或 regex）、modification_type（或 type）、data
+        capture_session: 可选，只评估该采集会话的录包
+        sample_limit: 每条规则最多返回的样例录包 id 数
+    
+    Returns:
+        包含每条规则命中数与样例录包 id 的字典
+    """
+    try:
+        if not isinstance(rules, list) or not rules:
+            return {"success": False, "error": "rules 须为非空数组"}
+        result = traffic_rules.dry_run(rules, get_packet_urls(capture_session), sample_limit=sample_limit)
+        return {
+            "success": True,
+            "message": f"已在 {result['total_packets']} 条录包上试运行 {len(result['rules'])} 条规则",
+            "data": result
+        }
+    except Exception as e:
+        return {"success": False, "error": str(e)}
+
+
+def replay_packet(packet_id: str, timeout: float = 30, max_diff_chars: int = replay_diff.DEFAULT_MAX_CHARS,
+                  listener: str = None) -> dict:
     """
     重发指定 ID 的数据包
     
+    通过录制代理（mitmproxy 客户端重放）发出，请求体为录制的完整原始字节；
+    流量规则照常生效，新响应录为新录包并以 replay_of 关联原录包。代理不可用时直接发送（规则不生效）。
+    
     Args:
         packet_id: 要重发的录包 ID
+        timeout: 超时秒数
+        max_diff_chars: 与原响应 body 差异的最大展示字符数
+        listener: 可选，按该代理监听器的规则集重放，默认使用全局规则
     
     Returns:
-        包含重发结果的字典，包括新的响应状态码和响应体预览
+        包含重发结果的字典，包括新的响应状态码、新录包 ID、响应体预览及与原录包的结构化差异
     """
-    # 1. 获取原数据包
-    packet = get_packet(packet_id)
-    if not packet:
+    if not get_packet(packet_id):
         return {"error": f"未找到 ID 为 {packet_id} 的数据包"}
 
     try:
-        # 2. 准备请求参数
-        method = packet.get("method", "GET")
-        url = packet.get("url")
-        
-        # 过滤掉一些不适合重发的 header (如 Content-Length, Host)
-        unsafe_headers = ['content-length', 'host', 'connection', 'upgrade-insecure-requests']
-        headers = {k: v for k, v in packet.get("request_headers", {}).items() 
-                   if k.lower() not in unsafe_headers}
-        
-        # 3. 发送请求 (verify=False 忽略 SSL 错误)
-        # 注意：这里我们使用 requests 库模拟重发，而不是通过 mitmproxy 内部重放
-        response = requests.request(
-            method=method,
-            url=url,
-            headers=headers,
-            data=packet.get("request_body_preview"), # 注意：如果是大文件，preview 可能不完整
-            verify=False,
-            timeout=30
-        )
-
-        # 4. 返回结果
-        return {
+        via = "proxy"
+        try:
+            result = browser_session.replay_packet(packet_id, timeout=timeout, listener=listener)
+        except RuntimeError as e:
+            if listener:
+                return {"error": str(e)}
+            # 代理不可用：改为直接发送，不经过规则与录制
+            via = "direct"
+            result = packet_replay.send_direct(packet_id, timeout=timeout)
+        if result is None:
+            return {"error": f"未找到 ID 为 {packet_id} 的数据包"}
+        if result["status"] is None:
+            return {"error": f"重发失败: {result.get('error') or '无响应'}", "new_packet_id": result.get("packet_id")}
+
+        out = {
             "status": "success",
-            "new_response_status": response.status_code,
-            "new_response_body_preview": response.text[:1000] # 截取前1000字符
+            "via": via,
+            "new_response_status": result["status"],
+            "new_response_body_preview": to_text(result["body"], result["content_type"])[:1000],
+            "diff": replay_diff.diff_replay(packet_id, result["status"], result["headers"], result["body"],
+                                            result["content_type"], max_chars=max_diff_chars),
         }
+        if result.get("packet_id"):
+            out["new_packet_id"] = result["packet_id"]
+            out["replay_of"] = packet_id
+        if result.get("error"):
+            out["note"] = result["error"]
+        return out
 
     except Exception as e:
         return {"error": f"重发失败: {str(e)}"}
+
+
+def replay_packets(packet_ids: list, variations: list = None, concurrency: int = 8,
+                   per_host_rps: float = None, timeout: float = 30) -> dict:
+    """
+    批量并发重发录包，用于对比测试
+    
+    Args:
+        packet_ids: 要重发的录包 ID 列表
+        variations: 可选，参数变体列表；每个录包按每组变体各重发一次。
+            变体可含 method、url、params、headers、body、ops（JSON 请求体 set/delete）
+        concurrency: 最大并发数，默认 8，最大 32
+        per_host_rps: 可选，每个主机每秒最多请求数
+        timeout: 单个请求超时秒数
+    
+    Returns:
+        包含紧凑结果表（状态码、长度、耗时、响应体哈希）与汇总的字典
+    """
+    try:
+        if not isinstance(packet_ids, list) or not packet_ids:
+            return {"success": False, "error": "packet_ids 须为非空数组"}
+        if variations is not None and (not isinstance(variations, list) or not all(isinstance(v, dict) for v in variations)):
+            return {"success": False, "error": "variations 须为对象数组"}
+        try:
+            per_host_rps = float(per_host_rps) if per_host_rps not in (None, "") else None
+            timeout = float(timeout) if timeout not in (None, "") else 30
+        except (TypeError, ValueError):
+            return {"success": False, "error": "per_host_rps 与 timeout 须为数字"}
+        if per_host_rps is not None and per_host_rps <= 0:
+            return {"success": False, "error": "per_host_rps 须大于 0"}
+        result = packet_replay.replay_many([str(p).strip() for p in packet_ids], variations,
+                                           concurrency=concurrency, per_host_rps=per_host_rps, timeout=timeout)
+        summary = result["summary"]
+        return {
+            "success": True,
+            "message": f"已重发 {summary['total']} 个请求，耗时 {summary['elapsed_ms']:g} ms",
+            "data": result
+        }
+    except Exception as e:
+        return {"success": False, "error": str(e)}
+
+
+def proxy_listeners(action: str = "list", name: str = None, port: int = None,
+                    capture_session: str = None, isolated_rules: bool = True) -> dict:
+    """
+    管理录制代理监听器：不同端口上的多个代理实例，各自有采集会话与规则集，可并行用于不同测试任务
+    
+    Args:
+        action: list（列出）、start（启动）或 stop（停止）
+        name: 监听器名称（start / stop 必填）
+        port: 监听端口（start 必填）
+        capture_session: 可选，录包写入的采集会话，默认与监听器同名
+        isolated_rules: 是否使用独立的规则集，默认 True；False 时与默认代理共用全局规则
+    
+    Returns:
+        包含执行结果的字典
+    """
+    try:
+        if action == "list":
+            listeners = browser_session.list_listeners()
+            return {"success": True, "message": f"当前共有 {len(listeners)} 个监听器", "data": {"listeners": listeners}}
+        if action == "start":
+            ok, result = browser_session.start_listener(name, port, capture_session=capture_session,
+                                                        isolated_rules=isolated_rules)
+            if not ok:
+                return {"success": False, "error": result}
+            return {"success": True, "message": f"监听器 {result['name']} 已在端口 {result['port']} 启动",
+                    "data": {"listener": result}}
+        if action == "stop":
+            if not name:
+                return {"success": False, "error": "缺少 name"}
+            if not browser_session.stop_listener(name):
+                return {"success": False, "error": f"监听器 {name} 不存在"}
+            return {"success": True, "message": f"监听器 {name} 已停止"}
+        return {"success": False, "error": f"未知操作: {action}"}
+    except Exception as e:
+        return {"success": False, "error": str(e)}